@@ -92,6 +92,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "simple_history.middleware.HistoryRequestMiddleware",
+    "common.middlewares.request_cache.RequestCacheMiddleware",
 ]
 
 # debug toolbar only showed in dev mode
@@ -107,6 +108,27 @@ extra_delay_request = int(os.environ.get("EXTRA_DELAY_REQUEST", "0"))
 if extra_delay_request:
     MIDDLEWARE.append("common.middlewares.delay.DelayMiddleware")
 
+# prescriptions updated in background by the process_prescription_queue command
+PRESCRIPTION_QUEUE_ENABLED = os.environ.get("PRESCRIPTION_QUEUE_ENABLED") == "true"
+
+# history records written in bulk by a background thread once transactions are committed
+HISTORY_WRITER_ASYNC = os.environ.get("HISTORY_WRITER_ASYNC") == "true"
+HISTORY_WRITER_QUEUE_SIZE = int(os.environ.get("HISTORY_WRITER_QUEUE_SIZE", "1000"))
+
+# permissions are cached across requests only with a shared cache backend (e.g.
+# django.core.cache.backends.db.DatabaseCache after createcachetable), with a per-process
+# backend (LocMemCache, DummyCache) they are only cached for the duration of a request
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    }
+}
+# seconds cached permissions are kept in the shared cache backend
+PERMISSIONS_CACHE_TIMEOUT = int(os.environ.get("PERMISSIONS_CACHE_TIMEOUT", "300"))
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 ROOT_URLCONF = "aigle.urls"
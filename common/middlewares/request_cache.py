@@ -0,0 +1,24 @@
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+_request_cache: ContextVar[Optional[Dict[str, Any]]] = ContextVar(
+    "request_cache", default=None
+)
+
+
+def get_request_cache() -> Optional[Dict[str, Any]]:
+    # values memoized for the duration of the current request, None outside requests
+    return _request_cache.get()
+
+
+class RequestCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _request_cache.set({})
+
+        try:
+            return self.get_response(request)
+        finally:
+            _request_cache.reset(token)
@@ -1,53 +1,373 @@
+import copy
 import json
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from django.conf import settings
 from django.db import models
 from django.db.models import JSONField
+from django.utils import timezone
 
-from simple_history.signals import pre_create_historical_record
-from django.db.models.signals import post_save
+from simple_history.manager import HistoryManager
+from simple_history.utils import get_change_reason_from_object
+from simple_history.signals import (
+    post_create_historical_record,
+    pre_create_historical_record,
+)
 from django.dispatch import receiver
 
+from common.models.history_writer import (
+    is_history_writer_enabled,
+    write_historical_records,
+)
 
-@receiver(pre_create_historical_record)
-def track_changed_fields(sender, instance, history_instance, **kwargs):
-    # Get current and previous historical records
-    previous = instance.history.first()
-    current = instance
 
-    # Compare each field in your model to find changes
-    changed_fields = []
-    if previous:
-        for field in instance._meta.fields:
-            field_name = field.name
-            current_value = getattr(current, field_name, None)
-            previous_value = getattr(previous, field_name, None)
+def get_history_snapshot(
+    instance: models.Model, fields: Iterable[models.Field]
+) -> Dict[str, Any]:
+    # mutable values are copied so that in-place changes are detected
+    return {
+        field.attname: copy.deepcopy(value)
+        if isinstance(value, (dict, list))
+        else value
+        for field in fields
+        if (value := instance.__dict__.get(field.attname, models.DEFERRED))
+        is not models.DEFERRED
+    }
+
+
+def get_field_value(
+    instance: models.Model,
+    field: models.Field,
+    value: Any,
+    related_objects: Optional[Dict[Any, models.Model]] = None,
+) -> Any:
+    # foreign keys are recorded as their related objects, as they were before values
+    # were compared by attname. Only changed foreign keys get here, the previous related
+    # object is fetched, the current one is usually cached on the instance. Related
+    # objects prefetched for a batch are looked up by (field name, value).
+    if value is None or not field.is_relation:
+        return value
+
+    instance_field = instance._meta.get_field(field.name)
+    target_attname = instance_field.target_field.attname
+
+    if instance_field.is_cached(instance):
+        related_object = instance_field.get_cached_value(instance)
+
+        if (
+            related_object is not None
+            and getattr(related_object, target_attname) == value
+        ):
+            return related_object
+
+    if related_objects is not None:
+        return related_objects.get((field.name, value), value)
+
+    return (
+        instance_field.related_model._base_manager.filter(
+            **{target_attname: value}
+        ).first()
+        or value
+    )
+
+
+def get_related_objects(
+    model: Type[models.Model],
+    instances_previous_values: Iterable[Tuple[models.Model, Optional[Dict[str, Any]]]],
+    fields: Iterable[models.Field],
+) -> Dict[Any, models.Model]:
+    # related objects of the changed foreign keys of a batch, fetched with one query
+    # per foreign key, keyed by (field name, value)
+    relation_fields = [field for field in fields if field.is_relation]
+    values_map = defaultdict(set)
+
+    for instance, previous_values in instances_previous_values:
+        if previous_values is None:
+            continue
+
+        for field in relation_fields:
+            if field.attname not in previous_values:
+                continue
+
+            current_value = getattr(instance, field.attname, None)
+            previous_value = previous_values[field.attname]
 
             if current_value != previous_value:
-                changed_fields.append(
-                    {
-                        "field": field_name,
-                        "old_value": previous_value,
-                        "new_value": current_value,
-                    }
+                values_map[field.name].update(
+                    value
+                    for value in (previous_value, current_value)
+                    if value is not None
                 )
 
-    # Save the changed fields to the history instance
-    history_instance.changed_fields = json.loads(
-        json.dumps(changed_fields, indent=4, sort_keys=True, default=str)
+    related_objects = {}
+
+    for field in relation_fields:
+        if not values_map[field.name]:
+            continue
+
+        instance_field = model._meta.get_field(field.name)
+        related_objects_map = instance_field.related_model._base_manager.in_bulk(
+            list(values_map[field.name]),
+            field_name=instance_field.target_field.attname,
+        )
+        related_objects.update(
+            {
+                (field.name, value): related_object
+                for value, related_object in related_objects_map.items()
+            }
+        )
+
+    return related_objects
+
+
+def get_changed_fields(
+    instance: models.Model,
+    previous_values: Optional[Dict[str, Any]],
+    fields: Iterable[models.Field],
+    related_objects: Optional[Dict[Any, models.Model]] = None,
+) -> List[Dict[str, Any]]:
+    changed_fields = []
+
+    if previous_values is None:
+        return changed_fields
+
+    for field in fields:
+        if field.attname not in previous_values:
+            continue
+
+        current_value = getattr(instance, field.attname, None)
+        previous_value = previous_values[field.attname]
+
+        if current_value != previous_value:
+            changed_fields.append(
+                {
+                    "field": field.name,
+                    "old_value": get_field_value(
+                        instance, field, previous_value, related_objects
+                    ),
+                    "new_value": get_field_value(
+                        instance, field, current_value, related_objects
+                    ),
+                }
+            )
+
+    return json.loads(json.dumps(changed_fields, indent=4, sort_keys=True, default=str))
+
+
+def get_previous_values(
+    history_model, instance: models.Model, history_type: str
+) -> Optional[Dict[str, Any]]:
+    # values the instance had when it was loaded, for instances built without being
+    # loaded (e.g. in bulk updates) we fall back to the last historical record
+    if history_type == "+":
+        return None
+
+    snapshot = get_instance_history_snapshot(instance)
+
+    if snapshot is not None:
+        return snapshot
+
+    previous = instance.history.first()
+
+    if previous is None:
+        return None
+
+    return get_history_snapshot(previous, history_model.tracked_fields)
+
+
+@receiver(pre_create_historical_record)
+def track_changed_fields(sender, instance, history_instance, **kwargs):
+    if not hasattr(history_instance, "changed_fields"):
+        return
+
+    history_instance.changed_fields = get_changed_fields(
+        instance=instance,
+        previous_values=get_previous_values(
+            sender, instance, history_instance.history_type
+        ),
+        fields=sender.tracked_fields,
     )
 
 
-@receiver(post_save)
-def create_history_record_on_insert(sender, instance, created, **kwargs):
-    if created and hasattr(instance, "history"):
-        try:
-            instance.history.create(history_type="+", history_user=None)
-        except Exception:
-            # Honestly I don't really know why it fails sometimes, it raises an integrity error
-            pass
+@receiver(post_create_historical_record)
+def refresh_history_snapshot(sender, instance, history_instance, **kwargs):
+    if isinstance(instance, HistorySnapshotModelMixin):
+        instance.refresh_history_snapshot(sender.tracked_fields)
 
 
 class HistoriedModelMixin(models.Model):
     changed_fields = JSONField(blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and is_history_writer_enabled():
+            write_historical_records([self], using=kwargs.get("using") or "default")
+            return
+
+        super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+def get_instance_history_snapshot(
+    instance: models.Model,
+) -> Optional[Dict[str, Any]]:
+    if isinstance(instance, HistorySnapshotModelMixin):
+        return instance.get_history_snapshot()
+
+    return None
+
+
+class HistorySnapshotModelMixin(models.Model):
+    # keeps the field values of the instance as loaded from the database, so that
+    # changed fields of history records are computed without querying the history.
+    # Loading only keeps a reference to the loaded row, the snapshot is built when the
+    # instance is saved.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        # mutable values are copied so that in-place changes are detected
+        if any(isinstance(value, (dict, list)) for value in values):
+            values = [
+                copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+                for value in values
+            ]
+
+        instance._history_loaded_row = (field_names, values)
+        return instance
+
+    def get_history_snapshot(self) -> Optional[Dict[str, Any]]:
+        if "_history_snapshot" not in self.__dict__:
+            loaded_row = self.__dict__.get("_history_loaded_row")
+
+            if loaded_row is None:
+                return None
+
+            field_names, values = loaded_row
+            self._history_snapshot = dict(zip(field_names, values))
+
+        return self._history_snapshot
+
+    def refresh_history_snapshot(self, fields: Iterable[models.Field]):
+        self._history_snapshot = get_history_snapshot(self, fields)
+        self.__dict__.pop("_history_loaded_row", None)
+
     class Meta:
         abstract = True
+
+
+class HistoriedHistoryManager(HistoryManager):
+    def bulk_history_create(
+        self,
+        objs,
+        batch_size=None,
+        update=False,
+        default_user=None,
+        default_change_reason="",
+        default_date=None,
+        custom_historical_attrs=None,
+    ):
+        # same as HistoryManager.bulk_history_create, with the changed fields of each
+        # object computed from its snapshot. Last historical records of the objects
+        # without snapshot are fetched with a single query, related objects of the
+        # changed foreign keys with a single query per foreign key. All the history
+        # records are inserted with a single bulk_create.
+        if not getattr(settings, "SIMPLE_HISTORY_ENABLED", True):
+            return
+
+        history_type = "~" if update else "+"
+        tracked_fields = self.model.tracked_fields
+        pk_attname = self.model.instance_type._meta.pk.attname
+
+        previous_values_map = {}
+
+        if update:
+            objs_without_snapshot_ids = [
+                getattr(instance, pk_attname)
+                for instance in objs
+                if get_instance_history_snapshot(instance) is None
+            ]
+
+            if objs_without_snapshot_ids:
+                previous_values_map = {
+                    getattr(previous, pk_attname): get_history_snapshot(
+                        previous, tracked_fields
+                    )
+                    for previous in self.model.objects.filter(
+                        **{f"{pk_attname}__in": objs_without_snapshot_ids}
+                    )
+                    .order_by(pk_attname, "-history_date", "-history_id")
+                    .distinct(pk_attname)
+                }
+
+        instances_previous_values = []
+        for instance in objs:
+            if update:
+                previous_values = get_instance_history_snapshot(instance)
+
+                if previous_values is None:
+                    previous_values = previous_values_map.get(
+                        getattr(instance, pk_attname)
+                    )
+            else:
+                previous_values = None
+
+            instances_previous_values.append((instance, previous_values))
+
+        related_objects = get_related_objects(
+            self.model.instance_type, instances_previous_values, tracked_fields
+        )
+
+        historical_instances = []
+        for instance, previous_values in instances_previous_values:
+            history_user = getattr(
+                instance,
+                "_history_user",
+                default_user or self.model.get_default_history_user(instance),
+            )
+
+            changed_fields = get_changed_fields(
+                instance=instance,
+                previous_values=previous_values,
+                fields=tracked_fields,
+                related_objects=related_objects,
+            )
+
+            # objects updated without any change do not get a history record
+            if update and previous_values is not None and not changed_fields:
+                continue
+
+            row = self.model(
+                history_date=getattr(
+                    instance, "_history_date", default_date or timezone.now()
+                ),
+                history_user=history_user,
+                history_change_reason=get_change_reason_from_object(instance)
+                or default_change_reason,
+                history_type=history_type,
+                changed_fields=changed_fields,
+                **{
+                    field.attname: getattr(instance, field.attname)
+                    for field in tracked_fields
+                },
+                **(custom_historical_attrs or {}),
+            )
+            if hasattr(self.model, "history_relation"):
+                row.history_relation_id = instance.pk
+            historical_instances.append(row)
+
+        if is_history_writer_enabled():
+            write_historical_records(historical_instances, using=self.db or "default")
+            historical_records = historical_instances
+        else:
+            historical_records = self.model.objects.bulk_create(
+                historical_instances, batch_size=batch_size
+            )
+
+        for instance in objs:
+            if isinstance(instance, HistorySnapshotModelMixin):
+                instance.refresh_history_snapshot(tracked_fields)
+
+        return historical_records
@@ -0,0 +1,186 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connections, models, transaction
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WRITER_BATCH_SIZE = 1000
+# records failing to be written twice in a row are put back in the queue this many
+# times before being dropped
+HISTORY_WRITER_MAX_REQUEUES = 3
+HISTORY_WRITER_REQUEUE_DELAY_SECONDS = 1
+
+_STOP = object()
+
+
+class HistoryWriter:
+    # writes historical records in background: records of committed transactions are
+    # put in a bounded queue (writers block when it is full) and a thread inserts
+    # everything available in the queue with one bulk_create per history model
+    def __init__(self, queue_size: int):
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(
+            target=self.run, name="history-writer", daemon=True
+        )
+        self.thread.start()
+
+    def put(self, records: List[models.Model], using: str, requeues: int = 0):
+        self.queue.put((records, using, requeues))
+
+    def run(self):
+        try:
+            while True:
+                items = [self.queue.get()]
+
+                while len(items) < HISTORY_WRITER_BATCH_SIZE:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = any(item is _STOP for item in items)
+                self.write([item for item in items if item is not _STOP])
+
+                for _ in items:
+                    self.queue.task_done()
+
+                if stop:
+                    # records put back in the queue are written before stopping
+                    if self.queue.empty():
+                        return
+
+                    self.queue.put_nowait(_STOP)
+        finally:
+            connections.close_all()
+
+    def write(self, items: List[Tuple[List[models.Model], str, int]]):
+        records_map = defaultdict(list)
+        requeues_map = defaultdict(int)
+
+        for records, using, requeues in items:
+            for record in records:
+                records_map[(type(record), using)].append(record)
+
+            for history_model in {type(record) for record in records}:
+                requeues_map[(history_model, using)] = max(
+                    requeues_map[(history_model, using)], requeues
+                )
+
+        for (history_model, using), records in records_map.items():
+            try:
+                self.write_records(history_model, using, records)
+            except DatabaseError:
+                self.requeue(
+                    history_model, using, records, requeues_map[(history_model, using)]
+                )
+
+    def write_records(self, history_model, using: str, records: List[models.Model]):
+        try:
+            history_model.objects.using(using).bulk_create(
+                records, batch_size=HISTORY_WRITER_BATCH_SIZE
+            )
+        except DatabaseError:
+            logger.warning(
+                "Failed to write %d %s records, retrying with a new connection",
+                len(records),
+                history_model,
+                exc_info=True,
+            )
+            # the connection of the writer thread may be broken (e.g. database
+            # restarted), it is reopened by the retry
+            connections[using].close()
+            history_model.objects.using(using).bulk_create(
+                records, batch_size=HISTORY_WRITER_BATCH_SIZE
+            )
+
+    def requeue(
+        self, history_model, using: str, records: List[models.Model], requeues: int
+    ):
+        if requeues >= HISTORY_WRITER_MAX_REQUEUES:
+            logger.exception(
+                "Failed to write %d %s records, dropping them",
+                len(records),
+                history_model,
+            )
+            return
+
+        logger.warning(
+            "Failed to write %d %s records, putting them back in the queue",
+            len(records),
+            history_model,
+            exc_info=True,
+        )
+        connections[using].close()
+        time.sleep(HISTORY_WRITER_REQUEUE_DELAY_SECONDS)
+
+        # the writer thread is the only consumer of the queue, it can not wait for a
+        # free slot
+        try:
+            self.queue.put_nowait((records, using, requeues + 1))
+        except queue.Full:
+            logger.exception(
+                "Failed to write %d %s records, queue is full, dropping them",
+                len(records),
+                history_model,
+            )
+
+    def flush(self):
+        self.queue.join()
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+_history_writer: Optional[HistoryWriter] = None
+_history_writer_lock = threading.Lock()
+
+
+def get_history_writer() -> HistoryWriter:
+    global _history_writer
+
+    with _history_writer_lock:
+        # forked processes do not inherit the thread, they get their own writer
+        if _history_writer is None or _history_writer.pid != os.getpid():
+            _history_writer = HistoryWriter(
+                queue_size=settings.HISTORY_WRITER_QUEUE_SIZE
+            )
+
+        return _history_writer
+
+
+def is_history_writer_enabled() -> bool:
+    return settings.HISTORY_WRITER_ASYNC
+
+
+def write_historical_records(records: List[models.Model], using: str):
+    # records are only handed to the writer once the transaction is committed, they
+    # are dropped with it on rollback
+    if not records:
+        return
+
+    transaction.on_commit(
+        partial(get_history_writer().put, records, using), using=using
+    )
+
+
+def flush_history_writer():
+    if _history_writer is not None and _history_writer.pid == os.getpid():
+        _history_writer.flush()
+
+
+@atexit.register
+def stop_history_writer():
+    # pending records are written before a clean shutdown
+    if _history_writer is not None and _history_writer.pid == os.getpid():
+        _history_writer.stop()
@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.contrib.gis.geos import GEOSGeometry
+
+from core.utils.tile_math import get_tile_xy
+
+# shards are made of blocks of tiles at this zoom (~10km wide in metropolitan France)
+SHARD_BLOCK_ZOOM = 12
+
+Block = Tuple[int, int]
+
+
+def get_shard_blocks(geometry: GEOSGeometry) -> List[Block]:
+    # blocks intersecting the bounding box, the first one is its top left block
+    xmin, ymin, xmax, ymax = geometry.extent
+    block_x_min, block_y_min = get_tile_xy(lon=xmin, lat=ymax, z=SHARD_BLOCK_ZOOM)
+    block_x_max, block_y_max = get_tile_xy(lon=xmax, lat=ymin, z=SHARD_BLOCK_ZOOM)
+
+    return [
+        (block_x, block_y)
+        for block_x in range(block_x_min, block_x_max + 1)
+        for block_y in range(block_y_min, block_y_max + 1)
+    ]
+
+
+class BlockGroups:
+    # union-find of blocks: blocks spanned by a same detection belong to the same
+    # group, the root of a group is its smallest block so that groups do not depend on
+    # the order of the rows
+    def __init__(self):
+        self.parents: Dict[Block, Block] = {}
+
+    def find(self, block: Block) -> Block:
+        root = block
+
+        while self.parents.get(root, root) != root:
+            root = self.parents[root]
+
+        while block != root:
+            self.parents[block], block = root, self.parents[block]
+
+        return root
+
+    def union(self, blocks: List[Block]):
+        roots = [self.find(block) for block in blocks]
+        root = min(roots)
+
+        for block_root in roots:
+            if block_root != root:
+                self.parents[block_root] = root
+
+
+class DetectionShardWriter:
+    # splits detection rows in spatially disjoint shards written as json lines files.
+    # Blocks spanned by a same detection are grouped and groups are distributed between
+    # shards: detections of different shards can not overlap and each shard keeps the
+    # order of the input rows, so shards imported in parallel give the same result as
+    # a sequential import. Rows are spooled to a file first, groups are only known once
+    # every row has been read.
+    def __init__(self, shards_count: int):
+        self.shards_count = shards_count
+        self.temp_dir = tempfile.TemporaryDirectory(prefix="import_detections_")
+
+        self.spool_file_path = os.path.join(self.temp_dir.name, "rows.jsonl")
+        self.shard_file_paths = [
+            os.path.join(self.temp_dir.name, f"shard_{shard}.jsonl")
+            for shard in range(shards_count)
+        ]
+
+        self.block_groups = BlockGroups()
+        self.shard_rows_counts = [0] * shards_count
+
+    def get_row_block(self, detection_row: Dict[str, Any]) -> Optional[Block]:
+        geometry_raw = detection_row.get("geometry")
+
+        if not geometry_raw:
+            return None
+
+        blocks = get_shard_blocks(GEOSGeometry(geometry_raw))
+        self.block_groups.union(blocks)
+
+        return blocks[0]
+
+    def get_shard(self, block: Optional[Block]) -> int:
+        # rows without geometry are rejected by the import, in any shard
+        if block is None:
+            return 0
+
+        return hash(self.block_groups.find(block)) % self.shards_count
+
+    def write_rows(self, detection_rows: Iterable[Dict[str, Any]]):
+        with open(self.spool_file_path, "w") as spool_file:
+            for detection_row in detection_rows:
+                block = self.get_row_block(detection_row)
+                spool_file.write(json.dumps([block, detection_row], default=str) + "\n")
+
+        shard_files = [open(file_path, "w") for file_path in self.shard_file_paths]
+
+        try:
+            with open(self.spool_file_path, "r") as spool_file:
+                for line in spool_file:
+                    block, detection_row = json.loads(line)
+                    shard = self.get_shard(tuple(block) if block else None)
+
+                    shard_files[shard].write(json.dumps(detection_row) + "\n")
+                    self.shard_rows_counts[shard] += 1
+        finally:
+            for file in shard_files:
+                file.close()
+
+        os.remove(self.spool_file_path)
+
+    def get_shards(self) -> List[Tuple[str, str]]:
+        # (shard name, file path) of the non empty shards, names are stable for a given
+        # input and shards count so that interrupted imports can be resumed per shard
+        return [
+            (self.get_shard_name(shard), file_path)
+            for shard, (file_path, rows_count) in enumerate(
+                zip(self.shard_file_paths, self.shard_rows_counts)
+            )
+            if rows_count
+        ]
+
+    def get_shard_name(self, shard: int) -> str:
+        return f"shard-{shard}-of-{self.shards_count}"
+
+    def cleanup(self):
+        self.temp_dir.cleanup()
+
+
+def read_shard_rows(file_path: str) -> Iterator[Dict[str, Any]]:
+    with open(file_path, "r") as file:
+        for line in file:
+            yield json.loads(line)
@@ -0,0 +1,535 @@
+import csv
+import io
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection, transaction
+
+from core.models.detection import Detection, DetectionSource
+from core.models.detection_data import (
+    DetectionControlStatus,
+    DetectionData,
+    DetectionValidationStatus,
+)
+from core.models.detection_object import DetectionObject
+from core.models.object_type import ObjectType
+from core.models.tile import TILE_DEFAULT_ZOOM
+from core.models.tile_set import TileSet
+from core.models.user import User
+from core.utils.detection import PERCENTAGE_SAME_DETECTION_THRESHOLD
+from core.utils.history import insert_historical_records
+from core.utils.tile import get_tile_xyz
+
+COPY_BATCH_SIZE = 10000
+COPY_NULL = "\\N"
+
+STAGING_COPY_COLUMNS = [
+    "import_id",
+    "score",
+    "address",
+    "object_type_id",
+    "detection_control_status",
+    "detection_validation_status",
+    "detection_prescription_status",
+    "detection_source",
+    "user_reviewed",
+    "tile_x",
+    "tile_y",
+    "created_at",
+    "updated_at",
+    "geometry",
+]
+
+# same rule as core.utils.detection.get_linked_detections, expressed in SQL: used
+# against detections already in the database
+OVERLAP_CONDITION = """
+    ST_Intersects({a}.geometry, {b}.geometry)
+    AND (
+        ST_Area(ST_Intersection({a}.geometry, {b}.geometry))
+            >= ST_Area({a}.geometry) * %(threshold)s
+        OR ST_Area(ST_Intersection({a}.geometry, {b}.geometry))
+            >= ST_Area({b}.geometry) * %(threshold)s
+    )
+"""
+
+# same rule as the in-batch check of the orm loader: the overlap is measured against
+# the area of the new row {a} only
+BATCH_OVERLAP_CONDITION = """
+    ST_Intersects({a}.geometry, {b}.geometry)
+    AND ST_Area(ST_Intersection({a}.geometry, {b}.geometry))
+        > ST_Area({a}.geometry) * %(threshold)s
+"""
+
+
+def to_copy_value(value: Any) -> Any:
+    if value is None:
+        return COPY_NULL
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return value
+
+
+class DetectionStagingLoader:
+    """
+    Buffer validated detection rows and load them by batches: each batch is copied
+    into a temporary staging table with COPY, then detection objects, detection
+    datas, detections and their history are created with set-based
+    INSERT ... SELECT statements. The staging table is dropped with the transaction
+    of the batch, whether it is committed or rolled back.
+    """
+
+    def __init__(
+        self,
+        tile_set: TileSet,
+        batch_id: str,
+        clean_step: bool,
+        user_reviewer: User,
+    ):
+        self.tile_set = tile_set
+        self.batch_id = batch_id
+        self.clean_step = clean_step
+        self.user_reviewer = user_reviewer
+
+        self.table_name = None
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.buffered_rows = 0
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(staging=self.table_name), params)
+            return cursor.rowcount
+
+    def fetchall(self, sql: str, params: Optional[Dict[str, Any]] = None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(staging=self.table_name), params)
+            return cursor.fetchall()
+
+    def create_table(self):
+        self.execute(
+            """
+            CREATE TEMPORARY TABLE {staging} (
+                id bigserial PRIMARY KEY,
+                import_id integer,
+                score double precision,
+                address varchar(255),
+                object_type_id bigint NOT NULL,
+                detection_control_status varchar(255),
+                detection_validation_status varchar(255),
+                detection_prescription_status varchar(255),
+                detection_source varchar(255),
+                user_reviewed boolean NOT NULL DEFAULT false,
+                tile_x integer,
+                tile_y integer,
+                created_at timestamp with time zone,
+                updated_at timestamp with time zone,
+                geometry geometry(Geometry, 4326) NOT NULL,
+                skip boolean NOT NULL DEFAULT false,
+                tile_id bigint,
+                parcel_id bigint,
+                linked_detection_id bigint,
+                detection_object_id bigint,
+                detection_data_id bigint,
+                detection_object_uuid uuid NOT NULL DEFAULT gen_random_uuid(),
+                detection_data_uuid uuid NOT NULL DEFAULT gen_random_uuid(),
+                detection_uuid uuid NOT NULL DEFAULT gen_random_uuid()
+            ) ON COMMIT DROP
+            """
+        )
+
+    def queue_detection(
+        self,
+        geometry: GEOSGeometry,
+        object_type: ObjectType,
+        serialized_detection: Dict[str, Any],
+    ):
+        # tile of the centroid, as in the orm loader
+        tile_x, tile_y, _ = get_tile_xyz(geometry=geometry)
+
+        values = [
+            serialized_detection["id"],
+            serialized_detection["score"],
+            serialized_detection.get("address"),
+            object_type.id,
+            serialized_detection.get("detection_control_status"),
+            serialized_detection.get("detection_validation_status"),
+            serialized_detection.get("detection_prescription_status"),
+            serialized_detection.get("detection_source"),
+            bool(serialized_detection.get("user_reviewed")),
+            tile_x,
+            tile_y,
+            serialized_detection.get("created_at"),
+            serialized_detection.get("updated_at"),
+            geometry.hexewkb.decode(),
+        ]
+        self.writer.writerow([to_copy_value(value) for value in values])
+        self.buffered_rows += 1
+
+    def is_full(self) -> bool:
+        return self.buffered_rows >= COPY_BATCH_SIZE
+
+    def copy_buffer(self):
+        self.buffer.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {self.table_name} ({', '.join(STAGING_COPY_COLUMNS)}) "
+                f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                self.buffer,
+            )
+
+        print(f"Staged detections: {self.buffered_rows}")
+
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.buffered_rows = 0
+
+    def load(self) -> int:
+        # loads the buffered rows, the caller commits them with its checkpoint
+        if not self.buffered_rows:
+            return 0
+
+        self.table_name = f"detection_staging_{uuid.uuid4().hex}"
+
+        with transaction.atomic():
+            self.create_table()
+            self.copy_buffer()
+            self.prepare_staging()
+
+            if self.clean_step:
+                self.skip_duplicates()
+
+            self.resolve_linked_detections()
+            self.resolve_tiles()
+            self.resolve_parcels()
+
+            return self.insert_detections()
+
+    def prepare_staging(self):
+        self.execute(
+            "CREATE INDEX ON {staging} USING gist (geometry); "
+            "CREATE INDEX ON {staging} (object_type_id); "
+            "ANALYZE {staging}"
+        )
+
+    def skip_duplicates(self):
+        # rows overlapping an earlier kept row of the same object type: overlapping
+        # pairs are computed by the database, rows are then kept or skipped in order
+        # as the orm loader does, a row overlapping only skipped rows is kept
+        overlapped_ids_map = defaultdict(list)
+
+        for staging_id, previous_id in self.fetchall(
+            f"""
+            SELECT staging.id, previous.id
+            FROM {{staging}} AS staging
+            JOIN {{staging}} AS previous
+                ON previous.id < staging.id
+                AND previous.object_type_id = staging.object_type_id
+            WHERE {BATCH_OVERLAP_CONDITION.format(a="staging", b="previous")}
+            """,
+            {"threshold": PERCENTAGE_SAME_DETECTION_THRESHOLD},
+        ):
+            overlapped_ids_map[staging_id].append(previous_id)
+
+        skipped_ids = set()
+
+        for staging_id in sorted(overlapped_ids_map):
+            if any(
+                previous_id not in skipped_ids
+                for previous_id in overlapped_ids_map[staging_id]
+            ):
+                skipped_ids.add(staging_id)
+
+        skipped_staging = self.execute(
+            "UPDATE {staging} SET skip = true WHERE id = ANY(%(skipped_ids)s)",
+            {"skipped_ids": list(skipped_ids)},
+        )
+
+        # rows overlapping a detection already imported in this tile set
+        skipped_database = self.execute(
+            f"""
+            UPDATE {{staging}} AS staging
+            SET skip = true
+            WHERE NOT staging.skip
+            AND EXISTS (
+                SELECT 1
+                FROM core_detection AS detection
+                JOIN core_detectionobject AS detection_object
+                    ON detection_object.id = detection.detection_object_id
+                WHERE detection.tile_set_id = %(tile_set_id)s
+                AND detection_object.object_type_id = staging.object_type_id
+                AND {OVERLAP_CONDITION.format(a="staging", b="detection")}
+            )
+            """,
+            {
+                "tile_set_id": self.tile_set.id,
+                "threshold": PERCENTAGE_SAME_DETECTION_THRESHOLD,
+            },
+        )
+
+        print(
+            f"Skipping {skipped_staging + skipped_database} detections already "
+            f"existing in tileset {self.tile_set.name}"
+        )
+
+    def resolve_linked_detections(self):
+        self.execute(
+            f"""
+            UPDATE {{staging}} AS staging
+            SET
+                linked_detection_id = linked.id,
+                detection_object_id = linked.detection_object_id
+            FROM {{staging}} AS source
+            CROSS JOIN LATERAL (
+                SELECT detection.id, detection.detection_object_id
+                FROM core_detection AS detection
+                JOIN core_detectionobject AS detection_object
+                    ON detection_object.id = detection.detection_object_id
+                WHERE detection.tile_set_id <> %(tile_set_id)s
+                AND detection_object.object_type_id = source.object_type_id
+                AND {OVERLAP_CONDITION.format(a="source", b="detection")}
+                ORDER BY
+                    ST_Area(ST_Intersection(detection.geometry, source.geometry)) DESC
+                LIMIT 1
+            ) AS linked
+            WHERE staging.id = source.id
+            AND NOT source.skip
+            """,
+            {
+                "tile_set_id": self.tile_set.id,
+                "threshold": PERCENTAGE_SAME_DETECTION_THRESHOLD,
+            },
+        )
+
+    def resolve_tiles(self):
+        # missing tiles are created
+        self.execute(
+            """
+            INSERT INTO core_tile (x, y, z, geometry, created_at, updated_at)
+            SELECT DISTINCT
+                staging.tile_x,
+                staging.tile_y,
+                %(z)s,
+                ST_Transform(ST_TileEnvelope(%(z)s, staging.tile_x, staging.tile_y), 4326),
+                now(),
+                now()
+            FROM {staging} AS staging
+            WHERE NOT staging.skip
+            ON CONFLICT DO NOTHING
+            """,
+            {"z": TILE_DEFAULT_ZOOM},
+        )
+        self.execute(
+            """
+            UPDATE {staging} AS staging
+            SET tile_id = tile.id
+            FROM core_tile AS tile
+            WHERE NOT staging.skip
+            AND tile.x = staging.tile_x
+            AND tile.y = staging.tile_y
+            AND tile.z = %(z)s
+            """,
+            {"z": TILE_DEFAULT_ZOOM},
+        )
+
+    def resolve_parcels(self):
+        self.execute(
+            """
+            UPDATE {staging} AS staging
+            SET parcel_id = (
+                SELECT parcel.id
+                FROM core_parcel AS parcel
+                WHERE ST_Contains(parcel.geometry, ST_Centroid(staging.geometry))
+                ORDER BY parcel.id
+                LIMIT 1
+            )
+            WHERE NOT staging.skip
+            AND staging.detection_object_id IS NULL
+            """
+        )
+
+    def insert_detections(self) -> int:
+        params = {
+            "batch_id": self.batch_id,
+            "tile_set_id": self.tile_set.id,
+            "user_reviewer_id": self.user_reviewer.id,
+            "default_control_status": DetectionControlStatus.NOT_CONTROLLED,
+            "default_validation_status": DetectionValidationStatus.DETECTED_NOT_VERIFIED,
+            "default_detection_source": DetectionSource.ANALYSIS,
+        }
+
+        # detection objects
+
+        self.execute(
+            """
+            INSERT INTO core_detectionobject (
+                uuid, created_at, updated_at, deleted, batch_id, import_id,
+                address, object_type_id, parcel_id
+            )
+            SELECT
+                staging.detection_object_uuid,
+                COALESCE(staging.created_at, now()),
+                COALESCE(staging.updated_at, now()),
+                false,
+                %(batch_id)s,
+                staging.import_id,
+                staging.address,
+                staging.object_type_id,
+                staging.parcel_id
+            FROM {staging} AS staging
+            WHERE NOT staging.skip
+            AND staging.detection_object_id IS NULL
+            ORDER BY staging.id
+            """,
+            params,
+        )
+        insert_historical_records(
+            DetectionObject,
+            where_sql=f"""uuid IN (
+                SELECT detection_object_uuid FROM {self.table_name}
+                WHERE NOT skip AND detection_object_id IS NULL
+            )""",
+        )
+        self.execute(
+            """
+            UPDATE {staging} AS staging
+            SET detection_object_id = detection_object.id
+            FROM core_detectionobject AS detection_object
+            WHERE NOT staging.skip
+            AND staging.detection_object_id IS NULL
+            AND detection_object.uuid = staging.detection_object_uuid
+            """
+        )
+
+        # linked detection objects without address get the imported one
+
+        self.execute(
+            """
+            CREATE TEMPORARY TABLE {staging}_addresses ON COMMIT DROP AS
+            SELECT DISTINCT ON (staging.detection_object_id)
+                staging.detection_object_id,
+                staging.address
+            FROM {staging} AS staging
+            JOIN core_detectionobject AS detection_object
+                ON detection_object.id = staging.detection_object_id
+            WHERE NOT staging.skip
+            AND staging.linked_detection_id IS NOT NULL
+            AND staging.address IS NOT NULL
+            AND staging.address <> ''
+            AND (detection_object.address IS NULL OR detection_object.address = '')
+            ORDER BY staging.detection_object_id, staging.id
+            """
+        )
+        self.execute(
+            """
+            UPDATE core_detectionobject AS detection_object
+            SET address = addresses.address, updated_at = now()
+            FROM {staging}_addresses AS addresses
+            WHERE detection_object.id = addresses.detection_object_id
+            """
+        )
+        insert_historical_records(
+            DetectionObject,
+            where_sql=f"""id IN (
+                SELECT detection_object_id FROM {self.table_name}_addresses
+            )""",
+            history_type="~",
+        )
+
+        # detection datas: statuses missing in rows are taken from the linked detection
+
+        self.execute(
+            """
+            INSERT INTO core_detectiondata (
+                uuid, created_at, updated_at, deleted,
+                detection_control_status,
+                detection_validation_status,
+                detection_prescription_status,
+                user_last_update_id
+            )
+            SELECT
+                staging.detection_data_uuid,
+                COALESCE(staging.created_at, now()),
+                COALESCE(staging.updated_at, now()),
+                false,
+                COALESCE(
+                    staging.detection_control_status,
+                    linked_detection_data.detection_control_status,
+                    %(default_control_status)s
+                ),
+                COALESCE(
+                    staging.detection_validation_status,
+                    linked_detection_data.detection_validation_status,
+                    %(default_validation_status)s
+                ),
+                staging.detection_prescription_status,
+                CASE WHEN staging.user_reviewed THEN %(user_reviewer_id)s END
+            FROM {staging} AS staging
+            LEFT JOIN core_detection AS linked_detection
+                ON linked_detection.id = staging.linked_detection_id
+            LEFT JOIN core_detectiondata AS linked_detection_data
+                ON linked_detection_data.id = linked_detection.detection_data_id
+            WHERE NOT staging.skip
+            ORDER BY staging.id
+            """,
+            params,
+        )
+        insert_historical_records(
+            DetectionData,
+            where_sql=f"""uuid IN (
+                SELECT detection_data_uuid FROM {self.table_name} WHERE NOT skip
+            )""",
+        )
+        self.execute(
+            """
+            UPDATE {staging} AS staging
+            SET detection_data_id = detection_data.id
+            FROM core_detectiondata AS detection_data
+            WHERE NOT staging.skip
+            AND detection_data.uuid = staging.detection_data_uuid
+            """
+        )
+
+        # detections
+
+        inserted_detections = self.execute(
+            """
+            INSERT INTO core_detection (
+                uuid, created_at, updated_at, deleted, batch_id, import_id,
+                geometry, score, detection_source, auto_prescribed,
+                detection_object_id, detection_data_id, tile_id, tile_set_id
+            )
+            SELECT
+                staging.detection_uuid,
+                COALESCE(staging.created_at, now()),
+                COALESCE(staging.updated_at, now()),
+                false,
+                %(batch_id)s,
+                staging.import_id,
+                staging.geometry,
+                staging.score,
+                COALESCE(staging.detection_source, %(default_detection_source)s),
+                false,
+                staging.detection_object_id,
+                staging.detection_data_id,
+                staging.tile_id,
+                %(tile_set_id)s
+            FROM {staging} AS staging
+            WHERE NOT staging.skip
+            ORDER BY staging.id
+            """,
+            params,
+        )
+        insert_historical_records(
+            Detection,
+            where_sql=f"""uuid IN (
+                SELECT detection_uuid FROM {self.table_name} WHERE NOT skip
+            )""",
+        )
+
+        return inserted_detections
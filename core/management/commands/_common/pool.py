@@ -0,0 +1,47 @@
+import multiprocessing
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+from django.db import connections
+
+from common.models.history_writer import flush_history_writer
+
+
+def _call_with_own_connections(function: Callable, args: Tuple[Any, ...]) -> Any:
+    try:
+        return function(*args)
+    finally:
+        # workers exit without running atexit handlers
+        flush_history_writer()
+        connections.close_all()
+
+
+def _call_with_own_connections_star(function_args: Tuple[Callable, Tuple[Any, ...]]):
+    return _call_with_own_connections(*function_args)
+
+
+def run_in_process_pool(
+    function: Callable, args_list: Iterable[Tuple[Any, ...]], workers: int
+) -> List[Any]:
+    # connections must not be shared with forked workers: they are closed before the
+    # fork so each worker opens its own, the parent reconnects on its next query
+    connections.close_all()
+
+    with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+        return pool.starmap(
+            _call_with_own_connections,
+            [(function, tuple(args)) for args in args_list],
+        )
+
+
+def iter_in_process_pool(
+    function: Callable, args_list: Iterable[Tuple[Any, ...]], workers: int
+) -> Iterator[Any]:
+    # same as run_in_process_pool but results are yielded as soon as they are ready,
+    # in completion order
+    connections.close_all()
+
+    with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+        yield from pool.imap_unordered(
+            _call_with_own_connections_star,
+            [(function, tuple(args)) for args in args_list],
+        )
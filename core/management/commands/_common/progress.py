@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+
+class Progress:
+    def __init__(self, total: int, label: str):
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.start_time = datetime.now()
+
+    def update(self, done: int):
+        self.done += done
+
+        elapsed = datetime.now() - self.start_time
+        eta = (
+            timedelta(
+                seconds=elapsed.total_seconds() / self.done * (self.total - self.done)
+            )
+            if self.done
+            else None
+        )
+
+        print(
+            f"{self.label}: {self.done}/{self.total}, elapsed time: {elapsed}, ETA: {
+                eta if eta is not None else 'unknown'}"
+        )
@@ -1,49 +1,110 @@
+from typing import List, Tuple
 from django.core.management.base import BaseCommand, CommandError
 
+from core.management.commands._common.pool import iter_in_process_pool
+from core.management.commands._common.progress import Progress
 from core.models.detection_object import DetectionObject
 from core.models.object_type import ObjectType
-from core.utils.prescription import compute_prescription
+from core.utils.prescription import compute_prescriptions, compute_prescriptions_sql
 
 BATCH_SIZE = 10000
 
 
+class PrescriptionEngine:
+    PYTHON = "python"
+    SQL = "sql"
+
+
 class Command(BaseCommand):
     help = "Compute prescription statuses for specified object types"
 
     def add_arguments(self, parser):
         parser.add_argument("--object-type-uuids", action="append", required=True)
+        parser.add_argument(
+            "--engine",
+            type=str,
+            choices=[PrescriptionEngine.PYTHON, PrescriptionEngine.SQL],
+            default=PrescriptionEngine.PYTHON,
+        )
+        parser.add_argument("--workers", type=int, default=1)
 
     def handle(self, *args, **options):
         object_type_uuids = list(set(options["object_type_uuids"]))
         object_types = ObjectType.objects.filter(uuid__in=object_type_uuids).all()
+        workers = options["workers"]
 
         if len(object_type_uuids) != len(object_types):
             raise CommandError("Some object types were not found")
 
+        if workers < 1:
+            raise CommandError("--workers must be greater than or equal to 1")
+
         print(f"Starting compute prescription statuses for object types: {
               [ot.name for ot in object_types]}")
 
-        offset = 0
-        total = DetectionObject.objects.filter(object_type__in=object_types).count()
+        object_type_ids = [object_type.id for object_type in object_types]
 
-        while True:
-            detection_objects = (
-                DetectionObject.objects.filter(object_type__in=object_types)
-                .prefetch_related(
-                    "detections", "detections__detection_data", "detections__tile_set"
-                )
-                .all()[offset : offset + BATCH_SIZE]
+        if options["engine"] == PrescriptionEngine.SQL:
+            updated_detections = compute_prescriptions_sql(
+                object_type_ids=object_type_ids
             )
+            print(f"Prescription computation done, updated detections: {
+                  updated_detections}")
+            return
 
-            if not detection_objects:
-                break
-
-            for detection_object in detection_objects:
-                compute_prescription(detection_object)
+        id_ranges = get_detection_object_id_ranges(object_type_ids=object_type_ids)
+        progress = Progress(
+            total=sum(count for _, _, count in id_ranges),
+            label="Computed prescription for detection objects",
+        )
+        args_list = [
+            (object_type_ids, id_min, id_max) for id_min, id_max, _ in id_ranges
+        ]
 
-            offset += len(detection_objects)
+        if workers > 1:
+            results = iter_in_process_pool(
+                compute_prescription_id_range, args_list, workers=workers
+            )
+        else:
+            results = (compute_prescription_id_range(*args) for args in args_list)
 
-            print(f"Computed prescription for detection objects: {
-                  offset}/{total}")
+        for computed_detection_objects in results:
+            progress.update(computed_detection_objects)
 
         print("Prescription computation done")
+
+
+def get_detection_object_id_ranges(
+    object_type_ids: List[int],
+) -> List[Tuple[int, int, int]]:
+    # (id min, id max, count) of batches of BATCH_SIZE detection objects, paginated
+    # on id so each page is an index range scan
+    id_ranges = []
+    last_id = None
+
+    while True:
+        queryset = DetectionObject.objects.filter(object_type_id__in=object_type_ids)
+
+        if last_id is not None:
+            queryset = queryset.filter(id__gt=last_id)
+
+        ids = list(queryset.order_by("id").values_list("id", flat=True)[:BATCH_SIZE])
+
+        if not ids:
+            return id_ranges
+
+        id_ranges.append((ids[0], ids[-1], len(ids)))
+        last_id = ids[-1]
+
+
+def compute_prescription_id_range(
+    object_type_ids: List[int], id_min: int, id_max: int
+) -> int:
+    detection_object_ids = list(
+        DetectionObject.objects.filter(
+            object_type_id__in=object_type_ids, id__gte=id_min, id__lte=id_max
+        ).values_list("id", flat=True)
+    )
+    compute_prescriptions(detection_object_ids)
+
+    return len(detection_object_ids)
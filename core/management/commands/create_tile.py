@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 
 from core.models.tile import TILE_DEFAULT_ZOOM, Tile
 
@@ -15,6 +16,8 @@ class Command(BaseCommand):
         parser.add_argument("--y-max", type=int, required=True)
         parser.add_argument("--z-min", type=int, required=False)
         parser.add_argument("--z-max", type=int, required=False)
+        # generate the tiles in the database, one statement per zoom level
+        parser.add_argument("--server-side", type=bool, default=False)
 
     def handle(self, *args, **options):
         x_min = options["x_min"]
@@ -45,6 +48,14 @@ class Command(BaseCommand):
 
         print(f"Starting insert tiles, total: {self.total}")
 
+        if options["server_side"]:
+            for z in range(z_min, z_max + 1):
+                self.insert_tiles_server_side(
+                    x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max, z=z
+                )
+
+            return
+
         for z in range(z_min, z_max + 1):
             for y in range(y_min, y_max + 1):
                 for x in range(x_min, x_max + 1):
@@ -64,3 +75,34 @@ class Command(BaseCommand):
         self.inserted += len(self.tiles)
         self.tiles = []
         print(f"Inserting tiles: {self.inserted}/{self.total}")
+
+    def insert_tiles_server_side(
+        self, x_min: int, x_max: int, y_min: int, y_max: int, z: int
+    ):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Tile._meta.db_table} (x, y, z, geometry, created_at, updated_at)
+                SELECT
+                    tile_x,
+                    tile_y,
+                    %(z)s,
+                    ST_Transform(ST_TileEnvelope(%(z)s, tile_x, tile_y), 4326),
+                    now(),
+                    now()
+                FROM generate_series(%(x_min)s, %(x_max)s) AS tile_x
+                CROSS JOIN generate_series(%(y_min)s, %(y_max)s) AS tile_y
+                ON CONFLICT (x, y, z) DO NOTHING
+                """,
+                {
+                    "x_min": x_min,
+                    "x_max": x_max,
+                    "y_min": y_min,
+                    "y_max": y_max,
+                    "z": z,
+                },
+            )
+            # tiles already existing are not counted
+            self.inserted += cursor.rowcount
+
+        print(f"Inserting tiles: {self.inserted}/{self.total}")
@@ -1,10 +1,21 @@
 import csv
+import itertools
+import json
+import os
 from datetime import datetime
-from typing import Any, Dict, Iterable
+from typing import Any, Dict, Iterable, List, Optional, Tuple, TypedDict
 from django.core.management.base import BaseCommand, CommandError
 from rest_framework import serializers
-from django.db import connection
+from django.db import connection, transaction
 
+from core.management.commands._common.detection_shards import (
+    DetectionShardWriter,
+    read_shard_rows,
+)
+from core.management.commands._common.detection_staging import (
+    DetectionStagingLoader,
+)
+from core.management.commands._common.pool import run_in_process_pool
 from core.models.detection import Detection, DetectionSource
 from core.models.detection_data import (
     DetectionControlStatus,
@@ -12,24 +23,36 @@ from core.models.detection_data import (
     DetectionPrescriptionStatus,
     DetectionValidationStatus,
 )
+from core.models.detection_import_checkpoint import (
+    DEFAULT_SHARD,
+    DetectionImportCheckpoint,
+)
 from core.models.detection_object import DetectionObject
 from django.contrib.gis.geos import GEOSGeometry
-from django.contrib.gis.db.models.functions import Centroid
 
 
 from core.models.object_type import ObjectType
-from core.models.parcel import Parcel
-from core.models.tile import TILE_DEFAULT_ZOOM, Tile
 from core.models.tile_set import TileSet
 from core.models.user import User
-from core.utils.detection import get_linked_detections
-from core.utils.prescription import compute_prescription
-from core.utils.string import normalize
+from core.utils.detection import get_linked_detections_batch
+from core.utils.parcel import get_parcel_ids
+from core.utils.prescription import compute_prescriptions
+from core.utils.spatial_index import GeometryGridIndex
+from core.utils.serializers import CompiledRowValidator
+from core.utils.string import normalize, slugify
+from core.utils.tile import get_tile_ids, get_tile_xyz
 from simple_history.utils import bulk_create_with_history
 
 PERCENTAGE_SAME_DETECTION_THRESHOLD = 0.5
 USER_REVIEWER_MAIL = "user.reviewer.default.aigle@aigle.beta.gouv.fr"
 INSERT_BATCH_SIZE = 1000
+FETCH_SIZE = 2000
+FILE_BUFFER_SIZE = 1024 * 1024
+
+
+class DetectionLoader:
+    ORM = "orm"
+    COPY = "copy"
 
 
 class DetectionRowSerializer(serializers.Serializer):
@@ -64,12 +87,18 @@ class DetectionRowSerializer(serializers.Serializer):
         default=False,
         allow_null=True,
     )
-    tile_x = serializers.IntegerField(required=False, allow_null=True)
-    tile_y = serializers.IntegerField(required=False, allow_null=True)
     created_at = serializers.DateTimeField(required=False, allow_null=True)
     updated_at = serializers.DateTimeField(required=False, allow_null=True)
 
 
+class DetectionRowToInsert(TypedDict):
+    geometry: GEOSGeometry
+    object_type: ObjectType
+    serialized_detection: Dict[str, Any]
+
+
+DETECTION_ROW_VALIDATOR = CompiledRowValidator(DetectionRowSerializer)
+
 TABLE_COLUMNS = list(DetectionRowSerializer().get_fields().keys()) + ["geometry"]
 TABLE_COLUMNS_DATE = ["created_at", "updated_at"]
 
@@ -89,15 +118,26 @@ class Command(BaseCommand):
         }
         self.user_reviewer = User.objects.get(email=USER_REVIEWER_MAIL)
 
+        self.detection_rows_to_insert = []
+        self.detection_rows_to_insert_index = GeometryGridIndex()
         self.detection_objects_to_insert = []
+        self.detection_object_centroids_to_insert = []
         self.detection_datas_to_insert = []
         self.detections_to_insert = []
 
         self.total_inserted_detections = 0
+        self.processed_rows = 0
+        self.last_import_id = None
+        self.checkpoint = None
+        self.rejects_file = None
+        self.rejects_file_path = None
+        self.total_rejected_rows = 0
 
         self.file = None
+        self.cursor = None
         self.total = None
         self.query_colums = None
+        self.staging_loader = None
 
     def add_arguments(self, parser):
         parser.add_argument("--tile-set-id", type=int, required=True)
@@ -107,6 +147,17 @@ class Command(BaseCommand):
         parser.add_argument("--file-path", type=str)
         parser.add_argument("--table-name", type=str)
         parser.add_argument("--table-schema", type=str, default="import_detections")
+        parser.add_argument(
+            "--loader",
+            type=str,
+            choices=[DetectionLoader.ORM, DetectionLoader.COPY],
+            default=DetectionLoader.ORM,
+        )
+        parser.add_argument("--workers", type=int, default=1)
+        # skip the rows already imported by a previous run with the same batch id
+        parser.add_argument("--resume", type=bool, default=False)
+        # invalid rows are written in this json lines file, default is derived from the batch id
+        parser.add_argument("--rejects-file-path", type=str)
 
     def validate_arguments(self, options):
         if not options.get("file_path") and not options.get("table_name"):
@@ -124,53 +175,78 @@ class Command(BaseCommand):
                 "You can't provide both a file path and a table name with parameter --file-path or --table-name"
             )
 
+        if options["workers"] < 1:
+            raise CommandError("--workers must be greater than or equal to 1")
+
     def get_detection_rows_to_insert_from_file(
         self, file_path: str
     ) -> Iterable[Dict[str, Any]]:
-        self.file = open(file_path, "r")
+        # rows are read lazily, only FILE_BUFFER_SIZE bytes are kept in memory
+        self.file = open(file_path, "r", newline="", buffering=FILE_BUFFER_SIZE)
         reader = csv.DictReader(self.file, delimiter=";", quotechar='"')
         return reader
 
     def get_detection_rows_to_insert_from_table(
         self, table_name: str, table_schema: str, batch_id: str, with_dates: bool
     ) -> Iterable[Dict[str, Any]]:
-        self.cursor = connection.cursor()
-        self.cursor.execute(
-            "SELECT count(*) FROM %s.%s WHERE batch_id = %s"
-            % (table_schema, table_name, f"'{batch_id}'")
-        )
-        self.total = self.cursor.fetchone()[0]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM %s.%s WHERE batch_id = %s"
+                % (table_schema, table_name, f"'{batch_id}'")
+            )
+            self.total = cursor.fetchone()[0]
 
         table_columns = TABLE_COLUMNS
 
         if with_dates:
-            table_columns += TABLE_COLUMNS_DATE
+            table_columns = TABLE_COLUMNS + TABLE_COLUMNS_DATE
 
+        # named server-side cursor: rows are fetched by windows of FETCH_SIZE instead
+        # of loading the whole result set in memory
+        self.cursor = connection.chunked_cursor()
         self.cursor.execute(
-            "SELECT %s FROM %s.%s WHERE batch_id = %s ORDER BY score DESC"
+            "SELECT %s FROM %s.%s WHERE batch_id = %s ORDER BY score DESC, id"
             % (", ".join(table_columns), table_schema, table_name, f"'{batch_id}'")
         )
-        return map(lambda row: dict(zip(table_columns, row)), self.cursor)
+
+        return self.fetch_detection_rows(table_columns)
+
+    def fetch_detection_rows(
+        self, table_columns: List[str]
+    ) -> Iterable[Dict[str, Any]]:
+        while True:
+            rows = self.cursor.fetchmany(FETCH_SIZE)
+
+            if not rows:
+                return
+
+            for row in rows:
+                yield dict(zip(table_columns, row))
 
     def handle(self, *args, **options):
         self.validate_arguments(options)
 
-        tile_set_id = options["tile_set_id"]
         with_dates = options["with_dates"]
-        self.clean_step = options["clean_step"]
-        self.batch_id = options.get("batch_id") or datetime.now().strftime(
+        workers = options["workers"]
+        options["batch_id"] = options.get("batch_id") or datetime.now().strftime(
             "%Y-%m-%dT%H:%M:%SZ"
         )
 
+        self.setup(options)
+
         print(f"Starting importing detections for batch: {self.batch_id}")
 
-        self.tile_set = TileSet.objects.get(id=tile_set_id)
         self.tile_set.last_import_started_at = self.start_time
         self.tile_set.last_import_ended_at = None
         self.tile_set.save()
 
         print(f"TileSet found: {self.tile_set.name}")
 
+        if options["resume"]:
+            self.validate_checkpoints(workers=workers)
+        else:
+            DetectionImportCheckpoint.objects.filter(batch_id=self.batch_id).delete()
+
         if options.get("file_path"):
             detection_rows_to_insert = self.get_detection_rows_to_insert_from_file(
                 file_path=options["file_path"]
@@ -183,25 +259,153 @@ class Command(BaseCommand):
                 with_dates=with_dates,
             )
 
-        for row in detection_rows_to_insert:
-            self.queue_detection(row)
-            self.insert_detections()
+        if workers > 1:
+            self.import_detection_rows_sharded(
+                detection_rows=detection_rows_to_insert,
+                options=options,
+                workers=workers,
+            )
+        else:
+            self.import_detection_rows(detection_rows_to_insert)
+
+        self.compute_prescriptions()
+
+        self.tile_set.last_import_ended_at = datetime.now()
+        self.tile_set.save()
+
+        print(f"Detections import finished for batch: {self.batch_id}")
+
+    def validate_checkpoints(self, workers: int):
+        # shards depend on the number of workers, it can't change between runs
+        shards = DetectionImportCheckpoint.objects.filter(
+            batch_id=self.batch_id
+        ).values_list("shard", flat=True)
 
+        for shard in shards:
+            if (workers > 1 and not shard.endswith(f"-of-{workers}")) or (
+                workers == 1 and shard != DEFAULT_SHARD
+            ):
+                raise CommandError(
+                    f"Import of batch {self.batch_id} can't be resumed with --workers {
+                        workers}, it was started with shard: {shard}"
+                )
+
+    def setup(self, options: Dict[str, Any]):
+        self.tile_set = TileSet.objects.get(id=options["tile_set_id"])
+        self.clean_step = options["clean_step"]
+        self.batch_id = options["batch_id"]
+        self.loader = options["loader"]
+        self.rejects_file_path = (
+            options.get("rejects_file_path")
+            or f"import_detections_rejects_{slugify(self.batch_id)}.jsonl"
+        )
+
+    def close_detection_rows_source(self):
         if self.file:
             self.file.close()
 
         if self.cursor:
             self.cursor.close()
 
+    def close_rejects_file(self):
+        if not self.rejects_file:
+            return
+
+        self.rejects_file.close()
+        self.rejects_file = None
+        print(
+            f"{self.total_rejected_rows} invalid detection rows skipped, see: {
+                self.rejects_file_path}"
+        )
+
+    def import_detection_rows(
+        self, detection_rows: Iterable[Dict[str, Any]], shard: str = DEFAULT_SHARD
+    ):
+        self.checkpoint, _ = DetectionImportCheckpoint.objects.get_or_create(
+            batch_id=self.batch_id,
+            shard=shard,
+            defaults={"tile_set": self.tile_set},
+        )
+        self.processed_rows = self.checkpoint.processed_rows
+
+        if self.processed_rows:
+            print(
+                f"Resuming import of {shard}, skipping {
+                    self.processed_rows} rows already imported"
+            )
+            detection_rows = itertools.islice(detection_rows, self.processed_rows, None)
+
+        if self.loader == DetectionLoader.COPY:
+            self.staging_loader = DetectionStagingLoader(
+                tile_set=self.tile_set,
+                batch_id=self.batch_id,
+                clean_step=self.clean_step,
+                user_reviewer=self.user_reviewer,
+            )
+
+        for row in detection_rows:
+            self.processed_rows += 1
+            self.last_import_id = row.get("id")
+            self.queue_detection(row)
+            self.insert_detections()
+
+        self.close_detection_rows_source()
+        self.close_rejects_file()
+
         self.insert_detections(force=True)
-        self.tile_set.last_import_ended_at = datetime.now()
-        self.tile_set.save()
+        self.staging_loader = None
+
+    def compute_prescriptions(self):
+        # prescriptions are computed once at the end of the import for all the detection
+        # objects of the batch, including the ones imported by a previous interrupted run
+        detection_object_ids = (
+            Detection.objects.filter(batch_id=self.batch_id, tile_set=self.tile_set)
+            .values_list("detection_object_id", flat=True)
+            .distinct()
+        )
 
-        print(f"Detections import finished for batch: {self.batch_id}")
+        print("Computing prescriptions")
+        compute_prescriptions(detection_object_ids)
+
+    def save_checkpoint(self, inserted_detections: int):
+        self.checkpoint.processed_rows = self.processed_rows
+        self.checkpoint.inserted_detections += inserted_detections
+        self.checkpoint.last_import_id = self.last_import_id
+        self.checkpoint.save()
+
+    def import_detection_rows_sharded(
+        self,
+        detection_rows: Iterable[Dict[str, Any]],
+        options: Dict[str, Any],
+        workers: int,
+    ):
+        shard_writer = DetectionShardWriter(shards_count=workers)
+
+        try:
+            shard_writer.write_rows(detection_rows)
+            self.close_detection_rows_source()
+
+            shards = shard_writer.get_shards()
+            print(f"Detections split in {len(shards)} shards")
+
+            shard_options = {
+                key: options[key]
+                for key in ["tile_set_id", "clean_step", "batch_id", "loader"]
+            }
+            shards_inserted_detections = run_in_process_pool(
+                import_detection_shard,
+                [(shard_options, shard, file_path) for shard, file_path in shards],
+                workers=workers,
+            )
+            self.total_inserted_detections += sum(shards_inserted_detections)
+        finally:
+            shard_writer.cleanup()
 
-    def queue_detection(self, detection_row: Dict[str, Any]):
-        # validate input data
+        print(f"Inserted {self.total_inserted_detections} detections in total")
 
+    def parse_detection_row(
+        self, detection_row: Dict[str, Any]
+    ) -> Optional[Tuple[GEOSGeometry, ObjectType, Dict[str, Any]]]:
         geometry_raw = detection_row.pop("geometry")
 
         if not geometry_raw:
@@ -217,102 +421,139 @@ class Command(BaseCommand):
         if not object_type:
             raise CommandError(f"Unknown object type: {object_type_raw}")
 
+        validated_data, errors = DETECTION_ROW_VALIDATOR.validate(detection_row)
+
+        if errors:
+            self.reject_detection_row(detection_row=detection_row, errors=errors)
+            return
+
         geometry = GEOSGeometry(geometry_raw, srid=4326)
 
-        serializer = DetectionRowSerializer(data=detection_row)
-        if not serializer.is_valid():
-            print(
-                f"Invalid detection row: {detection_row}, errors: {
-                    serializer.errors} skipping..."
+        return geometry, object_type, validated_data
+
+    def reject_detection_row(
+        self, detection_row: Dict[str, Any], errors: Dict[str, Any]
+    ):
+        if not self.rejects_file:
+            self.rejects_file = open(self.rejects_file_path, "a")
+
+        self.rejects_file.write(
+            json.dumps(
+                {
+                    "batch_id": self.batch_id,
+                    "shard": self.checkpoint.shard,
+                    "row": detection_row,
+                    "errors": errors,
+                },
+                default=str,
             )
+            + "\n"
+        )
+        self.total_rejected_rows += 1
+
+    def queue_detection(self, detection_row: Dict[str, Any]):
+        # validate input data
+
+        parsed_detection_row = self.parse_detection_row(detection_row)
+
+        if not parsed_detection_row:
             return
 
-        serialized_detection = serializer.validated_data
+        geometry, object_type, serialized_detection = parsed_detection_row
 
-        # get linked detections
+        if self.staging_loader:
+            self.staging_loader.queue_detection(
+                geometry=geometry,
+                object_type=object_type,
+                serialized_detection=serialized_detection,
+            )
+            return
 
         # linked detections in the ones to insert
 
         if self.clean_step:
-            linked_detections_to_insert = [
-                detection
-                for detection in self.detections_to_insert
-                if detection.geometry.intersects(geometry)
-                and detection.detection_object.object_type == object_type
-            ]
-            if linked_detections_to_insert:
-                for linked_detection in linked_detections_to_insert:
+            linked_detection_rows_to_insert = self.detection_rows_to_insert_index.query(
+                key=object_type.id, geometry=geometry
+            )
+            if linked_detection_rows_to_insert:
+                for linked_geometry, _ in linked_detection_rows_to_insert:
                     if (
-                        geometry.intersection(linked_detection.geometry).area
+                        geometry.intersection(linked_geometry).area
                         > geometry.area * PERCENTAGE_SAME_DETECTION_THRESHOLD
-                        or linked_detection.geometry.intersection(geometry).area
+                        or linked_geometry.intersection(geometry).area
                         > geometry.area * PERCENTAGE_SAME_DETECTION_THRESHOLD
                     ):
                         print(f"Detection already exists in tileset {
                             self.tile_set.name} and is going to be inserted. Skipping...")
                         return
 
-        # linked detections already in the database
+        # linked detections already in the database are resolved for the whole batch
+        # when it is flushed, see insert_detections
 
-        # we filter out detections that have too small intersection area with the detection
+        detection_row_to_insert = DetectionRowToInsert(
+            geometry=geometry,
+            object_type=object_type,
+            serialized_detection=serialized_detection,
+        )
+        self.detection_rows_to_insert.append(detection_row_to_insert)
 
         if self.clean_step:
-            linked_detections = get_linked_detections(
-                detection_geometry=geometry,
-                object_type_id=object_type.id,
-                exclude_tile_set_ids=[],
+            self.detection_rows_to_insert_index.insert(
+                key=object_type.id,
+                geometry=geometry,
+                item=detection_row_to_insert,
             )
 
-            # WE DO NOT FILTER OUT DETECTIONS THAT ARE NOT IN THE SAME TILE SET ANYMORE
+    def resolve_linked_detections(
+        self, detection_rows: List[DetectionRowToInsert]
+    ) -> List[Tuple[DetectionRowToInsert, Optional[Detection]]]:
+        geometries_object_type_ids = [
+            (detection_row["geometry"], detection_row["object_type"].id)
+            for detection_row in detection_rows
+        ]
 
-            # deal with linked detections
+        if self.clean_step:
+            # WE DO NOT FILTER OUT DETECTIONS THAT ARE NOT IN THE SAME TILE SET ANYMORE
 
-            linked_detection_same_tileset = next(
-                (
-                    detection
-                    for detection in linked_detections
-                    if detection.tile_set.id == self.tile_set.id
-                ),
-                None,
+            linked_detections_same_tileset = get_linked_detections_batch(
+                detection_geometries_object_type_ids=geometries_object_type_ids,
+                exclude_tile_set_ids=[],
+                tile_set_ids=[self.tile_set.id],
             )
+            detection_rows_not_existing = []
 
-            if linked_detection_same_tileset:
-                print(f"Detection already exists in tileset {self.tile_set.name}, id: {
-                      linked_detection_same_tileset.id}. Skipping...")
-                return
-        else:
-            linked_detections = get_linked_detections(
-                detection_geometry=geometry,
-                object_type_id=object_type.id,
-                exclude_tile_set_ids=[self.tile_set.id],
-            )
+            for detection_row, linked_detection_same_tileset in zip(
+                detection_rows, linked_detections_same_tileset
+            ):
+                if linked_detection_same_tileset:
+                    print(f"Detection already exists in tileset {self.tile_set.name}, id: {
+                          linked_detection_same_tileset.id}. Skipping...")
+                    continue
 
-        # create detection
+                detection_rows_not_existing.append(detection_row)
 
-        centroid = Centroid(geometry)
-        tile = Tile.objects.filter(
-            geometry__contains=centroid, z=TILE_DEFAULT_ZOOM
-        ).first()
+            detection_rows = detection_rows_not_existing
+            geometries_object_type_ids = [
+                (detection_row["geometry"], detection_row["object_type"].id)
+                for detection_row in detection_rows
+            ]
 
-        if not tile:
-            if serialized_detection.get("tile_x") and serialized_detection.get(
-                "tile_y"
-            ):
-                tile = Tile.objects.filter(
-                    x=serialized_detection["tile_x"],
-                    y=serialized_detection["tile_y"],
-                    z=TILE_DEFAULT_ZOOM,
-                ).first()
-
-                if not tile:
-                    tile = Tile.objects.create(
-                        x=serialized_detection["tile_x"],
-                        y=serialized_detection["tile_y"],
-                        z=TILE_DEFAULT_ZOOM,
-                    )
-            else:
-                print("Tile not found for detection, skipping...")
-                return
+        linked_detections = get_linked_detections_batch(
+            detection_geometries_object_type_ids=geometries_object_type_ids,
+            exclude_tile_set_ids=[self.tile_set.id],
+        )
+
+        return list(zip(detection_rows, linked_detections))
+
+    def create_detection(
+        self,
+        detection_row: DetectionRowToInsert,
+        linked_detection: Optional[Detection],
+        tile_id: int,
+    ):
+        geometry = detection_row["geometry"]
+        object_type = detection_row["object_type"]
+        serialized_detection = detection_row["serialized_detection"]
 
         # detection data
 
@@ -333,8 +574,7 @@ class Command(BaseCommand):
 
         # detection object
 
-        if linked_detections:
-            linked_detection = linked_detections[0]
+        if linked_detection:
             detection_object = linked_detection.detection_object
 
             if not detection_object.address and serialized_detection["address"]:
@@ -351,10 +591,9 @@ class Command(BaseCommand):
                     linked_detection.detection_data.detection_validation_status
                 )
         else:
-            parcel = Parcel.objects.filter(geometry__contains=centroid).first()
+            # parcels are resolved for the whole batch, see resolve_parcels
             detection_object = DetectionObject(
                 object_type=object_type,
-                parcel=parcel,
                 address=serialized_detection["address"],
                 batch_id=self.batch_id,
                 import_id=serialized_detection["id"],
@@ -362,6 +601,7 @@ class Command(BaseCommand):
                 updated_at=serialized_detection.get("updated_at"),
             )
             self.detection_objects_to_insert.append(detection_object)
+            self.detection_object_centroids_to_insert.append(geometry.centroid)
 
             if not detection_data.detection_control_status:
                 detection_data.detection_control_status = (
@@ -381,7 +621,7 @@ class Command(BaseCommand):
             detection_source=serialized_detection["detection_source"]
             or DetectionSource.ANALYSIS,
             auto_prescribed=False,
-            tile=tile,
+            tile_id=tile_id,
             tile_set=self.tile_set,
             detection_data=detection_data,
             batch_id=self.batch_id,
@@ -395,27 +635,55 @@ class Command(BaseCommand):
         self.detection_datas_to_insert.append(detection_data)
         self.detections_to_insert.append(detection)
 
-    def insert_detections(self, force=False):
-        if (
-            not force
-            and len(self.detections_to_insert) < INSERT_BATCH_SIZE
-            and len(self.detection_datas_to_insert) < INSERT_BATCH_SIZE
-            and len(self.detection_objects_to_insert) < INSERT_BATCH_SIZE
+    def resolve_parcels(self):
+        # one point-in-polygon join for the centroids of all new detection objects
+        parcel_ids = get_parcel_ids(self.detection_object_centroids_to_insert)
+
+        for detection_object, parcel_id in zip(
+            self.detection_objects_to_insert, parcel_ids
         ):
+            detection_object.parcel_id = parcel_id
+
+    def insert_detections(self, force=False):
+        if self.staging_loader:
+            self.load_staged_detections(force=force)
             return
 
-        print(f"Inserting {len(self.detections_to_insert)} detections")
+        if not force and len(self.detection_rows_to_insert) < INSERT_BATCH_SIZE:
+            return
 
-        bulk_create_with_history(self.detection_objects_to_insert, DetectionObject)
-        bulk_create_with_history(self.detection_datas_to_insert, DetectionData)
-        bulk_create_with_history(self.detections_to_insert, Detection)
+        # the batch and the checkpoint are committed together, an interrupted import
+        # can be resumed after the last committed batch
+        with transaction.atomic():
+            detection_rows_linked_detections = self.resolve_linked_detections(
+                self.detection_rows_to_insert
+            )
 
-        detection_objects = [
-            detection.detection_object for detection in self.detections_to_insert
-        ]
+            # tiles are computed from the centroids, missing ones are created
+            tile_xyzs = [
+                get_tile_xyz(geometry=detection_row["geometry"])
+                for detection_row, _ in detection_rows_linked_detections
+            ]
+            tile_ids_map = get_tile_ids(tile_xyzs)
 
-        for detection_object in detection_objects:
-            compute_prescription(detection_object)
+            for (detection_row, linked_detection), tile_xyz in zip(
+                detection_rows_linked_detections, tile_xyzs
+            ):
+                self.create_detection(
+                    detection_row=detection_row,
+                    linked_detection=linked_detection,
+                    tile_id=tile_ids_map[tile_xyz],
+                )
+
+            self.resolve_parcels()
+
+            print(f"Inserting {len(self.detections_to_insert)} detections")
+
+            bulk_create_with_history(self.detection_objects_to_insert, DetectionObject)
+            bulk_create_with_history(self.detection_datas_to_insert, DetectionData)
+            bulk_create_with_history(self.detections_to_insert, Detection)
+
+            self.save_checkpoint(len(self.detections_to_insert))
 
         self.total_inserted_detections += len(self.detections_to_insert)
 
@@ -431,5 +699,33 @@ class Command(BaseCommand):
         print(f"Elapsed time: {datetime.now() - self.start_time}")
 
         self.detection_objects_to_insert = []
+        self.detection_object_centroids_to_insert = []
         self.detection_datas_to_insert = []
         self.detections_to_insert = []
+        self.detection_rows_to_insert = []
+        self.detection_rows_to_insert_index.clear()
+
+    def load_staged_detections(self, force=False):
+        if not force and not self.staging_loader.is_full():
+            return
+
+        # same as the orm loader: the batch and the checkpoint are committed together
+        with transaction.atomic():
+            inserted_detections = self.staging_loader.load()
+            self.save_checkpoint(inserted_detections)
+
+        self.total_inserted_detections += inserted_detections
+        print(f"Inserted {self.total_inserted_detections} detections in total")
+        print(f"Elapsed time: {datetime.now() - self.start_time}")
+
+
+def import_detection_shard(options: Dict[str, Any], shard: str, file_path: str) -> int:
+    # runs in a worker process, with its own connection and batch buffers
+    command = Command()
+    command.setup(options)
+    # each worker writes its own rejects file
+    root, ext = os.path.splitext(command.rejects_file_path)
+    command.rejects_file_path = f"{root}_{shard}{ext}"
+    command.import_detection_rows(read_shard_rows(file_path), shard=shard)
+
+    return command.total_inserted_detections
@@ -0,0 +1,336 @@
+import re
+from datetime import date
+from typing import List
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from simple_history.utils import get_history_model_for_model
+
+from core.models.detection import Detection
+from core.models.detection_data import DetectionData
+
+HISTORIED_MODELS = {
+    "detection": Detection,
+    "detection_data": DetectionData,
+}
+
+# detached partitions are moved to this schema, they can be dumped and dropped from there
+ARCHIVE_SCHEMA = "history_archive"
+MONTHS_AHEAD = 3
+
+
+def get_partition_name(table: str, month_start: date) -> str:
+    return f"{table}_p{month_start:%Y%m}"
+
+
+def get_default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+class Command(BaseCommand):
+    help = "Partition historical tables by month of history_date, archive old partitions and compact no-op records"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--models",
+            nargs="+",
+            choices=list(HISTORIED_MODELS.keys()),
+            default=list(HISTORIED_MODELS.keys()),
+        )
+        parser.add_argument(
+            "--partition",
+            type=bool,
+            default=False,
+            help="Convert the historical tables to partitioned tables. Each table is "
+            "locked in ACCESS EXCLUSIVE mode, blocking reads and writes, until all its "
+            "records are copied, run it during a maintenance window",
+        )
+        parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+        # partitions of the months ending before this date are archived
+        parser.add_argument("--archive-before", type=date.fromisoformat)
+        parser.add_argument("--compact", type=bool, default=False)
+
+    def handle(self, *args, **options):
+        for model_name in options["models"]:
+            history_model = get_history_model_for_model(HISTORIED_MODELS[model_name])
+            table = history_model._meta.db_table
+
+            if options["partition"] and not self.is_partitioned(table):
+                self.partition_table(table, months_ahead=options["months_ahead"])
+                print(f"Partitioned {table}")
+
+            if self.is_partitioned(table):
+                self.create_partitions_ahead(
+                    table, months_ahead=options["months_ahead"]
+                )
+            elif options["archive_before"]:
+                raise CommandError(
+                    f"{table} is not partitioned, run the command with --partition"
+                )
+
+            if options["archive_before"]:
+                archived_partitions = self.archive_partitions(
+                    table, before=options["archive_before"]
+                )
+                print(f"Archived partitions of {table}: {archived_partitions}")
+
+            if options["compact"]:
+                deleted_records = self.compact(history_model)
+                print(f"Deleted no-op records of {table}: {deleted_records}")
+
+    def is_partitioned(self, table: str) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM pg_partitioned_table
+                    WHERE partrelid = to_regclass(%s)
+                )
+                """,
+                [table],
+            )
+            return cursor.fetchone()[0]
+
+    def partition_table(self, table: str, months_ahead: int):
+        unpartitioned_table = f"{table}_unpartitioned"
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {unpartitioned_table}")
+
+            cursor.execute(
+                """
+                SELECT pg_get_indexdef(indexrelid)
+                FROM pg_index
+                WHERE indrelid = to_regclass(%s) AND NOT indisprimary
+                """,
+                [unpartitioned_table],
+            )
+            index_definitions = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute(
+                """
+                SELECT conname, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE conrelid = to_regclass(%s) AND contype = 'f'
+                """,
+                [unpartitioned_table],
+            )
+            foreign_keys = cursor.fetchall()
+
+            # serial sequences are owned by the column of the unpartitioned table,
+            # identity columns get a new sequence
+            cursor.execute(
+                """
+                SELECT pg_get_serial_sequence(%(table)s, 'history_id'), attidentity <> ''
+                FROM pg_attribute
+                WHERE attrelid = to_regclass(%(table)s) AND attname = 'history_id'
+                """,
+                {"table": unpartitioned_table},
+            )
+            history_id_sequence, history_id_is_identity = cursor.fetchone()
+
+            # the partition key must be part of the primary key
+            cursor.execute(
+                f"""
+                CREATE TABLE {table} (
+                    LIKE {unpartitioned_table} INCLUDING DEFAULTS INCLUDING IDENTITY,
+                    PRIMARY KEY (history_id, history_date)
+                ) PARTITION BY RANGE (history_date)
+                """
+            )
+            cursor.execute(
+                f"""
+                CREATE TABLE {get_default_partition_name(table)}
+                PARTITION OF {table} DEFAULT
+                """
+            )
+
+            cursor.execute(
+                f"SELECT date_trunc('month', min(history_date))::date FROM {unpartitioned_table}"
+            )
+            first_month_start = cursor.fetchone()[0] or date.today().replace(day=1)
+
+            for month_start in self.get_months(first_month_start, months_ahead):
+                self.create_partition(cursor, table, month_start)
+
+            cursor.execute(f"INSERT INTO {table} SELECT * FROM {unpartitioned_table}")
+
+            if history_id_sequence and not history_id_is_identity:
+                cursor.execute(
+                    f"ALTER SEQUENCE {history_id_sequence} OWNED BY {table}.history_id"
+                )
+
+            cursor.execute(
+                f"""
+                SELECT setval(
+                    pg_get_serial_sequence(%s, 'history_id'),
+                    COALESCE((SELECT max(history_id) FROM {table}), 0) + 1,
+                    false
+                )
+                """,
+                [table],
+            )
+
+            cursor.execute(f"DROP TABLE {unpartitioned_table}")
+
+            for index_definition in index_definitions:
+                cursor.execute(
+                    re.sub(
+                        r" ON (ONLY )?\S+ USING ",
+                        f" ON {table} USING ",
+                        index_definition,
+                    )
+                )
+
+            for constraint_name, constraint_definition in foreign_keys:
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {constraint_name} {constraint_definition}"
+                )
+
+    def get_months(self, first_month_start: date, months_ahead: int) -> List[date]:
+        last_month_start = date.today().replace(day=1) + relativedelta(
+            months=months_ahead
+        )
+        months = []
+        month_start = first_month_start
+
+        while month_start <= last_month_start:
+            months.append(month_start)
+            month_start += relativedelta(months=1)
+
+        return months
+
+    def create_partitions_ahead(self, table: str, months_ahead: int):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for month_start in self.get_months(
+                date.today().replace(day=1), months_ahead
+            ):
+                self.create_partition(cursor, table, month_start)
+
+    def create_partition(self, cursor, table: str, month_start: date):
+        partition = get_partition_name(table, month_start)
+        default_partition = get_default_partition_name(table)
+        month_end = month_start + relativedelta(months=1)
+
+        cursor.execute(
+            f"""
+            SELECT
+                to_regclass(%(partition)s) IS NOT NULL
+                OR to_regclass(%(archived_partition)s) IS NOT NULL,
+                EXISTS (
+                    SELECT 1 FROM {default_partition}
+                    WHERE history_date >= %(month_start)s
+                    AND history_date < %(month_end)s
+                )
+            """,
+            {
+                "partition": partition,
+                "archived_partition": f"{ARCHIVE_SCHEMA}.{partition}",
+                "month_start": month_start,
+                "month_end": month_end,
+            },
+        )
+        partition_exists, default_partition_has_records = cursor.fetchone()
+
+        if partition_exists:
+            return
+
+        # records of the month already in the default partition are moved to the new
+        # partition, it can not be created otherwise
+        if default_partition_has_records:
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default_partition}")
+
+        cursor.execute(
+            f"""
+            CREATE TABLE {partition} PARTITION OF {table}
+            FOR VALUES FROM (%s) TO (%s)
+            """,
+            [month_start, month_end],
+        )
+
+        if default_partition_has_records:
+            cursor.execute(
+                f"""
+                WITH moved_records AS (
+                    DELETE FROM {default_partition}
+                    WHERE history_date >= %s AND history_date < %s
+                    RETURNING *
+                )
+                INSERT INTO {table} SELECT * FROM moved_records
+                """,
+                [month_start, month_end],
+            )
+            cursor.execute(
+                f"ALTER TABLE {table} ATTACH PARTITION {default_partition} DEFAULT"
+            )
+
+    def archive_partitions(self, table: str, before: date) -> List[str]:
+        archived_partitions = []
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+            cursor.execute(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = to_regclass(%s)
+                ORDER BY child.relname
+                """,
+                [table],
+            )
+            partitions = [row[0] for row in cursor.fetchall()]
+
+            for partition in partitions:
+                match = re.fullmatch(rf"{table}_p(\d{{4}})(\d{{2}})", partition)
+
+                if not match:
+                    continue
+
+                month_start = date(int(match.group(1)), int(match.group(2)), 1)
+
+                if month_start + relativedelta(months=1) > before:
+                    continue
+
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+                cursor.execute(f"ALTER TABLE {partition} SET SCHEMA {ARCHIVE_SCHEMA}")
+                archived_partitions.append(partition)
+
+        return archived_partitions
+
+    def compact(self, history_model) -> int:
+        # update records leaving the tracked fields as they were in the previous record
+        # of the same object are removed, auto_now fields change on every save
+        table = history_model._meta.db_table
+        columns = [
+            connection.ops.quote_name(field.column)
+            for field in history_model.tracked_fields
+            if not getattr(field, "auto_now", False)
+        ]
+        no_op_sql = " AND ".join(
+            [
+                f"{column} IS NOT DISTINCT FROM lag({column}) OVER object_records"
+                for column in columns
+            ]
+        )
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {table} AS history
+                USING (
+                    SELECT history_id, history_date, history_type, {no_op_sql} AS no_op
+                    FROM {table}
+                    WINDOW object_records AS (
+                        PARTITION BY id ORDER BY history_date, history_id
+                    )
+                ) AS records
+                WHERE records.no_op
+                AND records.history_type = '~'
+                AND history.history_id = records.history_id
+                AND history.history_date = records.history_date
+                """
+            )
+            return cursor.rowcount
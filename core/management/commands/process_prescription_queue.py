@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.utils.prescription import compute_prescriptions, dequeue_prescriptions
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Compute prescription statuses of the detection objects in the prescription queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        # keep waiting for new items once the queue is empty
+        parser.add_argument("--loop", type=bool, default=False)
+        parser.add_argument("--sleep-seconds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        while True:
+            computed_detection_objects = self.process_queue(batch_size=batch_size)
+
+            if computed_detection_objects:
+                print(
+                    f"Computed prescription for detection objects: {
+                        computed_detection_objects}"
+                )
+
+            if not options["loop"]:
+                break
+
+            time.sleep(options["sleep_seconds"])
+
+    def process_queue(self, batch_size: int) -> int:
+        computed_detection_objects = 0
+
+        while True:
+            # items are only removed from the queue if the computation succeeds
+            with transaction.atomic():
+                detection_object_ids = dequeue_prescriptions(batch_size=batch_size)
+                compute_prescriptions(detection_object_ids)
+
+            if not detection_object_ids:
+                return computed_detection_objects
+
+            computed_detection_objects += len(detection_object_ids)
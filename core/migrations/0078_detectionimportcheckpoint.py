@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0077_historicaluser"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DetectionImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("batch_id", models.CharField(max_length=255)),
+                ("shard", models.CharField(default="main", max_length=255)),
+                ("processed_rows", models.IntegerField(default=0)),
+                ("inserted_detections", models.IntegerField(default=0)),
+                ("last_import_id", models.BigIntegerField(null=True)),
+                (
+                    "tile_set",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="detection_import_checkpoints",
+                        to="core.tileset",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("batch_id", "shard"), name="batch_id_shard_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0078_detectionimportcheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PrescriptionQueueItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "detection_object",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="prescription_queue_item",
+                        to="core.detectionobject",
+                    ),
+                ),
+            ],
+        ),
+    ]
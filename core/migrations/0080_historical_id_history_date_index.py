@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:00
+
+from django.db import migrations
+
+# history of one object ordered by date, created on the parent table when history is
+# partitioned (see partition_history command) so each partition keeps its own index
+HISTORY_TABLES = ["core_historicaldetection", "core_historicaldetectiondata"]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0079_prescriptionqueueitem"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX IF NOT EXISTS {table}_id_history_date ON {table} (id, history_date DESC)",
+            reverse_sql=f"DROP INDEX IF EXISTS {table}_id_history_date",
+        )
+        for table in HISTORY_TABLES
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:30
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0080_historical_id_history_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usergroup",
+            name="union_geometry",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, null=True, srid=4326
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE core_usergroup AS user_group
+            SET union_geometry = (
+                SELECT ST_Union(geo_zone.geometry)
+                FROM core_usergroup_geo_zones AS user_group_geo_zone
+                JOIN core_geozone AS geo_zone
+                    ON geo_zone.id = user_group_geo_zone.geozone_id
+                WHERE user_group_geo_zone.usergroup_id = user_group.id
+            )
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:00
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0081_usergroup_union_geometry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tileset",
+            name="coverage_geometry",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, null=True, srid=4326
+            ),
+        ),
+        migrations.AddField(
+            model_name="tileset",
+            name="coverage_geometry_simplified",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, null=True, spatial_index=False, srid=4326
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE core_tileset AS tile_set
+            SET coverage_geometry = coverage.geometry,
+                coverage_geometry_simplified = ST_SimplifyPreserveTopology(
+                    coverage.geometry, 0.0001
+                )
+            FROM (
+                SELECT
+                    tile_set_geo_zone.tileset_id,
+                    ST_Union(geo_zone.geometry) AS geometry
+                FROM core_tileset_geo_zones AS tile_set_geo_zone
+                JOIN core_geozone AS geo_zone
+                    ON geo_zone.id = tile_set_geo_zone.geozone_id
+                GROUP BY tile_set_geo_zone.tileset_id
+            ) AS coverage
+            WHERE coverage.tileset_id = tile_set.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -20,3 +20,6 @@ from .user_group import UserGroup, UserUserGroup
 from .parcel import Parcel
 
 from .analytic_log import AnalyticLog
+
+from .detection_import_checkpoint import DetectionImportCheckpoint
+from .prescription_queue_item import PrescriptionQueueItem
@@ -3,7 +3,11 @@ from django.db import models
 
 from common.constants.models import DEFAULT_MAX_LENGTH
 from common.models.deletable import DeletableModelMixin
-from common.models.historied import HistoriedModelMixin
+from common.models.historied import (
+    HistoriedHistoryManager,
+    HistoriedModelMixin,
+    HistorySnapshotModelMixin,
+)
 from common.models.importable import ImportableModelMixin
 from common.models.timestamped import TimestampedModelMixin
 from common.models.uuid import UuidModelMixin
@@ -23,7 +27,11 @@ class DetectionSource(models.TextChoices):
 
 
 class Detection(
-    TimestampedModelMixin, UuidModelMixin, DeletableModelMixin, ImportableModelMixin
+    TimestampedModelMixin,
+    UuidModelMixin,
+    DeletableModelMixin,
+    ImportableModelMixin,
+    HistorySnapshotModelMixin,
 ):
     geometry = models_gis.GeometryField()
     score = models.FloatField(
@@ -51,7 +59,9 @@ class Detection(
         TileSet, related_name="detections", on_delete=models.CASCADE
     )
 
-    history = HistoricalRecords(bases=[HistoriedModelMixin])
+    history = HistoricalRecords(
+        bases=[HistoriedModelMixin], history_manager=HistoriedHistoryManager
+    )
 
     class Meta:
         indexes = UuidModelMixin.Meta.indexes + [
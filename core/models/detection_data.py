@@ -3,7 +3,11 @@ from django.db import models
 
 from common.constants.models import DEFAULT_MAX_LENGTH
 from common.models.deletable import DeletableModelMixin
-from common.models.historied import HistoriedModelMixin
+from common.models.historied import (
+    HistoriedHistoryManager,
+    HistoriedModelMixin,
+    HistorySnapshotModelMixin,
+)
 from common.models.timestamped import TimestampedModelMixin
 from common.models.uuid import UuidModelMixin
 from simple_history.models import HistoricalRecords
@@ -38,7 +42,12 @@ class DetectionPrescriptionStatus(models.TextChoices):
     NOT_PRESCRIBED = "NOT_PRESCRIBED", "NOT_PRESCRIBED"
 
 
-class DetectionData(TimestampedModelMixin, UuidModelMixin, DeletableModelMixin):
+class DetectionData(
+    TimestampedModelMixin,
+    UuidModelMixin,
+    DeletableModelMixin,
+    HistorySnapshotModelMixin,
+):
     detection_control_status = models.CharField(
         max_length=DEFAULT_MAX_LENGTH,
         choices=DetectionControlStatus.choices,
@@ -58,7 +67,9 @@ class DetectionData(TimestampedModelMixin, UuidModelMixin, DeletableModelMixin):
         on_delete=models.SET_NULL,
         null=True,
     )
-    history = HistoricalRecords(bases=[HistoriedModelMixin])
+    history = HistoricalRecords(
+        bases=[HistoriedModelMixin], history_manager=HistoriedHistoryManager
+    )
 
     class Meta:
         indexes = UuidModelMixin.Meta.indexes + [
@@ -0,0 +1,32 @@
+from django.db import models
+
+
+from common.constants.models import DEFAULT_MAX_LENGTH
+from common.models.timestamped import TimestampedModelMixin
+
+
+from core.models.tile_set import TileSet
+
+DEFAULT_SHARD = "main"
+
+
+class DetectionImportCheckpoint(TimestampedModelMixin):
+    # progress of an import_detections run, saved in the same transaction as each
+    # flushed batch so an interrupted import can be resumed
+    batch_id = models.CharField(max_length=DEFAULT_MAX_LENGTH)
+    shard = models.CharField(max_length=DEFAULT_MAX_LENGTH, default=DEFAULT_SHARD)
+    tile_set = models.ForeignKey(
+        TileSet,
+        related_name="detection_import_checkpoints",
+        on_delete=models.CASCADE,
+    )
+    processed_rows = models.IntegerField(default=0)
+    inserted_detections = models.IntegerField(default=0)
+    last_import_id = models.BigIntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["batch_id", "shard"], name="batch_id_shard_unique"
+            ),
+        ]
@@ -3,7 +3,11 @@ from django.db import models
 
 from common.constants.models import DEFAULT_MAX_LENGTH
 from common.models.deletable import DeletableModelMixin
-from common.models.historied import HistoriedModelMixin
+from common.models.historied import (
+    HistoriedHistoryManager,
+    HistoriedModelMixin,
+    HistorySnapshotModelMixin,
+)
 from common.models.importable import ImportableModelMixin
 from common.models.timestamped import TimestampedModelMixin
 from common.models.uuid import UuidModelMixin
@@ -14,7 +18,11 @@ from simple_history.models import HistoricalRecords
 
 
 class DetectionObject(
-    TimestampedModelMixin, UuidModelMixin, DeletableModelMixin, ImportableModelMixin
+    TimestampedModelMixin,
+    UuidModelMixin,
+    DeletableModelMixin,
+    ImportableModelMixin,
+    HistorySnapshotModelMixin,
 ):
     address = models.CharField(max_length=DEFAULT_MAX_LENGTH, null=True)
     comment = models.TextField(null=True)
@@ -31,7 +39,9 @@ class DetectionObject(
     geo_custom_zones = models.ManyToManyField(
         GeoCustomZone, related_name="detection_objects"
     )
-    history = HistoricalRecords(bases=[HistoriedModelMixin])
+    history = HistoricalRecords(
+        bases=[HistoriedModelMixin], history_manager=HistoriedHistoryManager
+    )
 
     class Meta:
         indexes = UuidModelMixin.Meta.indexes + []
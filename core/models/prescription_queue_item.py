@@ -0,0 +1,15 @@
+from django.db import models
+
+
+from core.models.detection_object import DetectionObject
+
+
+class PrescriptionQueueItem(models.Model):
+    # detection objects whose prescription has to be recomputed, drained by the
+    # process_prescription_queue command
+    created_at = models.DateTimeField(auto_now_add=True)
+    detection_object = models.OneToOneField(
+        DetectionObject,
+        related_name="prescription_queue_item",
+        on_delete=models.CASCADE,
+    )
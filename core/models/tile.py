@@ -4,19 +4,31 @@ from django.db import models
 from common.models.timestamped import TimestampedModelMixin
 from django.contrib.gis.db import models as models_gis
 from django.core.validators import MinValueValidator
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import Polygon
 
-from core.utils.postgis import ST_TileEnvelope
+from core.utils.tile_math import get_tile_envelopes
 
 TILE_DEFAULT_ZOOM = 19
 
 
+def get_tile_geometry(envelope) -> Polygon:
+    # same ring as ST_Transform(ST_TileEnvelope(z, x, y), 4326)
+    xmin, ymin, xmax, ymax = envelope
+    return Polygon(
+        ((xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)),
+        srid=4326,
+    )
+
+
 class TileManager(models_gis.Manager):
     def bulk_create(self, objs, **kwargs):
-        for obj in objs:
-            obj.geometry = GEOSGeometry(ST_TileEnvelope(z=obj.z, x=obj.x, y=obj.y))
+        objs = list(objs)
+        envelopes = get_tile_envelopes([(obj.x, obj.y, obj.z) for obj in objs])
+
+        for obj, envelope in zip(objs, envelopes):
+            obj.geometry = get_tile_geometry(envelope)
 
-        super().bulk_create(objs, **kwargs)
+        return super().bulk_create(objs, **kwargs)
 
 
 class Tile(TimestampedModelMixin):
@@ -36,5 +48,6 @@ class Tile(TimestampedModelMixin):
     geometry = models_gis.GeometryField()
 
     def save(self, *args, **kwargs):
-        self.geometry = GEOSGeometry(ST_TileEnvelope(z=self.z, x=self.x, y=self.y))
+        [envelope] = get_tile_envelopes([(self.x, self.y, self.z)])
+        self.geometry = get_tile_geometry(envelope)
         super(Tile, self).save(*args, **kwargs)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.gis.db import models as models_gis
 
 
 from common.constants.models import DEFAULT_MAX_LENGTH
@@ -47,6 +48,12 @@ class TileSet(TimestampedModelMixin, UuidModelMixin, DeletableModelMixin):
     max_zoom = models.IntegerField(validators=[MinValueValidator(0)], null=True)
 
     geo_zones = models.ManyToManyField(GeoZone, related_name="tile_sets")
+    # union of geo_zones geometries and its simplified version for display, maintained
+    # by core.signals
+    coverage_geometry = models_gis.GeometryField(null=True, blank=True)
+    coverage_geometry_simplified = models_gis.GeometryField(
+        null=True, blank=True, spatial_index=False
+    )
 
     last_import_started_at = models.DateTimeField(null=True)
     last_import_ended_at = models.DateTimeField(null=True)
@@ -13,7 +13,11 @@ from common.models.uuid import UuidModelMixin
 from core.managers.user import UserManager
 from django.contrib.gis.db import models as models_gis
 from simple_history.models import HistoricalRecords
-from common.models.historied import HistoriedModelMixin
+from common.models.historied import (
+    HistoriedHistoryManager,
+    HistoriedModelMixin,
+    HistorySnapshotModelMixin,
+)
 
 
 class UserRole(models.TextChoices):
@@ -28,6 +32,7 @@ class User(
     TimestampedModelMixin,
     UuidModelMixin,
     DeletableModelMixin,
+    HistorySnapshotModelMixin,
 ):
     email = models.EmailField(
         unique=True,
@@ -57,4 +62,6 @@ class User(
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["user_role"]
 
-    history = HistoricalRecords(bases=[HistoriedModelMixin])
+    history = HistoricalRecords(
+        bases=[HistoriedModelMixin], history_manager=HistoriedHistoryManager
+    )
@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.gis.db import models as models_gis
 
 
 from common.constants.models import DEFAULT_MAX_LENGTH
@@ -33,6 +34,8 @@ class UserGroup(TimestampedModelMixin, UuidModelMixin, DeletableModelMixin):
         max_length=DEFAULT_MAX_LENGTH,
         choices=UserGroupType.choices,
     )
+    # union of geo_zones geometries, maintained by core.signals
+    union_geometry = models_gis.GeometryField(null=True, blank=True)
 
     class Meta:
         indexes = UuidModelMixin.Meta.indexes + []
@@ -9,7 +9,6 @@ from core.models.detection_object import DetectionObject
 from core.models.geo_custom_zone import GeoCustomZone
 from core.models.object_type import ObjectType
 from core.models.parcel import Parcel
-from core.models.tile import TILE_DEFAULT_ZOOM, Tile
 from core.models.tile_set import TileSet
 from core.models.user_group import UserGroupRight
 from core.serializers import UuidTimestampedModelSerializerMixin
@@ -20,11 +19,11 @@ from rest_framework import serializers
 
 from core.serializers.tile import TileSerializer
 from core.serializers.tile_set import TileSetMinimalSerializer
-from django.contrib.gis.db.models.functions import Centroid
 
 from core.utils.data_permissions import get_user_group_rights
-from core.utils.detection import get_linked_detections
-from core.utils.prescription import compute_prescription
+from core.utils.detection import get_linked_detections_batch
+from core.utils.prescription import schedule_prescription
+from core.utils.tile import get_tile_id
 
 
 class DetectionMinimalSerializer(
@@ -152,7 +151,7 @@ class DetectionInputSerializer(DetectionSerializer):
 
     def create(self, validated_data):
         user = self.context["request"].user
-        centroid = Centroid(validated_data["geometry"])
+        centroid = validated_data["geometry"].centroid
 
         get_user_group_rights(
             user=user, points=[centroid], raise_if_has_no_right=UserGroupRight.WRITE
@@ -175,12 +174,7 @@ class DetectionInputSerializer(DetectionSerializer):
                     f"Tile set with following uuid not found: {tile_set_uuid}"
                 )
 
-        tile = Tile.objects.filter(
-            geometry__contains=centroid, z=TILE_DEFAULT_ZOOM
-        ).first()
-
-        if not tile:
-            raise serializers.ValidationError("Tile not found for specified geometry")
+        tile_id = get_tile_id(geometry=validated_data["geometry"])
 
         if not detection_object_uuid:
             detection_object_data = validated_data.pop("detection_object", None)
@@ -201,14 +195,15 @@ class DetectionInputSerializer(DetectionSerializer):
 
             # search for existing detection object
 
-            linked_detections = get_linked_detections(
-                detection_geometry=validated_data["geometry"],
-                object_type_id=object_type.id,
+            [linked_detection] = get_linked_detections_batch(
+                detection_geometries_object_type_ids=[
+                    (validated_data["geometry"], object_type.id)
+                ],
                 exclude_tile_set_ids=[tile_set.id],
             )
 
-            if linked_detections:
-                detection_object = linked_detections[0].detection_object
+            if linked_detection:
+                detection_object = linked_detection.detection_object
             else:
                 # get tile_set and tile
 
@@ -281,13 +276,12 @@ class DetectionInputSerializer(DetectionSerializer):
         if tile_set:
             instance.tile_set = tile_set
 
-        if tile:
-            instance.tile = tile
+        instance.tile_id = tile_id
 
         instance.save()
 
         # update prescription
-        compute_prescription(detection_object)
+        schedule_prescription(detection_object)
 
         return instance
 
@@ -300,7 +294,7 @@ class DetectionUpdateSerializer(DetectionSerializer):
 
     def update(self, instance: Detection, validated_data):
         user = self.context["request"].user
-        centroid = Centroid(instance.geometry)
+        centroid = instance.geometry.centroid
 
         get_user_group_rights(
             user=user, points=[centroid], raise_if_has_no_right=UserGroupRight.WRITE
@@ -318,9 +312,10 @@ class DetectionUpdateSerializer(DetectionSerializer):
                 )
 
             instance.detection_object.object_type = object_type
+            instance.detection_object.save()
 
             # update prescription
-            compute_prescription(instance.detection_object)
+            schedule_prescription(instance.detection_object)
 
         instance.save()
 
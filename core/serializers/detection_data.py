@@ -7,7 +7,6 @@ from core.models.detection import Detection
 from core.models.tile_set import TileSet, TileSetType
 from core.models.user_group import UserGroupRight
 from core.serializers import UuidTimestampedModelSerializerMixin
-from django.contrib.gis.db.models.functions import Centroid
 from dateutil.relativedelta import relativedelta
 from simple_history.utils import bulk_create_with_history
 from rest_framework import serializers
@@ -40,7 +39,7 @@ class DetectionDataInputSerializer(DetectionDataSerializer):
 
     def update(self, instance: DetectionData, validated_data):
         user = self.context["request"].user
-        centroid = Centroid(instance.detection.geometry)
+        centroid = instance.detection.geometry.centroid
 
         get_user_group_rights(
             user=user, points=[centroid], raise_if_has_no_right=UserGroupRight.WRITE
@@ -75,16 +74,22 @@ class DetectionDataInputSerializer(DetectionDataSerializer):
             )
 
             if tile_sets:
-                detections_to_insert = []
-
-                for tile_set in tile_sets:
-                    detection_data = DetectionData(
+                detection_datas_to_insert = [
+                    DetectionData(
                         detection_control_status=instance.detection.detection_data.detection_control_status,
                         detection_validation_status=instance.detection.detection_data.detection_validation_status,
                         detection_prescription_status=DetectionPrescriptionStatus.PRESCRIBED,
                         user_last_update=user,
                     )
-                    detection_data.save()
+                    for _ in tile_sets
+                ]
+                bulk_create_with_history(detection_datas_to_insert, DetectionData)
+
+                detections_to_insert = []
+
+                for tile_set, detection_data in zip(
+                    tile_sets, detection_datas_to_insert
+                ):
                     detection = Detection(
                         geometry=instance.detection.geometry,
                         score=1,
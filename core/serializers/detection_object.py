@@ -6,7 +6,6 @@ from core.models.object_type import ObjectType
 from core.models.tile_set import TileSet, TileSetType
 from core.models.user_group import UserGroupRight
 from core.serializers import UuidTimestampedModelSerializerMixin
-from django.contrib.gis.db.models.functions import Centroid
 
 from core.serializers.detection import (
     DetectionWithTileMinimalSerializer,
@@ -19,7 +18,7 @@ from rest_framework import serializers
 from core.serializers.tile_set import TileSetMinimalSerializer
 from core.serializers.user_group import UserGroupSerializer
 from core.utils.data_permissions import get_user_group_rights, get_user_tile_sets
-from core.utils.prescription import compute_prescription
+from core.utils.prescription import schedule_prescription
 
 
 class DetectionObjectMinimalSerializer(UuidTimestampedModelSerializerMixin):
@@ -212,7 +211,7 @@ class DetectionObjectDetailSerializer(DetectionObjectSerializer):
 
     def get_user_group_rights(self, obj: DetectionObject):
         user = self.context["request"].user
-        point = Centroid(obj.detections.first().geometry)
+        point = obj.detections.first().geometry.centroid
 
         return get_user_group_rights(user=user, points=[point])
 
@@ -237,7 +236,7 @@ class DetectionObjectInputSerializer(DetectionObjectSerializer):
                 )
 
         user = self.context["request"].user
-        centroid = Centroid(instance.detections.first().geometry)
+        centroid = instance.detections.first().geometry.centroid
 
         get_user_group_rights(
             user=user, points=[centroid], raise_if_has_no_right=UserGroupRight.WRITE
@@ -245,13 +244,15 @@ class DetectionObjectInputSerializer(DetectionObjectSerializer):
 
         if object_type:
             instance.object_type = object_type
-            compute_prescription(instance)
 
         for key, value in validated_data.items():
             setattr(instance, key, value)
 
         instance.save()
 
+        if object_type:
+            schedule_prescription(instance)
+
         return instance
 
 
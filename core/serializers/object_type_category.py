@@ -9,6 +9,7 @@ from core.serializers import UuidTimestampedModelSerializerMixin
 from rest_framework import serializers
 
 from core.serializers.object_type import ObjectTypeSerializer
+from core.utils.data_permissions import invalidate_object_types
 
 
 class ObjectTypeCategorySerializer(UuidTimestampedModelSerializerMixin):
@@ -136,5 +137,7 @@ def set_object_type_category_object_types(
     )
     previous_object_type_category_object_types.delete()
     ObjectTypeCategoryObjectType.objects.bulk_create(object_type_category_object_types)
+    # bulk_create does not send the signals invalidating cached object types
+    invalidate_object_types()
 
     return object_type_category_object_types
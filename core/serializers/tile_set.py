@@ -79,7 +79,7 @@ class TileSetDetailSerializer(TileSetSerializer):
     class Meta(TileSetSerializer.Meta):
         fields = TileSetSerializer.Meta.fields + ["geometry"]
 
-    geometry = GeometryField(read_only=True)
+    geometry = GeometryField(read_only=True, source="coverage_geometry_simplified")
 
 
 class TileSetInputSerializer(TileSetSerializer):
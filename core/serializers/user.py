@@ -7,6 +7,7 @@ from rest_framework import serializers
 
 from core.models.user import UserRole
 from core.models.user_group import UserGroup, UserUserGroup
+from core.utils.user_group import invalidate_user_user_groups
 
 UserModel = get_user_model()
 
@@ -135,6 +136,9 @@ class UserInputSerializer(UserSerializer):
 
             UserUserGroup.objects.bulk_create(new_user_user_groups)
 
+            # bulk operations do not send the signals invalidating cached permissions
+            invalidate_user_user_groups(instance.id)
+
         for key, value in validated_data.items():
             setattr(instance, key, value)
 
@@ -0,0 +1,127 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.models.geo_zone import GeoZone
+from core.models.object_type import ObjectType
+from core.models.object_type_category import (
+    ObjectTypeCategory,
+    ObjectTypeCategoryObjectType,
+)
+from core.models.tile_set import TileSet
+from core.models.user_group import UserGroup, UserUserGroup
+from core.utils.data_permissions import invalidate_object_types
+from core.utils.tile_set import (
+    get_geo_zone_tile_set_ids,
+    invalidate_tile_sets,
+    refresh_tile_sets_coverage_geometry,
+)
+from core.utils.user_group import (
+    get_geo_zone_user_group_ids,
+    invalidate_user_groups,
+    invalidate_user_user_groups,
+    refresh_user_groups_union_geometry,
+)
+
+
+def refresh_geo_zones_geometries(
+    instance, action, reverse, pk_set, get_geo_zone_ids, refresh, fields
+):
+    # reverse side: instance is a geo zone, its relations are only known before a clear
+    if action == "pre_clear" and reverse:
+        instance._cleared_ids = get_geo_zone_ids([instance.id])
+        return
+
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+
+    if not reverse:
+        refresh([instance.id])
+        # the instance is usually saved again after its zones are set
+        instance.refresh_from_db(fields=fields)
+    elif action == "post_clear":
+        refresh(getattr(instance, "_cleared_ids", []))
+    else:
+        refresh(pk_set)
+
+
+@receiver(m2m_changed, sender=UserGroup.geo_zones.through)
+def refresh_user_group_geo_zones(sender, instance, action, reverse, pk_set, **kwargs):
+    refresh_geo_zones_geometries(
+        instance,
+        action,
+        reverse,
+        pk_set,
+        get_geo_zone_ids=get_geo_zone_user_group_ids,
+        refresh=refresh_user_groups_union_geometry,
+        fields=["union_geometry"],
+    )
+
+
+@receiver(m2m_changed, sender=TileSet.geo_zones.through)
+def refresh_tile_set_geo_zones(sender, instance, action, reverse, pk_set, **kwargs):
+    refresh_geo_zones_geometries(
+        instance,
+        action,
+        reverse,
+        pk_set,
+        get_geo_zone_ids=get_geo_zone_tile_set_ids,
+        refresh=refresh_tile_sets_coverage_geometry,
+        fields=["coverage_geometry", "coverage_geometry_simplified"],
+    )
+
+
+@receiver(post_save)
+def refresh_geo_zone_geometries(sender, instance, created, **kwargs):
+    # geo zones have several concrete subclasses (communes, departments...)
+    if created or not isinstance(instance, GeoZone):
+        return
+
+    refresh_user_groups_union_geometry(get_geo_zone_user_group_ids([instance.id]))
+    refresh_tile_sets_coverage_geometry(get_geo_zone_tile_set_ids([instance.id]))
+
+
+@receiver(pre_delete)
+def get_deleted_geo_zone_relations(sender, instance, **kwargs):
+    if isinstance(instance, GeoZone):
+        instance._deleted_user_group_ids = get_geo_zone_user_group_ids([instance.id])
+        instance._deleted_tile_set_ids = get_geo_zone_tile_set_ids([instance.id])
+
+
+@receiver(post_delete)
+def refresh_deleted_geo_zone_geometries(sender, instance, **kwargs):
+    if isinstance(instance, GeoZone):
+        refresh_user_groups_union_geometry(
+            getattr(instance, "_deleted_user_group_ids", [])
+        )
+        refresh_tile_sets_coverage_geometry(
+            getattr(instance, "_deleted_tile_set_ids", [])
+        )
+
+
+@receiver(post_save, sender=UserUserGroup)
+@receiver(post_delete, sender=UserUserGroup)
+def invalidate_user_user_group(sender, instance, **kwargs):
+    invalidate_user_user_groups(instance.user_id)
+
+
+@receiver(post_save, sender=TileSet)
+@receiver(post_delete, sender=TileSet)
+def invalidate_tile_set(sender, instance, **kwargs):
+    invalidate_tile_sets()
+
+
+@receiver(post_save, sender=UserGroup)
+@receiver(post_delete, sender=UserGroup)
+def invalidate_user_group(sender, instance, **kwargs):
+    invalidate_user_groups()
+
+
+@receiver(post_save, sender=ObjectType)
+@receiver(post_delete, sender=ObjectType)
+@receiver(post_save, sender=ObjectTypeCategory)
+@receiver(post_delete, sender=ObjectTypeCategory)
+@receiver(post_save, sender=ObjectTypeCategoryObjectType)
+@receiver(post_delete, sender=ObjectTypeCategoryObjectType)
+@receiver(m2m_changed, sender=UserGroup.object_type_categories.through)
+def invalidate_object_type(sender, instance, **kwargs):
+    invalidate_object_types()
@@ -1 +1,1803 @@
-# Create your tests here.
+import csv
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models.query import QuerySet
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer
+from rest_framework.test import APIClient
+from simple_history.utils import bulk_update_with_history
+from unittest import mock
+
+from common.middlewares.request_cache import RequestCacheMiddleware
+from common.models.history_writer import flush_history_writer
+from core.management.commands._common.detection_shards import (
+    SHARD_BLOCK_ZOOM,
+    DetectionShardWriter,
+    read_shard_rows,
+)
+from core.management.commands.compute_prescription import (
+    get_detection_object_id_ranges,
+)
+from core.management.commands.create_tile import Command as CreateTileCommand
+from core.management.commands.process_prescription_queue import (
+    Command as ProcessPrescriptionQueueCommand,
+)
+from core.management.commands.import_detections import (
+    DETECTION_ROW_VALIDATOR,
+    USER_REVIEWER_MAIL,
+    DetectionLoader,
+    DetectionRowSerializer,
+)
+from core.models.detection import Detection, DetectionSource
+from core.models.detection_data import (
+    DetectionControlStatus,
+    DetectionData,
+    DetectionPrescriptionStatus,
+    DetectionValidationStatus,
+)
+from core.models.detection_import_checkpoint import (
+    DEFAULT_SHARD,
+    DetectionImportCheckpoint,
+)
+from core.models.detection_object import DetectionObject
+from core.models.geo_commune import GeoCommune
+from core.models.geo_department import GeoDepartment
+from core.models.geo_region import GeoRegion
+from core.models.object_type import ObjectType
+from core.models.parcel import Parcel
+from core.models.prescription_queue_item import PrescriptionQueueItem
+from core.models.tile_set import TileSet, TileSetScheme, TileSetStatus, TileSetType
+from core.models.user import User, UserRole
+from core.models.user_group import UserGroup, UserGroupRight, UserUserGroup
+from core.serializers.detection import DetectionMinimalSerializer
+from core.serializers.detection_data import DetectionDataInputSerializer
+from core.models.tile import Tile
+from core.utils.cache import bump_cache_version, get_or_set_versioned
+from core.utils.data_permissions import (
+    get_user_group_rights_by_point,
+    get_user_object_types_with_status,
+    get_user_tile_sets,
+)
+from core.utils.prescription import (
+    compute_prescriptions,
+    compute_prescriptions_sql,
+    enqueue_prescriptions,
+    schedule_prescription,
+)
+from core.utils.geo import quantize_bbox
+from core.utils.geojson import iter_detections_geojson
+from core.utils.mvt import MVT_CONTENT_TYPE, MVT_LAYER_NAME
+from core.utils.spatial_index import GRID_ZOOM, GeometryGridIndex
+from core.utils.tile import clear_tile_ids_cache, get_tile_id
+from core.utils.tile_math import get_tile_envelope, get_tile_lon, get_tile_xy
+from core.utils.user_group import get_user_union_geometry
+
+IMPORT_ROWS_COLUMNS = ["id", "score", "address", "object_type", "geometry"]
+
+
+def get_rectangle(xmin: float, ymin: float, xmax: float, ymax: float) -> Polygon:
+    rectangle = Polygon.from_bbox((xmin, ymin, xmax, ymax))
+    rectangle.srid = 4326
+    return rectangle
+
+
+def get_square(lon: float, lat: float, size: float = 0.0001) -> Polygon:
+    return get_rectangle(lon, lat, lon + size, lat + size)
+
+
+def create_tile_set(name: str, year: int, **kwargs) -> TileSet:
+    return TileSet.objects.create(
+        name=name,
+        url=f"https://{name}.tiles.test/{{z}}/{{x}}/{{y}}.png",
+        tile_set_status=TileSetStatus.VISIBLE,
+        tile_set_scheme=TileSetScheme.xyz,
+        tile_set_type=TileSetType.PARTIAL,
+        date=datetime(year, 1, 1, tzinfo=timezone.utc),
+        **kwargs,
+    )
+
+
+def create_geo_commune(name: str, geometry: GEOSGeometry) -> GeoCommune:
+    region = GeoRegion.objects.create(
+        name=f"Region {name}", insee_code=f"R-{name}", surface_km2=1, geometry=geometry
+    )
+    department = GeoDepartment.objects.create(
+        name=f"Department {name}",
+        insee_code=f"D-{name}",
+        surface_km2=1,
+        region=region,
+        geometry=geometry,
+    )
+    return GeoCommune.objects.create(
+        name=name, iso_code=f"C-{name}", department=department, geometry=geometry
+    )
+
+
+def create_detection(
+    tile_set: TileSet,
+    object_type: ObjectType,
+    geometry: GEOSGeometry,
+    address: str = None,
+    detection_object: DetectionObject = None,
+    auto_prescribed: bool = False,
+    detection_prescription_status: str = None,
+) -> Detection:
+    if detection_object is None:
+        detection_object = DetectionObject.objects.create(
+            object_type=object_type, address=address
+        )
+
+    detection_data = DetectionData.objects.create(
+        detection_control_status=DetectionControlStatus.NOT_CONTROLLED,
+        detection_validation_status=DetectionValidationStatus.SUSPECT,
+        detection_prescription_status=detection_prescription_status,
+    )
+    return Detection.objects.create(
+        geometry=geometry,
+        score=1,
+        detection_source=DetectionSource.ANALYSIS,
+        auto_prescribed=auto_prescribed,
+        detection_object=detection_object,
+        detection_data=detection_data,
+        tile_id=get_tile_id(geometry),
+        tile_set=tile_set,
+    )
+
+
+class DetectionImportTestMixin:
+    def setUp(self):
+        super().setUp()
+
+        # tiles of previous tests are deleted with their database
+        clear_tile_ids_cache()
+
+        User.objects.create_user(email=USER_REVIEWER_MAIL)
+        self.object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        self.previous_tile_set = create_tile_set(name="previous", year=2020)
+        self.tile_set = create_tile_set(name="current", year=2023)
+
+        self.previous_detection = create_detection(
+            tile_set=self.previous_tile_set,
+            object_type=self.object_type,
+            geometry=get_square(2.3520, 48.8560),
+        )
+
+        commune = create_geo_commune(
+            name="Paris", geometry=get_square(2.3, 48.8, size=0.1)
+        )
+        self.parcel = Parcel.objects.create(
+            id_parcellaire="75000000AA0001",
+            prefix="000",
+            section="AA",
+            num_parcel="0001",
+            contenance=100,
+            arpente=False,
+            geometry=get_square(2.3540, 48.8540, size=0.001),
+            commune=commune,
+            refreshed_at=datetime(2023, 1, 1, tzinfo=timezone.utc),
+        )
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def get_import_rows(self) -> List[Dict[str, Any]]:
+        # sorted by score like the import tables
+        return [
+            {
+                "id": 1,
+                "score": 0.9,
+                "address": "",
+                "geometry": get_square(2.3500, 48.8500),
+            },
+            # duplicate of the first row, skipped by the clean step
+            {
+                "id": 2,
+                "score": 0.8,
+                "address": "",
+                "geometry": get_square(2.35002, 48.85002),
+            },
+            # linked to the detection of the previous tile set, which gets its address
+            {
+                "id": 3,
+                "score": 0.7,
+                "address": "1 rue de Rivoli",
+                "geometry": get_square(2.35201, 48.85601),
+            },
+            # in the parcel
+            {
+                "id": 4,
+                "score": 0.6,
+                "address": "",
+                "geometry": get_square(2.3545, 48.8545),
+            },
+            {
+                "id": 5,
+                "score": 0.5,
+                "address": "",
+                "geometry": get_square(2.3600, 48.8600),
+            },
+        ]
+
+    def write_import_file(self, rows: List[Dict[str, Any]]) -> str:
+        file_path = os.path.join(self.temp_dir.name, "detections.csv")
+
+        with open(file_path, "w", newline="") as file:
+            writer = csv.DictWriter(
+                file, fieldnames=IMPORT_ROWS_COLUMNS, delimiter=";", quotechar='"'
+            )
+            writer.writeheader()
+
+            for row in rows:
+                writer.writerow(
+                    {
+                        **row,
+                        "object_type": row.get("object_type", self.object_type.name),
+                        "geometry": row["geometry"].wkt,
+                    }
+                )
+
+        return file_path
+
+    def import_detections(
+        self, batch_id: str, rows: Optional[List[Dict[str, Any]]] = None, **options
+    ):
+        call_command(
+            "import_detections",
+            tile_set_id=self.tile_set.id,
+            file_path=self.write_import_file(
+                self.get_import_rows() if rows is None else rows
+            ),
+            batch_id=batch_id,
+            clean_step=True,
+            rejects_file_path=os.path.join(self.temp_dir.name, "rejects.jsonl"),
+            **options,
+        )
+
+    def get_import_result(self, batch_id: str):
+        # detections of the batch without their ids and uuids, so that imports can be
+        # compared with each other
+        detections = (
+            Detection.objects.filter(batch_id=batch_id)
+            .select_related("detection_object", "detection_data", "tile")
+            .order_by("import_id")
+        )
+
+        return {
+            "detections": [
+                (
+                    detection.import_id,
+                    detection.score,
+                    detection.detection_source,
+                    (detection.tile.x, detection.tile.y, detection.tile.z),
+                    detection.detection_object_id
+                    == self.previous_detection.detection_object_id,
+                    detection.detection_object.import_id,
+                    detection.detection_object.address,
+                    detection.detection_object.parcel_id,
+                    detection.detection_data.detection_control_status,
+                    detection.detection_data.detection_validation_status,
+                    detection.detection_data.detection_prescription_status,
+                    detection.detection_data.user_last_update_id,
+                )
+                for detection in detections
+            ],
+            "detection_histories": Detection.history.filter(batch_id=batch_id).count(),
+            "detection_object_histories": DetectionObject.history.filter(
+                batch_id=batch_id
+            ).count(),
+        }
+
+    def reset_import(self):
+        Detection.objects.filter(tile_set=self.tile_set).delete()
+        DetectionObject.objects.filter(detections__isnull=True).delete()
+        DetectionData.objects.filter(detection__isnull=True).delete()
+        DetectionObject.objects.filter(
+            id=self.previous_detection.detection_object_id
+        ).update(address=None)
+
+
+class DetectionRowValidatorTestCase(SimpleTestCase):
+    def get_row(self, **values) -> Dict[str, Any]:
+        return {
+            "score": "0.5",
+            "id": "1",
+            "address": "",
+            "object_type": "piscine",
+            **values,
+        }
+
+    def validate_with_serializer(self, row: Dict[str, Any]):
+        serializer = DetectionRowSerializer(data=row)
+
+        if serializer.is_valid():
+            return dict(serializer.validated_data), {}
+
+        return None, {
+            field_name: [str(error) for error in field_errors]
+            for field_name, field_errors in serializer.errors.items()
+        }
+
+    def assertSameValidation(self, row: Dict[str, Any]):
+        validated_data, errors = DETECTION_ROW_VALIDATOR.validate(row)
+        expected_validated_data, expected_errors = self.validate_with_serializer(row)
+
+        self.assertEqual(errors, expected_errors)
+
+        if not expected_errors:
+            self.assertEqual(validated_data, expected_validated_data)
+
+        return errors
+
+    def test_defaults(self):
+        rows = [
+            self.get_row(),
+            # missing and null fields with defaults
+            self.get_row(
+                detection_control_status=None,
+                detection_validation_status=None,
+                detection_prescription_status=None,
+                detection_source=None,
+                user_reviewed=None,
+                created_at=None,
+            ),
+            self.get_row(address=None),
+            self.get_row(address="  1 rue de Rivoli "),
+        ]
+
+        for row in rows:
+            with self.subTest(row=row):
+                self.assertEqual(self.assertSameValidation(row), {})
+
+    def test_string_values(self):
+        rows = [
+            self.get_row(id="12", score="1"),
+            self.get_row(id="12.0", score="1e-3"),
+            self.get_row(id=12, score=0.5),
+            self.get_row(score="1e400"),
+            self.get_row(
+                detection_control_status=DetectionControlStatus.NOT_CONTROLLED,
+                detection_validation_status="SUSPECT",
+                detection_prescription_status="PRESCRIBED",
+                detection_source="INTERFACE_DRAWN",
+            ),
+            self.get_row(created_at="2023-01-01T00:00:00Z"),
+        ] + [
+            self.get_row(user_reviewed=user_reviewed)
+            for user_reviewed in ["true", "False", "1", "0", "yes", "null", True, 0]
+        ]
+
+        for row in rows:
+            with self.subTest(row=row):
+                self.assertEqual(self.assertSameValidation(row), {})
+
+    def test_errors(self):
+        rows_errors = [
+            (
+                self.get_row(address=None, object_type=""),
+                {"object_type": ["This field may not be blank."]},
+            ),
+            (
+                {"score": "0.5", "id": "1", "object_type": "piscine"},
+                {"address": ["This field is required."]},
+            ),
+            (
+                self.get_row(id=None, score=None),
+                {
+                    "id": ["This field may not be null."],
+                    "score": ["This field may not be null."],
+                },
+            ),
+            (
+                self.get_row(detection_validation_status="UNKNOWN"),
+                {"detection_validation_status": ['"UNKNOWN" is not a valid choice.']},
+            ),
+            (
+                self.get_row(user_reviewed="maybe"),
+                {"user_reviewed": ["Must be a valid boolean."]},
+            ),
+            (
+                self.get_row(id="12.5", score="abc"),
+                {
+                    "id": ["A valid integer is required."],
+                    "score": ["A valid number is required."],
+                },
+            ),
+            (
+                self.get_row(score=10**400),
+                {"score": ["Integer value too large to convert to float"]},
+            ),
+            (
+                self.get_row(score="1" * 1001),
+                {"score": ["String value too large."]},
+            ),
+            (
+                self.get_row(address=True),
+                {"address": ["Not a valid string."]},
+            ),
+            (
+                self.get_row(created_at="yesterday"),
+                {
+                    "created_at": [
+                        "Datetime has wrong format. Use one of these formats instead: "
+                        "YYYY-MM-DDThh:mm[:ss[.uuuuuu]][+HH:MM|-HH:MM|Z]."
+                    ]
+                },
+            ),
+        ]
+
+        for row, errors in rows_errors:
+            with self.subTest(row=row):
+                self.assertEqual(self.assertSameValidation(row), errors)
+
+
+class GeometryGridIndexTestCase(SimpleTestCase):
+    def test_query_returns_intersecting_geometries_with_same_key(self):
+        # a geometry crossing the edge of a cell is found from both cells
+        cell_x, _ = get_tile_xy(lon=2.35, lat=48.85, z=GRID_ZOOM)
+        cell_edge = get_tile_lon(x=cell_x + 1, z=GRID_ZOOM)
+
+        index = GeometryGridIndex()
+        index.insert(
+            key=1, geometry=get_square(cell_edge - 0.00005, 48.85), item="edge"
+        )
+        index.insert(key=1, geometry=get_square(2.40, 48.85), item="far")
+        index.insert(
+            key=2, geometry=get_square(cell_edge - 0.00005, 48.85), item="other"
+        )
+
+        for lon in [cell_edge - 0.00003, cell_edge + 0.00002]:
+            self.assertEqual(
+                [
+                    item
+                    for _, item in index.query(
+                        key=1, geometry=get_square(lon, 48.85, size=0.00001)
+                    )
+                ],
+                ["edge"],
+            )
+
+        self.assertEqual(
+            index.query(key=1, geometry=get_square(2.45, 48.85)),
+            [],
+        )
+        self.assertEqual(len(index), 3)
+
+        index.clear()
+        self.assertEqual(len(index), 0)
+
+
+class DetectionStagingLoaderTestCase(DetectionImportTestMixin, TransactionTestCase):
+    # staging tables are only dropped by real commits and rollbacks
+
+    def test_copy_loader_same_as_orm_loader(self):
+        self.import_detections(batch_id="orm", loader=DetectionLoader.ORM)
+        orm_result = self.get_import_result(batch_id="orm")
+        self.reset_import()
+
+        self.import_detections(batch_id="copy", loader=DetectionLoader.COPY)
+        copy_result = self.get_import_result(batch_id="copy")
+
+        self.assertEqual(
+            [detection[0] for detection in orm_result["detections"]], [1, 3, 4, 5]
+        )
+        self.assertEqual(copy_result, orm_result)
+
+    def test_copy_loader_skips_same_overlaps_as_orm_loader(self):
+        rows = self.get_import_rows() + [
+            # the second row overlaps the first one and is skipped, the third one only
+            # overlaps the skipped row and is kept
+            {
+                "id": 30,
+                "score": 0.4,
+                "address": "",
+                "geometry": get_square(2.37, 48.87),
+            },
+            {
+                "id": 31,
+                "score": 0.4,
+                "address": "",
+                "geometry": get_square(2.37004, 48.87),
+            },
+            {
+                "id": 32,
+                "score": 0.4,
+                "address": "",
+                "geometry": get_square(2.37008, 48.87),
+            },
+            # the large row covers the small earlier one, which is only a quarter of
+            # its area: it is kept
+            {
+                "id": 40,
+                "score": 0.3,
+                "address": "",
+                "geometry": get_square(2.38, 48.88),
+            },
+            {
+                "id": 41,
+                "score": 0.3,
+                "address": "",
+                "geometry": get_square(2.38, 48.88, size=0.0002),
+            },
+        ]
+
+        self.import_detections(batch_id="orm", rows=rows, loader=DetectionLoader.ORM)
+        orm_result = self.get_import_result(batch_id="orm")
+        self.reset_import()
+
+        self.import_detections(batch_id="copy", rows=rows, loader=DetectionLoader.COPY)
+        copy_result = self.get_import_result(batch_id="copy")
+
+        self.assertEqual(
+            [detection[0] for detection in orm_result["detections"]],
+            [1, 3, 4, 5, 30, 32, 40, 41],
+        )
+        self.assertEqual(copy_result, orm_result)
+
+    def test_copy_loader_links_detections_and_resolves_parcels(self):
+        self.import_detections(batch_id="copy", loader=DetectionLoader.COPY)
+
+        linked_detection = Detection.objects.get(batch_id="copy", import_id=3)
+        self.assertEqual(
+            linked_detection.detection_object_id,
+            self.previous_detection.detection_object_id,
+        )
+        self.assertEqual(linked_detection.detection_object.address, "1 rue de Rivoli")
+
+        parcel_detection = Detection.objects.get(batch_id="copy", import_id=4)
+        self.assertEqual(parcel_detection.detection_object.parcel_id, self.parcel.id)
+
+    def test_copy_loader_leaves_no_staging_table(self):
+        self.import_detections(batch_id="copy", loader=DetectionLoader.COPY)
+
+        self.assertFalse(self.get_staging_tables())
+
+    def test_copy_loader_resumes_after_last_committed_batch(self):
+        rows = self.get_import_rows()
+        invalid_rows = rows + [{**rows[-1], "id": 6, "object_type": "unknown"}]
+
+        with mock.patch(
+            "core.management.commands._common.detection_staging.COPY_BATCH_SIZE", 2
+        ):
+            with self.assertRaises(KeyError):
+                call_command(
+                    "import_detections",
+                    tile_set_id=self.tile_set.id,
+                    file_path=self.write_import_file(invalid_rows),
+                    batch_id="copy",
+                    clean_step=True,
+                    loader=DetectionLoader.COPY,
+                    rejects_file_path=os.path.join(self.temp_dir.name, "rejects.jsonl"),
+                )
+
+            # batches of 2 rows are committed with their checkpoint, their staging
+            # tables are dropped with them
+            self.assertFalse(self.get_staging_tables())
+            checkpoint = DetectionImportCheckpoint.objects.get(batch_id="copy")
+            self.assertEqual(checkpoint.processed_rows, 4)
+            self.assertEqual(checkpoint.last_import_id, 4)
+            self.assertEqual(self.get_imported_ids(batch_id="copy"), [1, 3, 4])
+
+            self.import_detections(
+                batch_id="copy", loader=DetectionLoader.COPY, resume=True
+            )
+
+        self.assertEqual(self.get_imported_ids(batch_id="copy"), [1, 3, 4, 5])
+        self.assertFalse(self.get_staging_tables())
+
+    def get_imported_ids(self, batch_id: str) -> List[int]:
+        return sorted(
+            Detection.objects.filter(batch_id=batch_id).values_list(
+                "import_id", flat=True
+            )
+        )
+
+    def get_staging_tables(self) -> List[str]:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tablename FROM pg_tables WHERE tablename LIKE 'detection_staging_%%'"
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class DetectionImportRejectsTestCase(DetectionImportTestMixin, TransactionTestCase):
+    def test_invalid_rows_written_in_rejects_file(self):
+        rows = self.get_import_rows() + [
+            {
+                "id": 6,
+                "score": "abc",
+                "address": "",
+                "geometry": get_square(2.37, 48.87),
+            }
+        ]
+        self.import_detections(batch_id="rejects", rows=rows)
+
+        with open(os.path.join(self.temp_dir.name, "rejects.jsonl")) as file:
+            rejects = [json.loads(line) for line in file]
+
+        self.assertEqual(
+            rejects,
+            [
+                {
+                    "batch_id": "rejects",
+                    "shard": DEFAULT_SHARD,
+                    "row": {
+                        "id": "6",
+                        "score": "abc",
+                        "address": "",
+                        "object_type": self.object_type.name,
+                    },
+                    "errors": {"score": ["A valid number is required."]},
+                }
+            ],
+        )
+        self.assertEqual(
+            sorted(
+                Detection.objects.filter(batch_id="rejects").values_list(
+                    "import_id", flat=True
+                )
+            ),
+            [1, 3, 4, 5],
+        )
+
+
+class DetectionImportTableTestCase(DetectionImportTestMixin, TransactionTestCase):
+    # the import table is created in its own schema, dropped after the test
+    def setUp(self):
+        super().setUp()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE SCHEMA import_detections_test;
+                CREATE TABLE import_detections_test.detections (
+                    batch_id varchar(255),
+                    id integer,
+                    score double precision,
+                    address varchar(255),
+                    object_type varchar(255),
+                    detection_control_status varchar(255),
+                    detection_validation_status varchar(255),
+                    detection_prescription_status varchar(255),
+                    detection_source varchar(255),
+                    user_reviewed boolean,
+                    tile_x integer,
+                    tile_y integer,
+                    geometry geometry(Geometry, 4326)
+                )
+                """
+            )
+
+        self.addCleanup(self.drop_import_schema)
+
+    def drop_import_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP SCHEMA import_detections_test CASCADE")
+
+    def insert_import_rows(self, batch_id: str):
+        # same values as the csv rows with the defaults of DetectionRowSerializer
+        with connection.cursor() as cursor:
+            for row in self.get_import_rows():
+                cursor.execute(
+                    """
+                    INSERT INTO import_detections_test.detections (
+                        batch_id, id, score, address, object_type,
+                        detection_control_status, detection_validation_status,
+                        detection_source, user_reviewed, geometry
+                    )
+                    VALUES (
+                        %s, %s, %s, %s, %s, %s, %s, %s, false,
+                        ST_GeomFromText(%s, 4326)
+                    )
+                    """,
+                    [
+                        batch_id,
+                        row["id"],
+                        row["score"],
+                        row["address"],
+                        self.object_type.name,
+                        DetectionControlStatus.NOT_CONTROLLED,
+                        DetectionValidationStatus.DETECTED_NOT_VERIFIED,
+                        DetectionSource.ANALYSIS,
+                        row["geometry"].wkt,
+                    ],
+                )
+
+    def test_table_import_same_as_file_import(self):
+        self.import_detections(batch_id="file")
+        file_result = self.get_import_result(batch_id="file")
+        self.reset_import()
+
+        self.insert_import_rows(batch_id="table")
+
+        # rows are fetched one by one from the server-side cursor
+        with mock.patch("core.management.commands.import_detections.FETCH_SIZE", 1):
+            call_command(
+                "import_detections",
+                tile_set_id=self.tile_set.id,
+                table_name="detections",
+                table_schema="import_detections_test",
+                batch_id="table",
+                clean_step=True,
+                rejects_file_path=os.path.join(self.temp_dir.name, "rejects.jsonl"),
+            )
+
+        self.assertEqual(self.get_import_result(batch_id="table"), file_result)
+
+
+class DetectionShardsTestCase(DetectionImportTestMixin, TransactionTestCase):
+    # shards are imported by forked workers, the rows must be committed
+    def get_import_rows(self) -> List[Dict[str, Any]]:
+        block_x, _ = get_tile_xy(lon=2.35, lat=48.85, z=SHARD_BLOCK_ZOOM)
+        block_edge = get_tile_lon(x=block_x + 1, z=SHARD_BLOCK_ZOOM)
+
+        return [
+            # spans two blocks and overlaps the next row, which is inside a block and
+            # has a lower score: it is skipped by the clean step
+            {
+                "id": 10,
+                "score": 0.95,
+                "address": "",
+                "geometry": get_rectangle(
+                    block_edge - 0.00005, 48.85, block_edge + 0.00005, 48.8501
+                ),
+            },
+            {
+                "id": 11,
+                "score": 0.92,
+                "address": "",
+                "geometry": get_rectangle(
+                    block_edge - 0.00008, 48.85, block_edge - 0.00001, 48.8501
+                ),
+            },
+            *super().get_import_rows(),
+            {"id": 12, "score": 0.4, "address": "", "geometry": get_square(3.0, 45.0)},
+        ]
+
+    def test_sharded_import_same_as_sequential_import(self):
+        for loader in [DetectionLoader.ORM, DetectionLoader.COPY]:
+            with self.subTest(loader=loader):
+                self.import_detections(batch_id=f"sequential-{loader}", loader=loader)
+                sequential_result = self.get_import_result(
+                    batch_id=f"sequential-{loader}"
+                )
+                self.reset_import()
+
+                self.import_detections(
+                    batch_id=f"sharded-{loader}", loader=loader, workers=2
+                )
+                sharded_result = self.get_import_result(batch_id=f"sharded-{loader}")
+                self.reset_import()
+
+                self.assertEqual(
+                    [detection[0] for detection in sequential_result["detections"]],
+                    [1, 3, 4, 5, 10, 12],
+                )
+                self.assertEqual(sharded_result, sequential_result)
+
+    def test_overlapping_rows_in_same_shard_in_input_order(self):
+        rows = [
+            {**row, "geometry": row["geometry"].wkt} for row in self.get_import_rows()
+        ]
+        shard_writer = DetectionShardWriter(shards_count=4)
+        self.addCleanup(shard_writer.cleanup)
+
+        shard_writer.write_rows(rows)
+        shards_rows = [
+            list(read_shard_rows(file_path))
+            for _, file_path in shard_writer.get_shards()
+        ]
+
+        input_ids = [row["id"] for row in rows]
+        shards_ids = [[row["id"] for row in shard_rows] for shard_rows in shards_rows]
+
+        self.assertEqual(sorted(sum(shards_ids, [])), sorted(input_ids))
+        self.assertTrue(any({10, 11} <= set(shard_ids) for shard_ids in shards_ids))
+        for shard_ids in shards_ids:
+            self.assertEqual(shard_ids, sorted(shard_ids, key=input_ids.index))
+
+
+class HistoryTestCase(TestCase):
+    def setUp(self):
+        object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        self.previous_tile_set = create_tile_set(name="previous", year=2020)
+        self.current_tile_set = create_tile_set(name="current", year=2023)
+        self.detection = create_detection(
+            tile_set=self.previous_tile_set,
+            object_type=object_type,
+            geometry=get_square(2.35, 48.85),
+        )
+
+    def get_last_changed_fields(self) -> List[Dict[str, Any]]:
+        return self.detection.history.filter(history_type="~").first().changed_fields
+
+    def test_changed_fields_keep_related_objects_format(self):
+        detection = Detection.objects.get(id=self.detection.id)
+        detection.tile_set = self.current_tile_set
+        detection.score = 0.5
+        detection.save()
+
+        self.assertEqual(
+            self.get_last_changed_fields(),
+            [
+                {"field": "score", "new_value": 0.5, "old_value": 1.0},
+                {
+                    "field": "tile_set",
+                    "new_value": str(self.current_tile_set),
+                    "old_value": str(self.previous_tile_set),
+                },
+            ],
+        )
+
+    def test_history_snapshot_built_on_save(self):
+        detection = Detection.objects.get(id=self.detection.id)
+        self.assertNotIn("_history_snapshot", detection.__dict__)
+
+        detection.score = 0.5
+        detection.save()
+
+        self.assertEqual(detection.__dict__["_history_snapshot"]["score"], 0.5)
+        self.assertEqual(
+            self.get_last_changed_fields(),
+            [{"field": "score", "new_value": 0.5, "old_value": 1.0}],
+        )
+
+    def assertCreatedWithOneHistoryRecord(self, instance):
+        self.assertEqual(
+            list(instance.history.values_list("history_type", flat=True)), ["+"]
+        )
+
+    def test_create_writes_one_history_record(self):
+        self.assertCreatedWithOneHistoryRecord(self.detection)
+        self.assertCreatedWithOneHistoryRecord(self.detection.detection_data)
+
+    def test_prescription_writes_one_history_record_per_created_detection(self):
+        missing_tile_set = create_tile_set(name="missing", year=2021)
+        detection = create_detection(
+            tile_set=self.current_tile_set,
+            object_type=ObjectType.objects.create(
+                name="caravane", color="#ff0000", prescription_duration_years=5
+            ),
+            geometry=get_square(2.36, 48.85),
+        )
+        serializer = DetectionDataInputSerializer(
+            detection.detection_data,
+            data={
+                "detection_prescription_status": DetectionPrescriptionStatus.PRESCRIBED
+            },
+            partial=True,
+            context={
+                "request": mock.Mock(
+                    user=User.objects.create_user(
+                        email="super-admin@aigle.test",
+                        user_role=UserRole.SUPER_ADMIN,
+                    )
+                )
+            },
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        created_detections = detection.detection_object.detections.exclude(
+            id=detection.id
+        )
+        self.assertEqual(
+            {created_detection.tile_set for created_detection in created_detections},
+            {self.previous_tile_set, missing_tile_set},
+        )
+
+        for created_detection in created_detections:
+            self.assertCreatedWithOneHistoryRecord(created_detection)
+            self.assertCreatedWithOneHistoryRecord(created_detection.detection_data)
+
+    @override_settings(HISTORY_WRITER_ASYNC=False)
+    def test_bulk_update_fetches_related_objects_once(self):
+        for i in range(1, 4):
+            create_detection(
+                tile_set=self.previous_tile_set,
+                object_type=self.detection.detection_object.object_type,
+                geometry=get_square(2.35 + i * 0.001, 48.85),
+            )
+
+        detections = list(Detection.objects.all())
+        self.assertEqual(len(detections), 4)
+
+        for detection in detections:
+            detection.tile_set_id = self.current_tile_set.id
+
+        # update, related objects of the changed tile sets, history records
+        with self.assertNumQueries(3):
+            bulk_update_with_history(detections, Detection, ["tile_set"])
+
+        for detection in detections:
+            self.assertEqual(
+                detection.history.filter(history_type="~").first().changed_fields,
+                [
+                    {
+                        "field": "tile_set",
+                        "new_value": str(self.current_tile_set),
+                        "old_value": str(self.previous_tile_set),
+                    }
+                ],
+            )
+
+
+@override_settings(HISTORY_WRITER_ASYNC=True)
+@mock.patch("common.models.history_writer.HISTORY_WRITER_REQUEUE_DELAY_SECONDS", 0)
+class HistoryWriterTestCase(TransactionTestCase):
+    def setUp(self):
+        clear_tile_ids_cache()
+        object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        self.detection = create_detection(
+            tile_set=create_tile_set(name="current", year=2023),
+            object_type=object_type,
+            geometry=get_square(2.35, 48.85),
+        )
+        flush_history_writer()
+
+    def update_detection_with_failures(self, failures_count: int):
+        bulk_create = QuerySet.bulk_create
+        history_model = Detection.history.model
+        failures = []
+
+        def failing_bulk_create(queryset, *args, **kwargs):
+            if queryset.model is history_model and len(failures) < failures_count:
+                failures.append(queryset.model)
+                raise OperationalError("server closed the connection unexpectedly")
+
+            return bulk_create(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, "bulk_create", failing_bulk_create):
+            detection = Detection.objects.get(id=self.detection.id)
+            detection.score = 0.5
+            detection.save()
+            flush_history_writer()
+
+        self.assertEqual(len(failures), failures_count)
+
+    def test_history_written_after_retry(self):
+        self.update_detection_with_failures(1)
+
+        self.assertEqual(
+            self.detection.history.filter(history_type="~").count(),
+            1,
+        )
+
+    def test_history_written_after_requeue(self):
+        self.update_detection_with_failures(2)
+
+        self.assertEqual(
+            self.detection.history.filter(history_type="~").count(),
+            1,
+        )
+
+
+class PartitionHistoryCommandTestCase(TransactionTestCase):
+    def setUp(self):
+        clear_tile_ids_cache()
+        object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        self.detection = create_detection(
+            tile_set=create_tile_set(name="current", year=2023),
+            object_type=object_type,
+            geometry=get_square(2.35, 48.85),
+        )
+        # records spread over several monthly partitions
+        self.detection.history.update(
+            history_date=datetime.now(timezone.utc) - timedelta(days=62)
+        )
+        self.table = Detection.history.model._meta.db_table
+
+    def get_history(self) -> List[Tuple[int, str, float]]:
+        return list(
+            self.detection.history.order_by("history_id").values_list(
+                "history_id", "history_type", "score"
+            )
+        )
+
+    def get_indexes_and_foreign_keys(self) -> Dict[str, Tuple[str, ...]]:
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, self.table)
+
+        return {
+            name: tuple(constraint["columns"])
+            for name, constraint in constraints.items()
+            if (constraint["index"] or constraint["foreign_key"])
+            and not constraint["primary_key"]
+        }
+
+    def save_detection(self, score: float):
+        detection = Detection.objects.get(id=self.detection.id)
+        detection.score = score
+        detection.save()
+
+    def test_partition_keeps_records_sequence_indexes_and_foreign_keys(self):
+        self.save_detection(0.5)
+        history = self.get_history()
+        indexes_and_foreign_keys = self.get_indexes_and_foreign_keys()
+        self.assertTrue(indexes_and_foreign_keys)
+
+        # DDL is transactional, the partitioning is rolled back so that the following
+        # tests get the unpartitioned table
+        with transaction.atomic():
+            call_command("partition_history", models=["detection"], partition=True)
+
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass(%s)",
+                    [self.table],
+                )
+                self.assertGreater(cursor.fetchone()[0], 2)
+
+            self.assertEqual(self.get_history(), history)
+            self.assertEqual(
+                self.get_indexes_and_foreign_keys(), indexes_and_foreign_keys
+            )
+
+            self.save_detection(0.4)
+            self.save_detection(0.3)
+            new_history = self.get_history()
+            self.assertEqual(new_history[: len(history)], history)
+            self.assertEqual(
+                [(history_type, score) for _, history_type, score in new_history[-2:]],
+                [("~", 0.4), ("~", 0.3)],
+            )
+            self.assertGreater(new_history[-2][0], history[-1][0])
+            self.assertGreater(new_history[-1][0], new_history[-2][0])
+
+            transaction.set_rollback(True)
+
+    def test_compact_deletes_no_op_update_records(self):
+        self.save_detection(0.5)
+        # saved without change
+        self.save_detection(0.5)
+        self.save_detection(0.4)
+        history = self.get_history()
+        self.assertEqual(
+            [(history_type, score) for _, history_type, score in history],
+            [("+", 1.0), ("~", 0.5), ("~", 0.5), ("~", 0.4)],
+        )
+
+        call_command("partition_history", models=["detection"], compact=True)
+
+        self.assertEqual(self.get_history(), history[:2] + history[3:])
+        self.assertEqual(
+            DetectionData.history.filter(id=self.detection.detection_data_id).count(),
+            1,
+        )
+
+
+def run_in_request(function):
+    # runs the function with the request cache of RequestCacheMiddleware
+    return RequestCacheMiddleware(get_response=lambda request: function())(None)
+
+
+class PermissionsCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.super_admin = User.objects.create_user(
+            email="super-admin@aigle.test", user_role=UserRole.SUPER_ADMIN
+        )
+
+    def get_counted_compute(self, calls: List[int]):
+        def compute():
+            calls.append(len(calls))
+            return len(calls)
+
+        return compute
+
+    def test_not_cached_across_requests_without_shared_backend(self):
+        calls = []
+        compute = self.get_counted_compute(calls)
+
+        def get_value():
+            return get_or_set_versioned("value", ["values"], compute)
+
+        self.assertEqual(get_value(), 1)
+        self.assertEqual(get_value(), 2)
+        self.assertEqual(run_in_request(lambda: (get_value(), get_value())), (3, 3))
+        self.assertEqual(run_in_request(get_value), 4)
+
+    def test_request_cache_cleared_on_invalidation(self):
+        calls = []
+        compute = self.get_counted_compute(calls)
+
+        def get_values():
+            value = get_or_set_versioned("value", ["values"], compute)
+            bump_cache_version("values")
+            return value, get_or_set_versioned("value", ["values"], compute)
+
+        self.assertEqual(run_in_request(get_values), (1, 2))
+
+    @mock.patch("core.utils.cache.is_cache_shared", return_value=True)
+    def test_cached_across_requests_with_shared_backend(self, _):
+        calls = []
+        compute = self.get_counted_compute(calls)
+
+        def get_value():
+            return get_or_set_versioned("value", ["values"], compute)
+
+        self.assertEqual(get_value(), 1)
+        self.assertEqual(run_in_request(get_value), 1)
+
+        bump_cache_version("values")
+        self.assertEqual(get_value(), 2)
+
+    @mock.patch("core.utils.cache.is_cache_shared", return_value=True)
+    def test_user_groups_invalidated(self, _):
+        user = User.objects.create_user(email="regular@aigle.test")
+        user_group = UserGroup.objects.create(name="group")
+        user_group.geo_zones.add(
+            create_geo_commune(name="commune", geometry=get_square(2.35, 48.85))
+        )
+
+        self.assertIsNone(get_user_union_geometry(user))
+
+        UserUserGroup.objects.create(
+            user=user, user_group=user_group, user_group_rights=[UserGroupRight.READ]
+        )
+
+        self.assertIsNotNone(get_user_union_geometry(user))
+
+    @mock.patch("core.utils.cache.is_cache_shared", return_value=True)
+    def test_tile_sets_invalidated(self, _):
+        tile_set = create_tile_set(name="previous", year=2020)
+        user_tile_sets, _ = get_user_tile_sets(self.super_admin)
+        self.assertEqual(
+            [user_tile_set.id for user_tile_set in user_tile_sets], [tile_set.id]
+        )
+
+        new_tile_set = create_tile_set(name="current", year=2023)
+        user_tile_sets, _ = get_user_tile_sets(self.super_admin)
+        self.assertEqual(
+            sorted(user_tile_set.id for user_tile_set in user_tile_sets),
+            [tile_set.id, new_tile_set.id],
+        )
+
+    def test_tile_sets_listed_in_one_query(self):
+        tile_set = create_tile_set(name="previous", year=2020)
+
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                user_tile_sets = get_user_tile_sets(self.super_admin)[0]
+
+            self.assertEqual(
+                [user_tile_set.id for user_tile_set in user_tile_sets], [tile_set.id]
+            )
+
+    @mock.patch("core.utils.cache.is_cache_shared", return_value=True)
+    def test_cached_tile_sets_listed_in_one_query(self, _):
+        tile_set = create_tile_set(name="previous", year=2020)
+
+        # ids and tile sets computed in one query, then tile sets of the cached ids
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                user_tile_sets = get_user_tile_sets(self.super_admin)[0]
+
+            self.assertEqual(
+                [user_tile_set.id for user_tile_set in user_tile_sets], [tile_set.id]
+            )
+
+    @mock.patch("core.utils.cache.is_cache_shared", return_value=True)
+    def test_object_types_invalidated(self, _):
+        self.assertEqual(get_user_object_types_with_status(self.super_admin), [])
+
+        object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+
+        self.assertEqual(
+            [
+                user_object_type.id
+                for user_object_type, _ in get_user_object_types_with_status(
+                    self.super_admin
+                )
+            ],
+            [object_type.id],
+        )
+
+
+class UserTileSetsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="regular@aigle.test")
+        self.commune = create_geo_commune(
+            name="commune", geometry=get_square(2.35, 48.85, size=0.01)
+        )
+        user_group = UserGroup.objects.create(name="group")
+        user_group.geo_zones.add(self.commune)
+        UserUserGroup.objects.create(
+            user=self.user,
+            user_group=user_group,
+            user_group_rights=[UserGroupRight.READ],
+        )
+
+    def get_user_tile_set_ids(self) -> List[int]:
+        tile_sets, _ = get_user_tile_sets(self.user)
+        return sorted(tile_set.id for tile_set in tile_sets)
+
+    def test_tile_sets_access_by_coverage(self):
+        covering_tile_set = create_tile_set(name="covering", year=2020)
+        covering_tile_set.geo_zones.add(self.commune)
+
+        not_restricted_tile_set = create_tile_set(name="not-restricted", year=2021)
+
+        # geo zones without geometry give the tile set no coverage
+        no_coverage_tile_set = create_tile_set(name="no-coverage", year=2022)
+        no_coverage_tile_set.geo_zones.add(
+            create_geo_commune(name="no-geometry", geometry=None)
+        )
+
+        self.assertIsNone(no_coverage_tile_set.coverage_geometry)
+        self.assertEqual(
+            self.get_user_tile_set_ids(),
+            [covering_tile_set.id, not_restricted_tile_set.id],
+        )
+
+    def test_detection_geometries_not_quantized(self):
+        tile_set = create_tile_set(name="covering", year=2020)
+        tile_set.geo_zones.add(self.commune)
+
+        # rectangular detection next to the commune, its quantized bbox overlaps it
+        geometry = get_rectangle(2.3601, 48.85, 2.3701, 48.86)
+        self.assertTrue(quantize_bbox(geometry).intersects(self.commune.geometry))
+
+        tile_sets, _ = get_user_tile_sets(
+            self.user, filter_tile_set_intersects_geometry=geometry
+        )
+        self.assertEqual(tile_sets, [])
+
+        tile_sets, _ = get_user_tile_sets(
+            self.user,
+            filter_tile_set_intersects_geometry=get_rectangle(
+                2.355, 48.85, 2.365, 48.86
+            ),
+        )
+        self.assertEqual(
+            [user_tile_set.id for user_tile_set in tile_sets], [tile_set.id]
+        )
+        self.assertAlmostEqual(tile_sets[0].intersection.area, 0.00005)
+
+
+class DetectionRightsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="regular@aigle.test")
+        object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        tile_set = create_tile_set(name="current", year=2023)
+
+        for name, lon, rights in [
+            ("write", 2.35, [UserGroupRight.WRITE, UserGroupRight.READ]),
+            ("read", 2.40, [UserGroupRight.READ]),
+        ]:
+            user_group = UserGroup.objects.create(name=name)
+            user_group.geo_zones.add(
+                create_geo_commune(
+                    name=name, geometry=get_square(lon, 48.85, size=0.01)
+                )
+            )
+            UserUserGroup.objects.create(
+                user=self.user, user_group=user_group, user_group_rights=rights
+            )
+
+        self.writable_detection, self.readable_detection, self.outside_detection = [
+            create_detection(
+                tile_set=tile_set,
+                object_type=object_type,
+                geometry=get_square(lon, 48.855),
+            )
+            for lon in [2.355, 2.405, 2.455]
+        ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def edit_multiple(self, detections: List[Detection]):
+        return self.client.post(
+            reverse("DetectionViewSet-edit-multiple"),
+            {
+                "uuids": [str(detection.uuid) for detection in detections],
+                "detectionValidationStatus": DetectionValidationStatus.LEGITIMATE,
+            },
+            format="json",
+        )
+
+    def get_validation_status(self, detection: Detection) -> str:
+        detection.detection_data.refresh_from_db()
+        return detection.detection_data.detection_validation_status
+
+    def test_rights_by_point(self):
+        rights_by_point = get_user_group_rights_by_point(
+            self.user,
+            [
+                detection.geometry.centroid
+                for detection in [
+                    self.writable_detection,
+                    self.readable_detection,
+                    self.outside_detection,
+                ]
+            ],
+        )
+
+        self.assertEqual(
+            [sorted(rights) for rights in rights_by_point],
+            [
+                sorted([UserGroupRight.WRITE, UserGroupRight.READ]),
+                [UserGroupRight.READ],
+                [],
+            ],
+        )
+
+    def test_edit_multiple_lists_forbidden_detections(self):
+        response = self.edit_multiple(
+            [self.writable_detection, self.readable_detection, self.outside_detection]
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(
+            sorted(response.json()["uuids"]),
+            sorted(
+                [str(self.readable_detection.uuid), str(self.outside_detection.uuid)]
+            ),
+        )
+        self.assertEqual(
+            self.get_validation_status(self.writable_detection),
+            DetectionValidationStatus.SUSPECT,
+        )
+
+    def test_edit_multiple_writable_detections(self):
+        response = self.edit_multiple([self.writable_detection])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.get_validation_status(self.writable_detection),
+            DetectionValidationStatus.LEGITIMATE,
+        )
+
+
+class DetectionTilesTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email="regular@aigle.test")
+        self.object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        commune = create_geo_commune(
+            name="commune", geometry=get_square(2.35, 48.85, size=0.005)
+        )
+        user_group = UserGroup.objects.create(name="group")
+        user_group.geo_zones.add(commune)
+        UserUserGroup.objects.create(
+            user=user, user_group=user_group, user_group_rights=[UserGroupRight.READ]
+        )
+
+        tile_set = create_tile_set(name="current", year=2023)
+        tile_set.geo_zones.add(commune)
+
+        # both detections are in the same tile, only the first one is in the commune
+        self.visible_detection, self.hidden_detection = [
+            create_detection(
+                tile_set=tile_set,
+                object_type=self.object_type,
+                geometry=get_square(lon, 48.851),
+            )
+            for lon in [2.351, 2.357]
+        ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def get_tile(self, z: int, x: int, y: int):
+        return self.client.get(
+            reverse("DetectionTilesView", kwargs={"z": z, "x": x, "y": y}),
+            {"objectTypesUuids": str(self.object_type.uuid)},
+        )
+
+    @mock.patch("core.views.detection.get_detections_mvt", return_value=b"")
+    def test_tile_detections_filtered_by_user_tile_sets(self, get_detections_mvt):
+        z = 13
+        x, y = get_tile_xy(lon=2.351, lat=48.851, z=z)
+        response = self.get_tile(z=z, x=x, y=y)
+
+        self.assertEqual(response.status_code, 200)
+        detections = get_detections_mvt.call_args.args[0]
+        self.assertEqual(
+            [detection.id for detection in detections], [self.visible_detection.id]
+        )
+
+    def test_tile_encoded_by_postgis(self):
+        z = 13
+        x, y = get_tile_xy(lon=2.351, lat=48.851, z=z)
+        response = self.get_tile(z=z, x=x, y=y)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], MVT_CONTENT_TYPE)
+
+        # strings of the tile (layer name, keys and values) are encoded as is
+        content = response.content
+        self.assertIn(MVT_LAYER_NAME.encode(), content)
+        self.assertIn(str(self.visible_detection.uuid).encode(), content)
+        self.assertIn(self.object_type.color.encode(), content)
+        self.assertNotIn(str(self.hidden_detection.uuid).encode(), content)
+
+        # tile without detection
+        response = self.get_tile(z=z, x=x + 2, y=y)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+
+    def test_tile_zoom_out_of_bounds(self):
+        response = self.get_tile(z=23, x=0, y=0)
+
+        self.assertEqual(response.status_code, 400)
+
+
+class DetectionsGeojsonTestCase(TestCase):
+    def setUp(self):
+        object_type = ObjectType.objects.create(name="piscine", color="#0000ff")
+        tile_sets = [
+            create_tile_set(name=str(year), year=year) for year in [2023, 2020]
+        ]
+
+        for i, tile_set in enumerate(tile_sets * 2):
+            create_detection(
+                tile_set=tile_set,
+                object_type=object_type,
+                geometry=get_square(2.35 + i * 0.001, 48.85),
+                detection_prescription_status=(
+                    DetectionPrescriptionStatus.PRESCRIBED if i % 2 else None
+                ),
+            )
+
+    def test_same_as_serializer(self):
+        detections = (
+            Detection.objects.order_by("tile_set__date", "id")
+            .select_related("detection_data", "tile_set")
+            .prefetch_related("detection_object__object_type")
+        )
+        expected = json.loads(
+            CamelCaseJSONRenderer().render(
+                DetectionMinimalSerializer(detections, many=True).data
+            )
+        )
+
+        streamed = json.loads("".join(iter_detections_geojson(detections)))
+
+        self.assertEqual(len(streamed["features"]), 4)
+        self.assertEqual(streamed, expected)
+
+    @mock.patch("core.utils.geojson.GEOJSON_FETCH_SIZE", 1)
+    def test_query_runs_before_streaming(self):
+        with self.assertNumQueries(1):
+            chunks = iter_detections_geojson(Detection.objects.all())
+
+        self.assertEqual(len(json.loads("".join(chunks))["features"]), 4)
+
+
+class PrescriptionTestMixin:
+    def setUp(self):
+        super().setUp()
+
+        # tiles of previous tests are deleted with their database
+        clear_tile_ids_cache()
+
+        prescribed_object_type = ObjectType.objects.create(
+            name="piscine", color="#0000ff", prescription_duration_years=5
+        )
+        not_prescribed_object_type = ObjectType.objects.create(
+            name="batiment", color="#ff0000"
+        )
+        tile_sets = {
+            year: create_tile_set(name=str(year), year=year)
+            for year in [2015, 2018, 2021]
+        }
+        geometry = get_square(2.35, 48.85)
+
+        def create_object_detections(object_type, detections):
+            detection_object = DetectionObject.objects.create(object_type=object_type)
+
+            for year, auto_prescribed, detection_prescription_status in detections:
+                create_detection(
+                    tile_set=tile_sets[year],
+                    object_type=object_type,
+                    geometry=geometry,
+                    detection_object=detection_object,
+                    auto_prescribed=auto_prescribed,
+                    detection_prescription_status=detection_prescription_status,
+                )
+
+            return detection_object
+
+        self.detection_objects = [
+            # the 2021 detection gets prescribed
+            create_object_detections(
+                prescribed_object_type,
+                [(2015, False, None), (2018, False, None), (2021, False, None)],
+            ),
+            # the 2018 detection is not prescribed anymore
+            create_object_detections(
+                prescribed_object_type,
+                [
+                    (2018, True, DetectionPrescriptionStatus.PRESCRIBED),
+                    (2021, False, None),
+                ],
+            ),
+            # prescriptions are reset for object types without prescription
+            create_object_detections(
+                not_prescribed_object_type,
+                [
+                    (2015, False, None),
+                    (2021, True, DetectionPrescriptionStatus.PRESCRIBED),
+                ],
+            ),
+            create_object_detections(
+                not_prescribed_object_type,
+                [(2021, False, DetectionPrescriptionStatus.NOT_PRESCRIBED)],
+            ),
+        ]
+        self.detection_object_ids = [
+            detection_object.id for detection_object in self.detection_objects
+        ]
+        self.object_types = [prescribed_object_type, not_prescribed_object_type]
+
+    def get_prescriptions(self):
+        detections = Detection.objects.filter(
+            detection_object_id__in=self.detection_object_ids
+        ).select_related("detection_data")
+
+        return {
+            "detections": sorted(
+                (
+                    detection.id,
+                    detection.auto_prescribed,
+                    detection.detection_data.detection_prescription_status,
+                )
+                for detection in detections
+            ),
+            "detection_histories": sorted(
+                Detection.history.filter(history_type="~").values_list(
+                    "id", "changed_fields"
+                )
+            ),
+            "detection_data_histories": sorted(
+                DetectionData.history.filter(history_type="~").values_list(
+                    "id", "changed_fields"
+                )
+            ),
+        }
+
+
+class PrescriptionTestCase(PrescriptionTestMixin, TestCase):
+    def test_sql_prescriptions_same_as_python_prescriptions(self):
+        with transaction.atomic():
+            compute_prescriptions(self.detection_object_ids)
+            python_prescriptions = self.get_prescriptions()
+            transaction.set_rollback(True)
+
+        compute_prescriptions_sql(detection_object_ids=self.detection_object_ids)
+        sql_prescriptions = self.get_prescriptions()
+
+        self.assertEqual(len(python_prescriptions["detection_histories"]), 3)
+        self.assertEqual(sql_prescriptions, python_prescriptions)
+
+    def test_sql_prescriptions_twice_in_transaction(self):
+        with transaction.atomic():
+            updated_detections = compute_prescriptions_sql(
+                detection_object_ids=self.detection_object_ids
+            )
+            updated_detections_again = compute_prescriptions_sql(
+                detection_object_ids=self.detection_object_ids
+            )
+
+        self.assertEqual(updated_detections, 3)
+        self.assertEqual(updated_detections_again, 0)
+
+
+class TileEnvelopeTestCase(TestCase):
+    def get_tile_xyzs(self):
+        # corners of the world, including the tiles touching the mercator poles, and
+        # a tile in metropolitan France
+        tile_xyzs = [(0, 0, 0), (265388, 180351, 19)]
+
+        for z in [1, 2, 5, 12, 19]:
+            last = 2**z - 1
+            tile_xyzs += [(0, 0, z), (last, 0, z), (0, last, z), (last, last, z)]
+
+        return tile_xyzs
+
+    def get_postgis_envelope(self, x: int, y: int, z: int):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT ST_XMin(envelope), ST_YMin(envelope), ST_XMax(envelope), ST_YMax(envelope)
+                FROM (
+                    SELECT ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326) AS envelope
+                ) AS tile
+                """,
+                [z, x, y],
+            )
+            return cursor.fetchone()
+
+    def test_envelope_same_as_postgis(self):
+        for x, y, z in self.get_tile_xyzs():
+            with self.subTest(x=x, y=y, z=z):
+                envelope = get_tile_envelope(x=x, y=y, z=z)
+                postgis_envelope = self.get_postgis_envelope(x=x, y=y, z=z)
+
+                for value, postgis_value in zip(envelope, postgis_envelope):
+                    self.assertAlmostEqual(value, postgis_value, places=9)
+
+    def test_tile_geometry_same_as_postgis(self):
+        tiles = Tile.objects.bulk_create(
+            [Tile(x=x, y=y, z=z) for x, y, z in self.get_tile_xyzs()]
+        )
+
+        for tile in tiles:
+            with self.subTest(x=tile.x, y=tile.y, z=tile.z):
+                xmin, ymin, xmax, ymax = self.get_postgis_envelope(
+                    x=tile.x, y=tile.y, z=tile.z
+                )
+                postgis_geometry = Polygon.from_bbox((xmin, ymin, xmax, ymax))
+                postgis_geometry.srid = 4326
+
+                self.assertTrue(
+                    tile.geometry.equals_exact(postgis_geometry, tolerance=1e-9)
+                )
+
+    def test_create_tile_server_side_counts_inserted_tiles(self):
+        Tile.objects.create(x=0, y=0, z=2)
+        command = CreateTileCommand()
+
+        call_command(
+            command,
+            x_min=0,
+            x_max=1,
+            y_min=0,
+            y_max=1,
+            z_min=2,
+            z_max=2,
+            server_side=True,
+        )
+
+        self.assertEqual(command.inserted, 3)
+        self.assertEqual(Tile.objects.filter(z=2).count(), 4)
+
+
+class PrescriptionQueueTestCase(PrescriptionTestMixin, TestCase):
+    def get_computed_prescriptions(self):
+        with transaction.atomic():
+            compute_prescriptions(self.detection_object_ids)
+            computed_detections = self.get_prescriptions()["detections"]
+            transaction.set_rollback(True)
+
+        return computed_detections
+
+    def get_queued_ids(self) -> List[int]:
+        return sorted(
+            PrescriptionQueueItem.objects.values_list("detection_object_id", flat=True)
+        )
+
+    @override_settings(PRESCRIPTION_QUEUE_ENABLED=True)
+    def test_schedule_enqueues_with_queue_enabled(self):
+        initial_detections = self.get_prescriptions()["detections"]
+
+        schedule_prescription(self.detection_objects[0])
+
+        self.assertEqual(self.get_queued_ids(), [self.detection_object_ids[0]])
+        self.assertEqual(self.get_prescriptions()["detections"], initial_detections)
+
+    @override_settings(PRESCRIPTION_QUEUE_ENABLED=False)
+    def test_schedule_computes_with_queue_disabled(self):
+        computed_detections = self.get_computed_prescriptions()
+
+        for detection_object in self.detection_objects:
+            schedule_prescription(detection_object)
+
+        self.assertEqual(self.get_queued_ids(), [])
+        self.assertEqual(self.get_prescriptions()["detections"], computed_detections)
+
+    def test_enqueue_twice(self):
+        enqueue_prescriptions([self.detection_object_ids[0]])
+        enqueue_prescriptions(
+            [self.detection_object_ids[0], self.detection_object_ids[0]]
+        )
+
+        self.assertEqual(self.get_queued_ids(), [self.detection_object_ids[0]])
+
+    def test_process_queue(self):
+        computed_detections = self.get_computed_prescriptions()
+        enqueue_prescriptions(self.detection_object_ids)
+
+        computed_detection_objects = ProcessPrescriptionQueueCommand().process_queue(
+            batch_size=3
+        )
+
+        self.assertEqual(computed_detection_objects, 4)
+        self.assertEqual(self.get_queued_ids(), [])
+        self.assertEqual(self.get_prescriptions()["detections"], computed_detections)
+
+    def test_failed_computation_keeps_queue_items(self):
+        initial_detections = self.get_prescriptions()["detections"]
+        enqueue_prescriptions(self.detection_object_ids)
+
+        with mock.patch(
+            "core.management.commands.process_prescription_queue.compute_prescriptions",
+            side_effect=RuntimeError("computation failed"),
+        ):
+            with self.assertRaises(RuntimeError):
+                ProcessPrescriptionQueueCommand().process_queue(batch_size=3)
+
+        self.assertEqual(self.get_queued_ids(), sorted(self.detection_object_ids))
+        self.assertEqual(self.get_prescriptions()["detections"], initial_detections)
+
+
+class ComputePrescriptionCommandTestCase(PrescriptionTestMixin, TransactionTestCase):
+    # detection objects are computed by forked workers, the rows must be committed
+    def setUp(self):
+        super().setUp()
+
+        self.initial_detections = list(
+            Detection.objects.select_related("detection_data")
+        )
+
+    def reset_prescriptions(self):
+        for detection in self.initial_detections:
+            Detection.objects.filter(id=detection.id).update(
+                auto_prescribed=detection.auto_prescribed
+            )
+            DetectionData.objects.filter(id=detection.detection_data_id).update(
+                detection_prescription_status=(
+                    detection.detection_data.detection_prescription_status
+                )
+            )
+
+    def compute_prescription(self, **options):
+        call_command(
+            "compute_prescription",
+            object_type_uuids=[
+                str(object_type.uuid) for object_type in self.object_types
+            ],
+            **options,
+        )
+        return self.get_prescriptions()["detections"]
+
+    @mock.patch("core.management.commands.compute_prescription.BATCH_SIZE", 3)
+    def test_id_ranges_cover_every_detection_object_once(self):
+        # the page size does not divide the count of detection objects
+        object_type_ids = [object_type.id for object_type in self.object_types]
+        id_ranges = get_detection_object_id_ranges(object_type_ids=object_type_ids)
+
+        self.assertEqual([count for _, _, count in id_ranges], [3, 1])
+
+        range_ids = [
+            detection_object_id
+            for id_min, id_max, _ in id_ranges
+            for detection_object_id in DetectionObject.objects.filter(
+                object_type_id__in=object_type_ids, id__gte=id_min, id__lte=id_max
+            ).values_list("id", flat=True)
+        ]
+        self.assertEqual(sorted(range_ids), sorted(self.detection_object_ids))
+
+    @mock.patch("core.management.commands.compute_prescription.BATCH_SIZE", 3)
+    def test_workers_same_as_single_process(self):
+        workers_detections = self.compute_prescription(workers=2)
+        self.reset_prescriptions()
+        single_process_detections = self.compute_prescription(workers=1)
+
+        self.assertNotEqual(
+            single_process_detections,
+            sorted(
+                (
+                    detection.id,
+                    detection.auto_prescribed,
+                    detection.detection_data.detection_prescription_status,
+                )
+                for detection in self.initial_detections
+            ),
+        )
+        self.assertEqual(workers_detections, single_process_detections)
@@ -50,6 +50,14 @@ router.register("detection-data", DetectionDataViewSet, basename="DetectionDataV
 
 urlpatterns = router.urls
 
+urlpatterns += [
+    path(
+        "detection/tiles/<int:z>/<int:x>/<int:y>.mvt",
+        DetectionViewSet.as_view({"get": "tiles"}),
+        name="DetectionTilesView",
+    )
+]
+
 urlpatterns += [
     path("map-settings/", MapSettingsView.as_view(), name="MapSettingsView")
 ]
@@ -0,0 +1,89 @@
+import time
+from typing import Any, Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from common.middlewares.request_cache import get_request_cache
+
+# cached values are invalidated by bumping version counters that are part of their keys
+VERSION_KEY_PREFIX = "version"
+CACHE_MISS = object()
+
+# backends whose values are not seen by the other processes: version bumps would only
+# invalidate the process handling the change
+PROCESS_LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_cache_shared() -> bool:
+    return not isinstance(caches["default"], PROCESS_LOCAL_CACHE_BACKENDS)
+
+
+def get_version_key(name: str) -> str:
+    return f"{VERSION_KEY_PREFIX}:{name}"
+
+
+def get_cache_version(name: str) -> int:
+    version_key = get_version_key(name)
+    version = cache.get(version_key)
+
+    if version is None:
+        # versions start from the current time so that an evicted counter never goes
+        # back to a version used before
+        cache.add(version_key, time.time_ns(), timeout=None)
+        version = cache.get(version_key)
+
+    return version
+
+
+def bump_cache_version(name: str):
+    # values memoized for the current request may depend on the invalidated ones
+    request_cache = get_request_cache()
+
+    if request_cache is not None:
+        request_cache.clear()
+
+    if not is_cache_shared():
+        return
+
+    version_key = get_version_key(name)
+
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.add(version_key, time.time_ns(), timeout=None)
+
+
+def get_or_set_versioned(
+    key: str, version_names: Iterable[str], compute: Callable[[], Any]
+) -> Any:
+    # without a shared backend, values are only memoized for the current request
+    if not is_cache_shared():
+        request_cache = get_request_cache()
+
+        if request_cache is None:
+            return compute()
+
+        value = request_cache.get(key, CACHE_MISS)
+
+        if value is CACHE_MISS:
+            value = request_cache[key] = compute()
+
+        return value
+
+    versions = ":".join(
+        f"{version_name}={get_cache_version(version_name)}"
+        for version_name in version_names
+    )
+    versioned_key = f"{key}:{versions}"
+
+    # None is a valid value to cache
+    value = cache.get(versioned_key, CACHE_MISS)
+
+    if value is CACHE_MISS:
+        value = compute()
+        cache.set(versioned_key, value, timeout=settings.PERMISSIONS_CACHE_TIMEOUT)
+
+    return value
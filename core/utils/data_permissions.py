@@ -1,20 +1,31 @@
+import hashlib
 from typing import List, Optional, Tuple
 from core.contants.order_by import TILE_SETS_ORDER_BYS
 from core.models.object_type import ObjectType
 from core.models.object_type_category import ObjectTypeCategoryObjectTypeStatus
 from core.models.tile_set import TileSet, TileSetStatus, TileSetType
 from core.models.user import UserRole
-from core.models.user_group import UserGroupRight, UserUserGroup
+from core.models.user_group import UserGroupRight
 from django.contrib.gis.db.models.functions import Intersection
-from django.db.models import Q
-from django.db.models import Count
+from django.db.models import Exists, F, OuterRef, Q
 from django.contrib.gis.geos.collections import MultiPolygon
 
 from django.core.exceptions import PermissionDenied
-from django.contrib.gis.db.models.aggregates import Union
 
 from core.utils.postgis import GeometryType, GetGeometryType
-from django.contrib.gis.geos import Point
+from core.utils.cache import bump_cache_version, get_or_set_versioned
+from core.utils.tile_set import TILE_SETS_CACHE_VERSION
+from core.utils.user_group import (
+    USER_GROUPS_CACHE_VERSION,
+    get_user_union_geometry,
+    get_user_user_groups_cache_version,
+)
+from common.middlewares.request_cache import get_request_cache
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.contrib.gis.geos.prepared import PreparedGeometry
+
+
+OBJECT_TYPES_CACHE_VERSION = "object-types"
 
 
 def get_user_tile_sets(
@@ -26,6 +37,127 @@ def get_user_tile_sets(
     filter_tile_set_uuid__in=None,
     order_bys=None,
 ) -> Tuple[List[TileSet], Optional[MultiPolygon]]:
+    # memoized for the request. The ids of the tile sets are also cached across requests
+    # until the tile sets, the user groups or the groups of the user change. When the
+    # ids are computed, the tile sets are listed with their intersections in the same
+    # query, when they come from the cache the intersections are computed again as they
+    # are too large to be cached.
+    key_parts = (
+        user.id,
+        user.user_role,
+        filter_tile_set_status__in,
+        filter_tile_set_type__in,
+        filter_tile_set_contains_point and filter_tile_set_contains_point.hexewkb,
+        filter_tile_set_intersects_geometry
+        and filter_tile_set_intersects_geometry.hexewkb,
+        filter_tile_set_uuid__in and sorted(map(str, filter_tile_set_uuid__in)),
+        order_bys,
+    )
+    key_hash = hashlib.sha1(repr(key_parts).encode()).hexdigest()
+    key = f"user-tile-sets:{user.id}:{key_hash}"
+
+    request_cache = get_request_cache()
+
+    if request_cache is not None and key in request_cache:
+        return request_cache[key]
+
+    computed = {}
+
+    def compute():
+        tile_sets, final_union = compute_user_tile_sets(
+            user=user,
+            filter_tile_set_status__in=filter_tile_set_status__in,
+            filter_tile_set_type__in=filter_tile_set_type__in,
+            filter_tile_set_contains_point=filter_tile_set_contains_point,
+            filter_tile_set_intersects_geometry=filter_tile_set_intersects_geometry,
+            filter_tile_set_uuid__in=filter_tile_set_uuid__in,
+            order_bys=order_bys,
+        )
+        computed["result"] = (list(tile_sets), final_union)
+        return [tile_set.id for tile_set in computed["result"][0]]
+
+    tile_set_ids = get_or_set_versioned(
+        key=f"user-tile-set-ids:{user.id}:{key_hash}",
+        version_names=[
+            TILE_SETS_CACHE_VERSION,
+            USER_GROUPS_CACHE_VERSION,
+            get_user_user_groups_cache_version(user.id),
+        ],
+        compute=compute,
+    )
+
+    if "result" in computed:
+        result = computed["result"]
+    else:
+        # ids from the cache
+        final_union = get_user_final_union(user, filter_tile_set_intersects_geometry)
+        result = (
+            get_tile_sets_with_intersection(
+                user=user,
+                tile_set_ids=tile_set_ids,
+                final_union=final_union,
+                order_bys=order_bys,
+            ),
+            final_union,
+        )
+
+    if request_cache is not None:
+        request_cache[key] = result
+
+    return result
+
+
+def get_user_final_union(
+    user, filter_tile_set_intersects_geometry=None
+) -> Optional[MultiPolygon]:
+    # geometry of the groups of the user restricted to the filter, None for super admins
+    if user.user_role == UserRole.SUPER_ADMIN:
+        return None
+
+    final_union = get_user_union_geometry(user)
+
+    if final_union is not None and filter_tile_set_intersects_geometry:
+        final_union = final_union.intersection(filter_tile_set_intersects_geometry)
+
+    return final_union
+
+
+def get_tile_sets_intersection(user, final_union: Optional[MultiPolygon]):
+    if user.user_role != UserRole.SUPER_ADMIN:
+        return Intersection("coverage_geometry", final_union)
+
+    return F("coverage_geometry")
+
+
+def get_tile_sets_with_intersection(
+    user,
+    tile_set_ids: List[int],
+    final_union: Optional[MultiPolygon],
+    order_bys=None,
+) -> List[TileSet]:
+    if not tile_set_ids:
+        return []
+
+    if order_bys is None:
+        order_bys = TILE_SETS_ORDER_BYS
+
+    return list(
+        TileSet.objects.filter(id__in=tile_set_ids)
+        .defer("coverage_geometry", "coverage_geometry_simplified")
+        .annotate(intersection=get_tile_sets_intersection(user, final_union))
+        .order_by(*order_bys)
+    )
+
+
+def compute_user_tile_sets(
+    user,
+    filter_tile_set_status__in=None,
+    filter_tile_set_type__in=None,
+    filter_tile_set_contains_point=None,
+    filter_tile_set_intersects_geometry=None,
+    filter_tile_set_uuid__in=None,
+    order_bys=None,
+):
     if filter_tile_set_status__in is None:
         filter_tile_set_status__in = [TileSetStatus.VISIBLE, TileSetStatus.HIDDEN]
 
@@ -39,39 +171,32 @@ def get_user_tile_sets(
     if order_bys is None:
         order_bys = TILE_SETS_ORDER_BYS
 
-    if user.user_role != UserRole.SUPER_ADMIN:
-        user_user_groups_with_geo_union = UserUserGroup.objects.filter(
-            user=user
-        ).prefetch_related("user_group__object_type_categories__object_types")
-
-        geo_union = Union("user_group__geo_zones__geometry")
-
-        if filter_tile_set_intersects_geometry:
-            geo_union = Intersection(geo_union, filter_tile_set_intersects_geometry)
+    final_union = get_user_final_union(user, filter_tile_set_intersects_geometry)
+    intersection = get_tile_sets_intersection(user, final_union)
 
-        user_user_groups_with_geo_union = user_user_groups_with_geo_union.annotate(
-            geo_union=geo_union
+    # coverages are only needed through the intersection
+    tile_sets = (
+        TileSet.objects.filter(
+            tile_set_status__in=filter_tile_set_status__in,
+            tile_set_type__in=filter_tile_set_type__in,
         )
+        .defer("coverage_geometry", "coverage_geometry_simplified")
+        .order_by(*order_bys)
+    )
 
-        final_union = user_user_groups_with_geo_union.aggregate(
-            total_geo_union=Union("geo_union")
-        )["total_geo_union"]
-        intersection = Intersection("union_geometry", final_union)
-    else:
-        final_union = None
-        intersection = Union("geo_zones__geometry")
-
-    tile_sets = TileSet.objects.filter(
-        tile_set_status__in=filter_tile_set_status__in,
-        tile_set_type__in=filter_tile_set_type__in,
-    ).order_by(*order_bys)
+    # tile sets without geo zones are not restricted, tile sets with geo zones but
+    # without coverage (e.g. zones without geometry) give no access
+    no_geo_zones = ~Exists(
+        TileSet.geo_zones.through.objects.filter(tileset_id=OuterRef("pk"))
+    )
 
-    union_geometry = Union("geo_zones__geometry")
+    if final_union is not None:
+        tile_sets = tile_sets.filter(
+            Q(coverage_geometry__intersects=final_union) | no_geo_zones
+        )
 
     tile_sets = tile_sets.annotate(
-        union_geometry=union_geometry,
         intersection=intersection,
-        geo_zones_count=Count("geo_zones"),
         intersection_type=GetGeometryType("intersection"),
     )
 
@@ -85,19 +210,18 @@ def get_user_tile_sets(
                 ]
             )
         )
-        | Q(geo_zones_count=0)
+        | no_geo_zones
     )
 
     if filter_tile_set_contains_point:
         tile_sets = tile_sets.filter(
-            Q(intersection__contains=filter_tile_set_contains_point)
-            | Q(geo_zones_count=0)
+            Q(intersection__contains=filter_tile_set_contains_point) | no_geo_zones
         )
 
     if filter_tile_set_intersects_geometry:
         tile_sets = tile_sets.filter(
             Q(intersection__intersects=filter_tile_set_intersects_geometry)
-            | Q(geo_zones_count=0)
+            | no_geo_zones
         )
 
     if filter_tile_set_uuid__in:
@@ -106,8 +230,28 @@ def get_user_tile_sets(
     return tile_sets, final_union
 
 
+def invalidate_object_types():
+    bump_cache_version(OBJECT_TYPES_CACHE_VERSION)
+
+
 def get_user_object_types_with_status(
     user,
+) -> List[Tuple[ObjectType, ObjectTypeCategoryObjectTypeStatus]]:
+    # cached until object types, their categories, the user groups or the groups of the
+    # user change
+    return get_or_set_versioned(
+        key=f"user-object-types-with-status:{user.id}:{user.user_role}",
+        version_names=[
+            OBJECT_TYPES_CACHE_VERSION,
+            USER_GROUPS_CACHE_VERSION,
+            get_user_user_groups_cache_version(user.id),
+        ],
+        compute=lambda: compute_user_object_types_with_status(user),
+    )
+
+
+def compute_user_object_types_with_status(
+    user,
 ) -> List[Tuple[ObjectType, ObjectTypeCategoryObjectTypeStatus]]:
     if user.user_role == UserRole.SUPER_ADMIN:
         object_types = ObjectType.objects.order_by("name").all()
@@ -160,26 +304,68 @@ def get_user_object_types_with_status(
     return object_types_with_status
 
 
+ALL_USER_GROUP_RIGHTS = [
+    UserGroupRight.WRITE,
+    UserGroupRight.ANNOTATE,
+    UserGroupRight.READ,
+]
+
+
+def get_user_groups_geometries_rights(
+    user,
+) -> List[Tuple[GEOSGeometry, List[UserGroupRight]]]:
+    # geometries and rights of the groups of the user, cached until they change
+    return get_or_set_versioned(
+        key=f"user-groups-geometries-rights:{user.id}",
+        version_names=[
+            USER_GROUPS_CACHE_VERSION,
+            get_user_user_groups_cache_version(user.id),
+        ],
+        compute=lambda: [
+            (
+                user_user_group.user_group.union_geometry,
+                user_user_group.user_group_rights,
+            )
+            for user_user_group in user.user_user_groups.select_related("user_group")
+            if user_user_group.user_group.union_geometry is not None
+        ],
+    )
+
+
+def get_user_groups_prepared_geometries_rights(
+    user,
+) -> List[Tuple[PreparedGeometry, List[UserGroupRight]]]:
+    # prepared geometries can not be cached across requests, they are kept for the
+    # request as preparing large geometries is not free either
+    request_cache = get_request_cache()
+    key = f"user-groups-prepared-geometries-rights:{user.id}"
+
+    if request_cache is not None and key in request_cache:
+        return request_cache[key]
+
+    prepared_geometries_rights = [
+        (geometry.prepared, rights)
+        for geometry, rights in get_user_groups_geometries_rights(user)
+    ]
+
+    if request_cache is not None:
+        request_cache[key] = prepared_geometries_rights
+
+    return prepared_geometries_rights
+
+
 def get_user_group_rights(
     user, points: List[Point], raise_if_has_no_right: Optional[UserGroupRight] = None
 ) -> List[UserGroupRight]:
+    # rights given by the groups containing all the points
     if user.user_role == UserRole.SUPER_ADMIN:
-        return [
-            UserGroupRight.WRITE,
-            UserGroupRight.ANNOTATE,
-            UserGroupRight.READ,
-        ]
-
-    user_user_groups = user.user_user_groups.annotate(
-        union_geometry=Union("user_group__geo_zones__geometry")
-    )
-    for point in points:
-        user_user_groups = user_user_groups.filter(union_geometry__contains=point)
+        return list(ALL_USER_GROUP_RIGHTS)
 
     user_group_rights = set()
 
-    for user_user_group in user_user_groups:
-        user_group_rights.update(user_user_group.user_group_rights)
+    for prepared_geometry, rights in get_user_groups_prepared_geometries_rights(user):
+        if all(prepared_geometry.contains(point) for point in points):
+            user_group_rights.update(rights)
 
     res = list(user_group_rights)
 
@@ -187,3 +373,28 @@ def get_user_group_rights(
         raise PermissionDenied("Vous n'avez pas les droits pour éditer cette zone")
 
     return res
+
+
+def get_user_group_rights_by_point(
+    user, points: List[Point], raise_if_has_no_right: Optional[UserGroupRight] = None
+) -> List[List[UserGroupRight]]:
+    # rights of each point, given by the groups containing it
+    if user.user_role == UserRole.SUPER_ADMIN:
+        return [list(ALL_USER_GROUP_RIGHTS) for _ in points]
+
+    prepared_geometries_rights = get_user_groups_prepared_geometries_rights(user)
+    res = []
+
+    for point in points:
+        point_rights = set()
+
+        for prepared_geometry, rights in prepared_geometries_rights:
+            if prepared_geometry.contains(point):
+                point_rights.update(rights)
+
+        if raise_if_has_no_right and raise_if_has_no_right not in point_rights:
+            raise PermissionDenied("Vous n'avez pas les droits pour éditer cette zone")
+
+        res.append(list(point_rights))
+
+    return res
@@ -1,7 +1,8 @@
-from typing import Iterable, List
+from typing import Iterable, List, Optional, Tuple
 
 from core.models.detection import Detection
 from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
 
 from django.contrib.gis.db.models.functions import Intersection, Area
 from django.db.models import Value
@@ -47,3 +48,81 @@ def get_linked_detections(
             >= detection.geometry.area * PERCENTAGE_SAME_DETECTION_THRESHOLD
         ]
     )
+
+
+def get_linked_detections_batch(
+    detection_geometries_object_type_ids: List[Tuple[GEOSGeometry, int]],
+    exclude_tile_set_ids: Iterable[int],
+    tile_set_ids: Optional[Iterable[int]] = None,
+) -> List[Optional[Detection]]:
+    # set-based version of get_linked_detections: for each (geometry, object type id)
+    # returns the linked detection with the best overlap, in a single query
+    if not detection_geometries_object_type_ids:
+        return []
+
+    tile_set_ids_where = (
+        "AND detection.tile_set_id = ANY(%(tile_set_ids)s)"
+        if tile_set_ids is not None
+        else ""
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT input.idx, linked.id
+            FROM unnest(
+                %(idxs)s::integer[],
+                %(geometries)s::text[],
+                %(object_type_ids)s::bigint[]
+            ) AS input(idx, geometry_hexewkb, object_type_id)
+            CROSS JOIN LATERAL (
+                SELECT ST_GeomFromEWKB(decode(input.geometry_hexewkb, 'hex')) AS geometry
+            ) AS input_geometry
+            CROSS JOIN LATERAL (
+                SELECT detection.id
+                FROM core_detection AS detection
+                JOIN core_detectionobject AS detection_object
+                    ON detection_object.id = detection.detection_object_id
+                WHERE detection_object.object_type_id = input.object_type_id
+                AND NOT detection.tile_set_id = ANY(%(exclude_tile_set_ids)s)
+                {tile_set_ids_where}
+                AND ST_Intersects(detection.geometry, input_geometry.geometry)
+                AND (
+                    ST_Area(ST_Intersection(detection.geometry, input_geometry.geometry))
+                        >= ST_Area(input_geometry.geometry) * %(threshold)s
+                    OR ST_Area(ST_Intersection(detection.geometry, input_geometry.geometry))
+                        >= ST_Area(detection.geometry) * %(threshold)s
+                )
+                ORDER BY
+                    ST_Area(ST_Intersection(detection.geometry, input_geometry.geometry)) DESC
+                LIMIT 1
+            ) AS linked
+            """,
+            {
+                "idxs": list(range(len(detection_geometries_object_type_ids))),
+                "geometries": [
+                    geometry.hexewkb.decode()
+                    for geometry, _ in detection_geometries_object_type_ids
+                ],
+                "object_type_ids": [
+                    object_type_id
+                    for _, object_type_id in detection_geometries_object_type_ids
+                ],
+                "exclude_tile_set_ids": list(exclude_tile_set_ids),
+                "tile_set_ids": list(tile_set_ids or []),
+                "threshold": PERCENTAGE_SAME_DETECTION_THRESHOLD,
+            },
+        )
+        idx_linked_detection_id_map = dict(cursor.fetchall())
+
+    linked_detections_map = Detection.objects.select_related(
+        "detection_object",
+        "detection_object__object_type",
+        "detection_data",
+        "tile_set",
+    ).in_bulk(list(set(idx_linked_detection_id_map.values())))
+
+    return [
+        linked_detections_map.get(idx_linked_detection_id_map.get(idx))
+        for idx in range(len(detection_geometries_object_type_ids))
+    ]
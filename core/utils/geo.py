@@ -1,5 +1,7 @@
+import math
 from typing import List
 from django.contrib.gis.db.models.aggregates import Union
+from django.contrib.gis.geos import GEOSGeometry, Polygon
 
 
 from core.models.geo_zone import GeoZone
@@ -16,3 +18,34 @@ def get_geometry(
     return GeoZone.objects.filter(uuid__in=geozone_uuids).aggregate(
         union_geometry=Union("geometry")
     )["union_geometry"]
+
+
+# bounding boxes are snapped to a grid made of about this number of cells per side
+BBOX_QUANTIZATION_STEPS = 8
+
+
+def quantize_bbox(geometry: GEOSGeometry) -> GEOSGeometry:
+    # expands a rectangle to a grid whose step depends on its size, so that close
+    # viewports give the same geometry. Other geometries are returned as is.
+    if geometry.geom_type != "Polygon" or not geometry.equals(geometry.envelope):
+        return geometry
+
+    xmin, ymin, xmax, ymax = geometry.extent
+    size = max(xmax - xmin, ymax - ymin)
+
+    if size <= 0:
+        return geometry
+
+    step = 2 ** math.floor(math.log2(size / BBOX_QUANTIZATION_STEPS))
+
+    quantized_geometry = Polygon.from_bbox(
+        (
+            math.floor(xmin / step) * step,
+            math.floor(ymin / step) * step,
+            math.ceil(xmax / step) * step,
+            math.ceil(ymax / step) * step,
+        )
+    )
+    quantized_geometry.srid = geometry.srid
+
+    return quantized_geometry
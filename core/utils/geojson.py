@@ -0,0 +1,83 @@
+from typing import Iterator, List, Tuple
+
+from django.db import connection
+from django.db.models import QuerySet
+
+from core.models.detection import Detection
+from core.models.detection_data import DetectionData
+from core.models.detection_object import DetectionObject
+from core.models.object_type import ObjectType
+from core.models.tile_set import TileSet
+
+GEOJSON_FETCH_SIZE = 2000
+# same precision as GEOSGeometry.geojson
+GEOJSON_MAX_DECIMAL_DIGITS = 15
+
+
+def iter_detections_geojson(detections: QuerySet) -> Iterator[str]:
+    # feature collection of the detections built by the database and streamed by
+    # chunks, features are the same as DetectionMinimalSerializer rendered by
+    # CamelCaseJSONRenderer. The query runs and the first chunk is fetched when this is
+    # called, so that errors are raised before anything is sent.
+    detection_ids_sql, detection_ids_params = (
+        detections.order_by().values("id").query.sql_with_params()
+    )
+
+    cursor = connection.chunked_cursor()
+
+    try:
+        cursor.execute(
+            f"""
+            SELECT json_build_object(
+                'type', 'Feature',
+                'geometry', ST_AsGeoJSON(
+                    detection.geometry, {GEOJSON_MAX_DECIMAL_DIGITS}
+                )::json,
+                'properties', json_build_object(
+                    'uuid', detection.uuid,
+                    'objectTypeUuid', object_type.uuid,
+                    'objectTypeColor', object_type.color,
+                    'detectionControlStatus',
+                        detection_data.detection_control_status,
+                    'detectionValidationStatus',
+                        detection_data.detection_validation_status,
+                    'detectionPrescriptionStatus',
+                        detection_data.detection_prescription_status,
+                    'detectionObjectUuid', detection_object.uuid,
+                    'tileSetType', tile_set.tile_set_type
+                )
+            )::text
+            FROM {Detection._meta.db_table} AS detection
+            JOIN {DetectionData._meta.db_table} AS detection_data
+                ON detection_data.id = detection.detection_data_id
+            JOIN {DetectionObject._meta.db_table} AS detection_object
+                ON detection_object.id = detection.detection_object_id
+            JOIN {ObjectType._meta.db_table} AS object_type
+                ON object_type.id = detection_object.object_type_id
+            JOIN {TileSet._meta.db_table} AS tile_set
+                ON tile_set.id = detection.tile_set_id
+            WHERE detection.id IN ({detection_ids_sql})
+            ORDER BY tile_set.date, detection.id
+            """,
+            detection_ids_params,
+        )
+        rows = cursor.fetchmany(GEOJSON_FETCH_SIZE)
+    except Exception:
+        cursor.close()
+        raise
+
+    return iter_feature_collection(cursor, rows)
+
+
+def iter_feature_collection(cursor, rows: List[Tuple[str]]) -> Iterator[str]:
+    with cursor:
+        yield '{"type":"FeatureCollection","features":['
+
+        separator = ""
+
+        while rows:
+            yield separator + ",".join(row[0] for row in rows)
+            separator = ","
+            rows = cursor.fetchmany(GEOJSON_FETCH_SIZE)
+
+        yield "]}"
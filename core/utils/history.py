@@ -0,0 +1,49 @@
+from typing import Any, Iterable, Optional
+
+from django.db import connection, models
+from simple_history.utils import get_history_model_for_model
+
+
+def insert_historical_records(
+    model: models.Model,
+    where_sql: str,
+    params: Optional[Iterable[Any]] = None,
+    history_type: str = "+",
+    changed_fields_sql: str = "'[]'::jsonb",
+) -> int:
+    # set-based equivalent of bulk_history_create: copy the current state of the rows
+    # matching where_sql into the historical table with a single INSERT ... SELECT
+    history_model = get_history_model_for_model(model)
+    quote_name = connection.ops.quote_name
+
+    tracked_columns = ", ".join(
+        [quote_name(field.column) for field in history_model.tracked_fields]
+    )
+    history_user_column = quote_name(
+        history_model._meta.get_field("history_user").column
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {quote_name(history_model._meta.db_table)} (
+                {tracked_columns},
+                history_date,
+                history_change_reason,
+                history_type,
+                {history_user_column},
+                changed_fields
+            )
+            SELECT
+                {tracked_columns},
+                now(),
+                NULL,
+                %s,
+                NULL,
+                {changed_fields_sql}
+            FROM {quote_name(model._meta.db_table)}
+            WHERE {where_sql}
+            """,
+            [history_type] + list(params or []),
+        )
+        return cursor.rowcount
@@ -0,0 +1,55 @@
+from django.db import connection
+from django.db.models import QuerySet
+
+from core.models.detection import Detection
+from core.models.detection_data import DetectionData
+from core.models.detection_object import DetectionObject
+from core.models.object_type import ObjectType
+
+# same defaults as ST_AsMVT / ST_AsMVTGeom
+MVT_EXTENT = 4096
+MVT_BUFFER = 256
+MVT_LAYER_NAME = "detections"
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+def get_detections_mvt(detections: QuerySet, z: int, x: int, y: int) -> bytes:
+    # vector tile of the detections of the queryset, with the minimal properties needed
+    # to draw them: features are clipped and encoded by PostGIS
+    detection_ids_sql, detection_ids_params = (
+        detections.order_by().values("id").query.sql_with_params()
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT ST_AsMVT(tile_detection, '{MVT_LAYER_NAME}', {MVT_EXTENT}, 'geometry')
+            FROM (
+                SELECT
+                    ST_AsMVTGeom(
+                        ST_Transform(detection.geometry, 3857),
+                        ST_TileEnvelope(%s, %s, %s),
+                        {MVT_EXTENT},
+                        {MVT_BUFFER},
+                        true
+                    ) AS geometry,
+                    detection.uuid::text AS uuid,
+                    detection_data.detection_validation_status AS status,
+                    object_type.color AS object_type_color
+                FROM {Detection._meta.db_table} AS detection
+                JOIN {DetectionData._meta.db_table} AS detection_data
+                    ON detection_data.id = detection.detection_data_id
+                JOIN {DetectionObject._meta.db_table} AS detection_object
+                    ON detection_object.id = detection.detection_object_id
+                JOIN {ObjectType._meta.db_table} AS object_type
+                    ON object_type.id = detection_object.object_type_id
+                WHERE detection.id IN ({detection_ids_sql})
+                AND detection.geometry && ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
+            ) AS tile_detection
+            WHERE tile_detection.geometry IS NOT NULL
+            """,
+            [z, x, y] + list(detection_ids_params) + [z, x, y],
+        )
+        mvt = cursor.fetchone()[0]
+
+    return bytes(mvt) if mvt else b""
@@ -0,0 +1,41 @@
+from typing import List, Optional
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
+
+from core.models.parcel import Parcel
+
+
+def get_parcel_ids(points: List[GEOSGeometry]) -> List[Optional[int]]:
+    # set-based version of Parcel.objects.filter(geometry__contains=point).first():
+    # returns the id of the parcel containing each point in a single query
+    if not points:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT input.idx, parcel.id
+            FROM unnest(
+                %(idxs)s::integer[],
+                %(points)s::text[]
+            ) AS input(idx, point_hexewkb)
+            CROSS JOIN LATERAL (
+                SELECT parcel.id
+                FROM {Parcel._meta.db_table} AS parcel
+                WHERE ST_Contains(
+                    parcel.geometry,
+                    ST_GeomFromEWKB(decode(input.point_hexewkb, 'hex'))
+                )
+                ORDER BY parcel.id
+                LIMIT 1
+            ) AS parcel
+            """,
+            {
+                "idxs": list(range(len(points))),
+                "points": [point.hexewkb.decode() for point in points],
+            },
+        )
+        idx_parcel_id_map = dict(cursor.fetchall())
+
+    return [idx_parcel_id_map.get(idx) for idx in range(len(points))]
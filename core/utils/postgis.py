@@ -1,27 +1,8 @@
-from django.db import connection
 from django.db.models import Func, CharField, TextChoices
 
 from django.contrib.gis.db import models as models_gis
 
 
-def ST_TileEnvelope(z: int, x: int, y: int):
-    with connection.cursor() as cursor:
-        cursor.execute(
-            """
-            SELECT 
-                ST_AsText(
-                    ST_Transform(
-                       ST_TileEnvelope(%s, %s, %s), 
-                       4326
-                    )
-                )
-        """,
-            [z, x, y],
-        )
-        row = cursor.fetchone()
-        return row[0] if row else None
-
-
 class Simplify(Func):
     function = "ST_Simplify"
     output_field = models_gis.GeometryField()
@@ -1,19 +1,30 @@
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
 from core.models.detection import Detection
 from core.models.detection_data import DetectionData, DetectionPrescriptionStatus
 from core.models.detection_object import DetectionObject
+from core.models.object_type import ObjectType
+from core.models.prescription_queue_item import PrescriptionQueueItem
+from core.utils.history import insert_historical_records
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import connection, transaction
 from simple_history.utils import bulk_update_with_history
 
+PRESCRIPTION_BATCH_SIZE = 1000
 
-def compute_prescription(detection_object: DetectionObject) -> DetectionObject:
-    object_type = detection_object.object_type
+
+def get_prescription_changes(
+    object_type: ObjectType, detections: List[Detection]
+) -> Tuple[List[Detection], List[DetectionData]]:
+    # returns the detections and detection datas of a detection object to update
+    detections_to_update = []
+    detections_data_to_update = []
 
     # if prescription do not apply to this object type, we reset all prescriptions
     if not object_type.prescription_duration_years:
-        detections_to_update = []
-        detections_data_to_update = []
-
-        for detection in detection_object.detections.all():
+        for detection in detections:
             if detection.auto_prescribed:
                 detection.auto_prescribed = False
                 detections_to_update.append(detection)
@@ -22,34 +33,18 @@ def compute_prescription(detection_object: DetectionObject) -> DetectionObject:
                 detection.detection_data.detection_prescription_status = None
                 detections_data_to_update.append(detection.detection_data)
 
-        if detections_to_update:
-            bulk_update_with_history(
-                detections_to_update, Detection, ["auto_prescribed"]
-            )
-
-        if detections_data_to_update:
-            bulk_update_with_history(
-                detections_data_to_update,
-                DetectionData,
-                ["detection_prescription_status"],
-            )
-
-        return detection_object
+        return detections_to_update, detections_data_to_update
 
-    detections = list(detection_object.detections.all())
     detections = sorted(detections, key=lambda detection: detection.tile_set.date)
 
     if not detections:
-        return detection_object
+        return detections_to_update, detections_data_to_update
 
     oldest_detection = detections[0]
     oldest_detection_date = oldest_detection.tile_set.date
 
     prescription_duration_years = object_type.prescription_duration_years
 
-    detections_to_update = []
-    detections_data_to_update = []
-
     for detection in detections:
         detection_date = detection.tile_set.date
 
@@ -77,6 +72,13 @@ def compute_prescription(detection_object: DetectionObject) -> DetectionObject:
             detections_to_update.append(detection)
             detections_data_to_update.append(detection.detection_data)
 
+    return detections_to_update, detections_data_to_update
+
+
+def save_prescription_changes(
+    detections_to_update: List[Detection],
+    detections_data_to_update: List[DetectionData],
+):
     if detections_to_update:
         bulk_update_with_history(detections_to_update, Detection, ["auto_prescribed"])
 
@@ -85,4 +87,234 @@ def compute_prescription(detection_object: DetectionObject) -> DetectionObject:
             detections_data_to_update, DetectionData, ["detection_prescription_status"]
         )
 
+
+def compute_prescription(detection_object: DetectionObject) -> DetectionObject:
+    detections_to_update, detections_data_to_update = get_prescription_changes(
+        object_type=detection_object.object_type,
+        detections=list(detection_object.detections.all()),
+    )
+    save_prescription_changes(detections_to_update, detections_data_to_update)
+
     return detection_object
+
+
+def compute_prescriptions(detection_object_ids: Iterable[int]):
+    # set-based version of compute_prescription: detections of the detection objects
+    # are loaded with a single query per batch and the changes are saved in bulk
+    detection_object_ids = sorted(set(detection_object_ids))
+
+    for i in range(0, len(detection_object_ids), PRESCRIPTION_BATCH_SIZE):
+        detections = Detection.objects.filter(
+            detection_object_id__in=detection_object_ids[
+                i : i + PRESCRIPTION_BATCH_SIZE
+            ]
+        ).select_related("detection_data", "tile_set", "detection_object__object_type")
+
+        detections_by_detection_object_id = defaultdict(list)
+
+        for detection in detections:
+            detections_by_detection_object_id[detection.detection_object_id].append(
+                detection
+            )
+
+        detections_to_update = []
+        detections_data_to_update = []
+
+        for object_detections in detections_by_detection_object_id.values():
+            object_detections_to_update, object_detections_data_to_update = (
+                get_prescription_changes(
+                    object_type=object_detections[0].detection_object.object_type,
+                    detections=object_detections,
+                )
+            )
+            detections_to_update += object_detections_to_update
+            detections_data_to_update += object_detections_data_to_update
+
+        save_prescription_changes(detections_to_update, detections_data_to_update)
+
+
+def compute_prescriptions_sql(
+    object_type_ids: Optional[Iterable[int]] = None,
+    detection_object_ids: Optional[Iterable[int]] = None,
+) -> int:
+    # database-side version of compute_prescriptions: the age of each detection relative
+    # to the oldest detection of its object is computed with a window function, only
+    # the rows whose prescription changes are updated and get a history record
+    where_clauses = []
+    params = {
+        "prescribed": DetectionPrescriptionStatus.PRESCRIBED.value,
+        "not_prescribed": DetectionPrescriptionStatus.NOT_PRESCRIBED.value,
+    }
+
+    if object_type_ids is not None:
+        where_clauses.append(
+            "detection_object.object_type_id = ANY(%(object_type_ids)s)"
+        )
+        params["object_type_ids"] = list(object_type_ids)
+
+    if detection_object_ids is not None:
+        where_clauses.append(
+            "detection.detection_object_id = ANY(%(detection_object_ids)s)"
+        )
+        params["detection_object_ids"] = list(detection_object_ids)
+
+    where_sql = " AND ".join(where_clauses) or "true"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # the table of a previous call in the same transaction is only dropped on commit
+        cursor.execute("DROP TABLE IF EXISTS prescription_changes")
+        cursor.execute(
+            f"""
+            CREATE TEMPORARY TABLE prescription_changes ON COMMIT DROP AS
+            WITH detection_prescription AS (
+                SELECT
+                    detection.id AS detection_id,
+                    detection.detection_data_id,
+                    detection.auto_prescribed,
+                    detection_data.detection_prescription_status,
+                    COALESCE(object_type.prescription_duration_years, 0) = 0
+                        AS prescription_disabled,
+                    extract(
+                        year FROM age(
+                            tile_set.date,
+                            min(tile_set.date) OVER (
+                                PARTITION BY detection.detection_object_id
+                            )
+                        )
+                    ) >= object_type.prescription_duration_years AS prescribed
+                FROM core_detection AS detection
+                JOIN core_detectionobject AS detection_object
+                    ON detection_object.id = detection.detection_object_id
+                JOIN core_objecttype AS object_type
+                    ON object_type.id = detection_object.object_type_id
+                JOIN core_tileset AS tile_set
+                    ON tile_set.id = detection.tile_set_id
+                JOIN core_detectiondata AS detection_data
+                    ON detection_data.id = detection.detection_data_id
+                WHERE {where_sql}
+            ), prescription_change AS (
+                SELECT
+                    detection_id,
+                    detection_data_id,
+                    auto_prescribed AS old_auto_prescribed,
+                    detection_prescription_status AS old_prescription_status,
+                    CASE
+                        WHEN prescription_disabled THEN false
+                        ELSE prescribed
+                    END AS new_auto_prescribed,
+                    CASE
+                        WHEN prescription_disabled THEN NULL
+                        WHEN prescribed THEN %(prescribed)s
+                        ELSE %(not_prescribed)s
+                    END AS new_prescription_status,
+                    CASE
+                        WHEN prescription_disabled THEN auto_prescribed
+                        ELSE auto_prescribed <> prescribed
+                    END AS update_detection,
+                    CASE
+                        WHEN prescription_disabled
+                            THEN detection_prescription_status IS NOT NULL
+                        ELSE auto_prescribed <> prescribed
+                    END AS update_detection_data
+                FROM detection_prescription
+            )
+            SELECT *
+            FROM prescription_change
+            WHERE update_detection OR update_detection_data
+            """,
+            params,
+        )
+
+        cursor.execute(
+            """
+            UPDATE core_detection AS detection
+            SET auto_prescribed = prescription_changes.new_auto_prescribed
+            FROM prescription_changes
+            WHERE detection.id = prescription_changes.detection_id
+            AND prescription_changes.update_detection
+            """
+        )
+        updated_detections = cursor.rowcount
+
+        cursor.execute(
+            """
+            UPDATE core_detectiondata AS detection_data
+            SET detection_prescription_status = prescription_changes.new_prescription_status
+            FROM prescription_changes
+            WHERE detection_data.id = prescription_changes.detection_data_id
+            AND prescription_changes.update_detection_data
+            """
+        )
+
+        # same changed_fields format as common.models.historied.track_changed_fields
+        insert_historical_records(
+            Detection,
+            where_sql="""id IN (
+                SELECT detection_id FROM prescription_changes WHERE update_detection
+            )""",
+            history_type="~",
+            changed_fields_sql="""jsonb_build_array(jsonb_build_object(
+                'field', 'auto_prescribed',
+                'old_value', NOT auto_prescribed,
+                'new_value', auto_prescribed
+            ))""",
+        )
+        insert_historical_records(
+            DetectionData,
+            where_sql="""id IN (
+                SELECT detection_data_id FROM prescription_changes
+                WHERE update_detection_data
+            )""",
+            history_type="~",
+            changed_fields_sql="""(
+                SELECT jsonb_build_array(jsonb_build_object(
+                    'field', 'detection_prescription_status',
+                    'old_value', prescription_changes.old_prescription_status,
+                    'new_value', prescription_changes.new_prescription_status
+                ))
+                FROM prescription_changes
+                WHERE prescription_changes.detection_data_id = core_detectiondata.id
+            )""",
+        )
+
+    return updated_detections
+
+
+def enqueue_prescriptions(detection_object_ids: Iterable[int]):
+    PrescriptionQueueItem.objects.bulk_create(
+        [
+            PrescriptionQueueItem(detection_object_id=detection_object_id)
+            for detection_object_id in set(detection_object_ids)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def dequeue_prescriptions(batch_size: int) -> List[int]:
+    # must be called in a transaction: queue items are deleted and locked until the
+    # prescriptions are computed, concurrent workers skip them
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {PrescriptionQueueItem._meta.db_table}
+            WHERE id IN (
+                SELECT id FROM {PrescriptionQueueItem._meta.db_table}
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING detection_object_id
+            """,
+            [batch_size],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def schedule_prescription(detection_object: DetectionObject):
+    # with the prescription queue enabled, prescription is computed in background by
+    # the process_prescription_queue command instead of during the request
+    if settings.PRESCRIPTION_QUEUE_ENABLED:
+        enqueue_prescriptions([detection_object.id])
+        return
+
+    compute_prescription(detection_object)
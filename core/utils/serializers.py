@@ -1,5 +1,11 @@
+import re
 import uuid
+from enum import Enum
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
+from rest_framework.fields import SkipField, empty, get_error_detail
 
 
 class CommaSeparatedUUIDField(serializers.Field):
@@ -41,3 +47,178 @@ class CommaSeparatedStringField(serializers.Field):
         if isinstance(value, list):
             return ",".join([str(v) for v in value])
         return value
+
+
+# characters rejected by the default validators of CharField
+CHAR_FIELD_PROHIBITED_CHARACTERS_REGEX = re.compile("[\x00\ud800-\udfff]")
+
+
+class CompiledRowValidator:
+    """
+    Validates flat rows like serializer_class(data=row).is_valid() does, with the
+    same defaults, choices and error messages, but the field checks are compiled
+    once instead of instantiating the serializer and its fields for each row.
+    Fields without a fast path are validated by the serializer field itself.
+    """
+
+    def __init__(self, serializer_class: Type[serializers.Serializer]):
+        self.serializer = serializer_class()
+        self.field_validators = [
+            (field.field_name, self.compile_field(field))
+            for field in self.serializer._writable_fields
+        ]
+        self.validate_serializer = (
+            self.serializer.validate
+            if type(self.serializer).validate is not serializers.Serializer.validate
+            else None
+        )
+
+    def compile_field(self, field: serializers.Field) -> Callable[[Any], Any]:
+        to_internal_value = self.compile_to_internal_value(field)
+        validate_method = getattr(self.serializer, f"validate_{field.field_name}", None)
+
+        required = field.required
+        allow_null = field.allow_null
+        default = field.default
+        is_char_field = isinstance(field, serializers.CharField)
+        allow_blank = getattr(field, "allow_blank", False)
+        trim_whitespace = getattr(field, "trim_whitespace", False)
+
+        def validate_field(value: Any) -> Any:
+            if is_char_field and (
+                value == "" or (trim_whitespace and str(value).strip() == "")
+            ):
+                if not allow_blank:
+                    field.fail("blank")
+                validated_value = ""
+            elif value is empty:
+                if required:
+                    field.fail("required")
+                if default is empty:
+                    raise SkipField()
+                validated_value = default() if callable(default) else default
+            elif value is None:
+                if not allow_null:
+                    field.fail("null")
+                validated_value = None
+            else:
+                validated_value = to_internal_value(value)
+
+            if validate_method is not None:
+                validated_value = validate_method(validated_value)
+
+            return validated_value
+
+        return validate_field
+
+    def compile_to_internal_value(
+        self, field: serializers.Field
+    ) -> Callable[[Any], Any]:
+        field_class = type(field)
+
+        if field_class is serializers.ChoiceField:
+            choices = field.choice_strings_to_values
+            allow_blank = field.allow_blank
+
+            def to_internal_value(value: Any) -> Any:
+                if value == "" and allow_blank:
+                    return ""
+                if isinstance(value, Enum):
+                    return field.to_internal_value(value)
+                try:
+                    return choices[str(value)]
+                except KeyError:
+                    field.fail("invalid_choice", input=value)
+
+        elif field_class is serializers.BooleanField:
+            true_values = field.TRUE_VALUES
+            false_values = field.FALSE_VALUES
+            null_values = field.NULL_VALUES if field.allow_null else set()
+
+            def to_internal_value(value: Any) -> Any:
+                lower_value = value.lower() if isinstance(value, str) else value
+                try:
+                    if lower_value in true_values:
+                        return True
+                    if lower_value in false_values:
+                        return False
+                    if lower_value in null_values:
+                        return None
+                except TypeError:
+                    pass
+                field.fail("invalid", input=value)
+
+        elif field_class is serializers.IntegerField and not field.validators:
+            max_string_length = field.MAX_STRING_LENGTH
+            re_decimal = field.re_decimal
+
+            def to_internal_value(value: Any) -> Any:
+                if isinstance(value, int) and not isinstance(value, bool):
+                    return value
+                if isinstance(value, str) and len(value) > max_string_length:
+                    field.fail("max_string_length")
+                try:
+                    return int(re_decimal.sub("", str(value)))
+                except (ValueError, TypeError):
+                    field.fail("invalid")
+
+        elif field_class is serializers.FloatField and not field.validators:
+            max_string_length = field.MAX_STRING_LENGTH
+
+            def to_internal_value(value: Any) -> Any:
+                if isinstance(value, str) and len(value) > max_string_length:
+                    field.fail("max_string_length")
+                try:
+                    return float(value)
+                except (TypeError, ValueError):
+                    field.fail("invalid")
+                except OverflowError:
+                    field.fail("overflow")
+
+        elif field_class is serializers.CharField and len(field.validators) == 2:
+            # only the default validators: null and surrogate characters
+            trim_whitespace = field.trim_whitespace
+
+            def to_internal_value(value: Any) -> Any:
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    field.fail("invalid")
+                value = str(value)
+                if trim_whitespace:
+                    value = value.strip()
+                if CHAR_FIELD_PROHIBITED_CHARACTERS_REGEX.search(value):
+                    field.run_validators(value)
+                return value
+
+        else:
+
+            def to_internal_value(value: Any) -> Any:
+                value = field.to_internal_value(value)
+                field.run_validators(value)
+                return value
+
+        return to_internal_value
+
+    def validate(
+        self, row: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+        # returns the validated data and the errors by field, like serializer.errors
+        validated_data = {}
+        errors = {}
+
+        for field_name, validate_field in self.field_validators:
+            try:
+                validated_data[field_name] = validate_field(row.get(field_name, empty))
+            except SkipField:
+                continue
+            except serializers.ValidationError as exc:
+                errors[field_name] = [str(detail) for detail in exc.detail]
+            except DjangoValidationError as exc:
+                errors[field_name] = [str(detail) for detail in get_error_detail(exc)]
+
+        if not errors and self.validate_serializer:
+            try:
+                validated_data = self.validate_serializer(validated_data)
+            except serializers.ValidationError as exc:
+                errors = serializers.as_serializer_error(exc)
+
+        return validated_data, errors
@@ -0,0 +1,62 @@
+from collections import defaultdict
+from typing import Dict, Generic, Hashable, List, Set, Tuple, TypeVar
+
+from django.contrib.gis.geos import GEOSGeometry
+
+from core.utils.tile_math import get_tile_xy
+
+# cells of the grid are web mercator tiles at this zoom (~300m wide at the equator),
+# a detection usually fits in a single cell
+GRID_ZOOM = 17
+
+T = TypeVar("T")
+
+
+class GeometryGridIndex(Generic[T]):
+    # grid hash of geometries keyed by (key, tile x, tile y): a geometry is registered
+    # in every cell its bounding box touches, so a query only tests nearby candidates
+    def __init__(self, zoom: int = GRID_ZOOM):
+        self.zoom = zoom
+        self.items: List[Tuple[GEOSGeometry, T]] = []
+        self.cells: Dict[Tuple[Hashable, int, int], List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get_cells(self, key: Hashable, geometry: GEOSGeometry):
+        xmin, ymin, xmax, ymax = geometry.extent
+        x_min, y_min = get_tile_xy(lon=xmin, lat=ymax, z=self.zoom)
+        x_max, y_max = get_tile_xy(lon=xmax, lat=ymin, z=self.zoom)
+
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                yield key, x, y
+
+    def insert(self, key: Hashable, geometry: GEOSGeometry, item: T):
+        item_index = len(self.items)
+        self.items.append((geometry, item))
+
+        for cell in self.get_cells(key, geometry):
+            self.cells[cell].append(item_index)
+
+    def query(
+        self, key: Hashable, geometry: GEOSGeometry
+    ) -> List[Tuple[GEOSGeometry, T]]:
+        # returns the indexed items with the same key whose geometry intersects the input
+        item_indexes: Set[int] = set()
+
+        for cell in self.get_cells(key, geometry):
+            item_indexes.update(self.cells.get(cell, []))
+
+        prepared_geometry = geometry.prepared
+        candidates = [self.items[item_index] for item_index in sorted(item_indexes)]
+
+        return [
+            (candidate_geometry, item)
+            for candidate_geometry, item in candidates
+            if prepared_geometry.intersects(candidate_geometry)
+        ]
+
+    def clear(self):
+        self.items = []
+        self.cells = defaultdict(list)
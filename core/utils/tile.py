@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import transaction
+
+from core.models.tile import TILE_DEFAULT_ZOOM, Tile
+from core.utils.tile_math import get_tile_xy
+
+TILE_IDS_CACHE_MAX_SIZE = 100000
+
+TileXYZ = Tuple[int, int, int]
+
+# tiles are never deleted nor moved, their ids can be cached for the process lifetime
+_tile_ids_cache: "OrderedDict[TileXYZ, int]" = OrderedDict()
+_tile_ids_cache_lock = threading.Lock()
+
+
+def clear_tile_ids_cache():
+    # for databases that are emptied while the process runs, e.g. between tests
+    with _tile_ids_cache_lock:
+        _tile_ids_cache.clear()
+
+
+def get_tile_xyz(geometry: GEOSGeometry, z: int = TILE_DEFAULT_ZOOM) -> TileXYZ:
+    centroid = geometry.centroid
+    x, y = get_tile_xy(lon=centroid.x, lat=centroid.y, z=z)
+    return x, y, z
+
+
+def _get_cached_tile_ids(tile_xyzs: Iterable[TileXYZ]) -> Dict[TileXYZ, int]:
+    tile_ids_map = {}
+
+    with _tile_ids_cache_lock:
+        for tile_xyz in tile_xyzs:
+            tile_id = _tile_ids_cache.get(tile_xyz)
+
+            if tile_id is not None:
+                _tile_ids_cache.move_to_end(tile_xyz)
+                tile_ids_map[tile_xyz] = tile_id
+
+    return tile_ids_map
+
+
+def _cache_tile_ids(tile_ids_map: Dict[TileXYZ, int]):
+    with _tile_ids_cache_lock:
+        for tile_xyz, tile_id in tile_ids_map.items():
+            _tile_ids_cache[tile_xyz] = tile_id
+            _tile_ids_cache.move_to_end(tile_xyz)
+
+        while len(_tile_ids_cache) > TILE_IDS_CACHE_MAX_SIZE:
+            _tile_ids_cache.popitem(last=False)
+
+
+def _fetch_tile_ids(tile_xyzs: Iterable[TileXYZ]) -> Dict[TileXYZ, int]:
+    tile_xyzs = set(tile_xyzs)
+    tile_ids_map = {}
+
+    for z in {tile_xyz[2] for tile_xyz in tile_xyzs}:
+        tile_xyzs_z = [tile_xyz for tile_xyz in tile_xyzs if tile_xyz[2] == z]
+        tiles = Tile.objects.filter(
+            z=z,
+            x__in={tile_xyz[0] for tile_xyz in tile_xyzs_z},
+            y__in={tile_xyz[1] for tile_xyz in tile_xyzs_z},
+        ).values_list("x", "y", "z", "id")
+
+        for x, y, z, tile_id in tiles:
+            if (x, y, z) in tile_xyzs:
+                tile_ids_map[(x, y, z)] = tile_id
+
+    return tile_ids_map
+
+
+def get_tile_ids(tile_xyzs: Iterable[TileXYZ]) -> Dict[TileXYZ, int]:
+    # returns the ids of the tiles with the given coordinates, missing tiles are created
+    tile_xyzs = set(tile_xyzs)
+    tile_ids_map = _get_cached_tile_ids(tile_xyzs)
+
+    tile_xyzs_not_cached = tile_xyzs - tile_ids_map.keys()
+
+    if not tile_xyzs_not_cached:
+        return tile_ids_map
+
+    tile_ids_map_fetched = _fetch_tile_ids(tile_xyzs_not_cached)
+    tile_xyzs_missing = tile_xyzs_not_cached - tile_ids_map_fetched.keys()
+
+    if tile_xyzs_missing:
+        Tile.objects.bulk_create(
+            [Tile(x=x, y=y, z=z) for x, y, z in tile_xyzs_missing],
+            ignore_conflicts=True,
+        )
+        tile_ids_map_fetched.update(_fetch_tile_ids(tile_xyzs_missing))
+
+    # tiles created in a transaction that is rolled back must not stay in cache
+    transaction.on_commit(lambda: _cache_tile_ids(tile_ids_map_fetched))
+    tile_ids_map.update(tile_ids_map_fetched)
+
+    return tile_ids_map
+
+
+def get_tile_id(geometry: GEOSGeometry, z: int = TILE_DEFAULT_ZOOM) -> int:
+    tile_xyz = get_tile_xyz(geometry=geometry, z=z)
+    return get_tile_ids([tile_xyz])[tile_xyz]
@@ -0,0 +1,78 @@
+import math
+from typing import Iterable, List, Tuple
+
+# same tiling scheme as PostGIS ST_TileEnvelope default bounds (EPSG:3857)
+EARTH_RADIUS = 6378137.0
+WEB_MERCATOR_BOUND = math.pi * EARTH_RADIUS
+WEB_MERCATOR_MAX_LATITUDE = 85.0511287798066
+
+
+def get_web_mercator_coordinates(lon: float, lat: float) -> Tuple[float, float]:
+    lat = max(min(lat, WEB_MERCATOR_MAX_LATITUDE), -WEB_MERCATOR_MAX_LATITUDE)
+
+    mercator_x = EARTH_RADIUS * math.radians(lon)
+    mercator_y = EARTH_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+    return mercator_x, mercator_y
+
+
+def get_tile_size(z: int) -> float:
+    return 2 * WEB_MERCATOR_BOUND / (2**z)
+
+
+def get_tile_xy(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    # x grows eastward and y southward from the top left corner of the world
+    mercator_x, mercator_y = get_web_mercator_coordinates(lon=lon, lat=lat)
+    tile_size = get_tile_size(z)
+    tiles_count = 2**z
+
+    x = math.floor((mercator_x + WEB_MERCATOR_BOUND) / tile_size)
+    y = math.floor((WEB_MERCATOR_BOUND - mercator_y) / tile_size)
+
+    return min(max(x, 0), tiles_count - 1), min(max(y, 0), tiles_count - 1)
+
+
+def get_tile_lon(x: int, z: int) -> float:
+    # longitude of the west edge of the tile column x
+    return math.degrees((x * get_tile_size(z) - WEB_MERCATOR_BOUND) / EARTH_RADIUS)
+
+
+def get_tile_lat(y: int, z: int) -> float:
+    # latitude of the north edge of the tile row y
+    return math.degrees(
+        math.atan(math.sinh((WEB_MERCATOR_BOUND - y * get_tile_size(z)) / EARTH_RADIUS))
+    )
+
+
+def get_tile_envelope(x: int, y: int, z: int) -> Tuple[float, float, float, float]:
+    # (xmin, ymin, xmax, ymax) in EPSG:4326, same as ST_Transform(ST_TileEnvelope(z, x, y), 4326)
+    return (
+        get_tile_lon(x=x, z=z),
+        get_tile_lat(y=y + 1, z=z),
+        get_tile_lon(x=x + 1, z=z),
+        get_tile_lat(y=y, z=z),
+    )
+
+
+def get_tile_envelopes(
+    tile_xyzs: Iterable[Tuple[int, int, int]],
+) -> List[Tuple[float, float, float, float]]:
+    # edges only depend on x or y, they are computed once per distinct column and row
+    lons = {}
+    lats = {}
+    envelopes = []
+
+    for x, y, z in tile_xyzs:
+        for x_edge in (x, x + 1):
+            if (x_edge, z) not in lons:
+                lons[(x_edge, z)] = get_tile_lon(x=x_edge, z=z)
+
+        for y_edge in (y, y + 1):
+            if (y_edge, z) not in lats:
+                lats[(y_edge, z)] = get_tile_lat(y=y_edge, z=z)
+
+        envelopes.append(
+            (lons[(x, z)], lats[(y + 1, z)], lons[(x + 1, z)], lats[(y, z)])
+        )
+
+    return envelopes
@@ -0,0 +1,62 @@
+from typing import Iterable, List
+
+from django.db import connection
+
+from core.models.tile_set import TileSet
+from core.utils.cache import bump_cache_version
+
+TILE_SETS_CACHE_VERSION = "tile-sets"
+
+# ~10m, simplified coverages are only used for display
+COVERAGE_SIMPLIFY_TOLERANCE = 0.0001
+
+
+def refresh_tile_sets_coverage_geometry(tile_set_ids: Iterable[int]):
+    tile_set_ids = list(set(tile_set_ids))
+
+    if not tile_set_ids:
+        return
+
+    through = TileSet.geo_zones.through
+    geo_zone_field = through._meta.get_field("geozone")
+    tile_set_field = through._meta.get_field("tileset")
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {TileSet._meta.db_table} AS tile_set
+            SET coverage_geometry = coverage.geometry,
+                coverage_geometry_simplified = ST_SimplifyPreserveTopology(
+                    coverage.geometry, %(tolerance)s
+                )
+            FROM (
+                SELECT
+                    tile_set.id AS tile_set_id,
+                    (
+                        SELECT ST_Union(geo_zone.geometry)
+                        FROM {through._meta.db_table} AS tile_set_geo_zone
+                        JOIN {geo_zone_field.related_model._meta.db_table} AS geo_zone
+                            ON geo_zone.id = tile_set_geo_zone.{geo_zone_field.column}
+                        WHERE tile_set_geo_zone.{tile_set_field.column} = tile_set.id
+                    ) AS geometry
+                FROM {TileSet._meta.db_table} AS tile_set
+                WHERE tile_set.id = ANY(%(tile_set_ids)s)
+            ) AS coverage
+            WHERE coverage.tile_set_id = tile_set.id
+            """,
+            {"tolerance": COVERAGE_SIMPLIFY_TOLERANCE, "tile_set_ids": tile_set_ids},
+        )
+
+    bump_cache_version(TILE_SETS_CACHE_VERSION)
+
+
+def get_geo_zone_tile_set_ids(geo_zone_ids: Iterable[int]) -> List[int]:
+    return list(
+        TileSet.geo_zones.through.objects.filter(
+            geozone_id__in=list(geo_zone_ids)
+        ).values_list("tileset_id", flat=True)
+    )
+
+
+def invalidate_tile_sets():
+    bump_cache_version(TILE_SETS_CACHE_VERSION)
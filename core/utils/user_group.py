@@ -0,0 +1,74 @@
+from typing import Iterable, List, Optional
+
+from django.contrib.gis.db.models.aggregates import Union
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
+
+from core.models.user_group import UserGroup
+from core.utils.cache import bump_cache_version, get_or_set_versioned
+
+USER_GROUPS_CACHE_VERSION = "user-groups"
+
+
+def get_user_user_groups_cache_version(user_id: int) -> str:
+    return f"user-user-groups:{user_id}"
+
+
+def refresh_user_groups_union_geometry(user_group_ids: Iterable[int]):
+    user_group_ids = list(set(user_group_ids))
+
+    if not user_group_ids:
+        return
+
+    through = UserGroup.geo_zones.through
+    geo_zone_field = through._meta.get_field("geozone")
+    user_group_field = through._meta.get_field("usergroup")
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {UserGroup._meta.db_table} AS user_group
+            SET union_geometry = (
+                SELECT ST_Union(geo_zone.geometry)
+                FROM {through._meta.db_table} AS user_group_geo_zone
+                JOIN {geo_zone_field.related_model._meta.db_table} AS geo_zone
+                    ON geo_zone.id = user_group_geo_zone.{geo_zone_field.column}
+                WHERE user_group_geo_zone.{user_group_field.column} = user_group.id
+            )
+            WHERE user_group.id = ANY(%s)
+            """,
+            [user_group_ids],
+        )
+
+    bump_cache_version(USER_GROUPS_CACHE_VERSION)
+
+
+def get_geo_zone_user_group_ids(geo_zone_ids: Iterable[int]) -> List[int]:
+    return list(
+        UserGroup.geo_zones.through.objects.filter(
+            geozone_id__in=list(geo_zone_ids)
+        ).values_list("usergroup_id", flat=True)
+    )
+
+
+def invalidate_user_groups():
+    bump_cache_version(USER_GROUPS_CACHE_VERSION)
+
+
+def invalidate_user_user_groups(user_id: int):
+    bump_cache_version(get_user_user_groups_cache_version(user_id))
+
+
+def get_user_union_geometry(user) -> Optional[GEOSGeometry]:
+    # union of the geometries of the groups of the user, cached until the user groups
+    # or their geometries change
+    return get_or_set_versioned(
+        key=f"user-union-geometry:{user.id}",
+        version_names=[
+            USER_GROUPS_CACHE_VERSION,
+            get_user_user_groups_cache_version(user.id),
+        ],
+        compute=lambda: UserGroup.objects.filter(user_user_groups__user=user).aggregate(
+            union=Union("union_geometry")
+        )["union"],
+    )
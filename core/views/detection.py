@@ -14,8 +14,9 @@ from core.models.detection_data import (
     DetectionPrescriptionStatus,
     DetectionValidationStatus,
 )
-from rest_framework.status import HTTP_200_OK
-from django.http import HttpResponse
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_403_FORBIDDEN
+from django.http import HttpResponse, StreamingHttpResponse
 from core.models.detection_object import DetectionObject
 from core.models.object_type import ObjectType
 from core.models.tile_set import TileSetType
@@ -28,15 +29,24 @@ from core.serializers.detection import (
     DetectionUpdateSerializer,
 )
 from core.utils.data_permissions import (
-    get_user_group_rights,
+    get_user_group_rights_by_point,
     get_user_object_types_with_status,
     get_user_tile_sets,
 )
 from simple_history.utils import bulk_update_with_history
 from core.utils.filters import ChoiceInFilter, UuidInFilter
+from core.utils.geo import quantize_bbox
+from core.utils.geojson import iter_detections_geojson
+from core.utils.mvt import MVT_CONTENT_TYPE, get_detections_mvt
+from core.utils.tile_math import get_tile_envelope
 from django.contrib.gis.geos import Polygon
 from rest_framework.decorators import action
 
+# below this zoom, tiles would cover too many detections to be computed on the fly
+DETECTION_TILES_MIN_ZOOM = 10
+# above this zoom, tiles are smaller than the precision of the detections
+DETECTION_TILES_MAX_ZOOM = 22
+
 BOOLEAN_CHOICES = (("false", "False"), ("true", "True"), ("null", "Null"))
 INTERFACE_DRAWN_CHOICES = (
     ("ALL", "ALL"),
@@ -148,10 +158,12 @@ class DetectionFilter(FilterSet):
         polygon_requested = Polygon.from_bbox((sw_lng, sw_lat, ne_lng, ne_lat))
         polygon_requested.srid = 4326
 
+        # tile sets are selected with the quantized viewport so that panning the map
+        # reuses cached results, detections are filtered with the requested one
         tile_sets, global_geometry = get_user_tile_sets(
             user=self.request.user,
             filter_tile_set_type__in=[TileSetType.PARTIAL, TileSetType.BACKGROUND],
-            filter_tile_set_intersects_geometry=polygon_requested,
+            filter_tile_set_intersects_geometry=quantize_bbox(polygon_requested),
             filter_tile_set_uuid__in=tile_sets_uuids,
         )
 
@@ -250,9 +262,24 @@ class DetectionViewSet(BaseViewSetMixin[Detection]):
 
         points = [detection.geometry.centroid for detection in detections]
 
-        get_user_group_rights(
-            user=request.user, points=points, raise_if_has_no_right=UserGroupRight.WRITE
+        # each detection must be writable, possibly through different groups
+        rights_by_point = get_user_group_rights_by_point(
+            user=request.user, points=points
         )
+        forbidden_uuids = [
+            str(detection.uuid)
+            for detection, rights in zip(detections, rights_by_point)
+            if UserGroupRight.WRITE not in rights
+        ]
+
+        if forbidden_uuids:
+            return Response(
+                {
+                    "detail": "Vous n'avez pas les droits pour éditer ces détections",
+                    "uuids": forbidden_uuids,
+                },
+                status=HTTP_403_FORBIDDEN,
+            )
 
         detection_data_fields_to_update = []
 
@@ -318,6 +345,50 @@ class DetectionViewSet(BaseViewSetMixin[Detection]):
 
         return DetectionDetailSerializer
 
+    def list(self, request, *args, **kwargs):
+        # without pagination, minimal detections are streamed as GeoJSON built by the
+        # database instead of being serialized one by one
+        if (
+            self.get_serializer_class() is DetectionMinimalSerializer
+            and (self.paginator is None or self.paginator.get_limit(request) is None)
+            and request.accepted_renderer.format == "json"
+        ):
+            detections = self.filter_queryset(self.get_queryset())
+            return StreamingHttpResponse(
+                iter_detections_geojson(detections), content_type="application/json"
+            )
+
+        return super().list(request, *args, **kwargs)
+
+    def tiles(self, request, z: int, x: int, y: int):
+        # vector tiles of the detections, filtered like the list with the tile as bounding
+        # box. Mapped in core.urls as routers do not support the .mvt suffix.
+        if z > DETECTION_TILES_MAX_ZOOM:
+            raise BadRequest(f"Tile zoom out of bounds: {z}/{x}/{y}")
+
+        if x >= 2**z or y >= 2**z:
+            raise BadRequest(f"Tile out of bounds: {z}/{x}/{y}")
+
+        if z < DETECTION_TILES_MIN_ZOOM:
+            return HttpResponse(b"", content_type=MVT_CONTENT_TYPE)
+
+        xmin, ymin, xmax, ymax = get_tile_envelope(x=x, y=y, z=z)
+
+        data = request.GET.copy()
+        data["swLng"] = str(xmin)
+        data["swLat"] = str(ymin)
+        data["neLng"] = str(xmax)
+        data["neLat"] = str(ymax)
+
+        detections = self.filterset_class(
+            data, queryset=self.get_queryset(), request=request
+        ).qs
+
+        return HttpResponse(
+            get_detections_mvt(detections, z=z, x=x, y=y),
+            content_type=MVT_CONTENT_TYPE,
+        )
+
     def get_queryset(self):
         queryset = Detection.objects.order_by("tile_set__date", "id")
         queryset = queryset.prefetch_related(
@@ -16,7 +16,7 @@ from core.serializers.object_type import ObjectTypeSerializer
 from core.serializers.tile_set import TileSetMinimalSerializer
 from django.contrib.gis.geos import GEOSGeometry
 
-from django.contrib.gis.db.models.aggregates import Union
+from django.db.models import F
 
 from core.utils.data_permissions import (
     get_user_object_types_with_status,
@@ -35,9 +35,7 @@ class MapSettingsView(APIView):
                 tile_set_status__in=[TileSetStatus.VISIBLE, TileSetStatus.HIDDEN]
             ).order_by(*TILE_SETS_ORDER_BYS)
 
-            tile_sets = tile_sets.annotate(
-                intersection=Union("geo_zones__geometry")
-            ).all()
+            tile_sets = tile_sets.annotate(intersection=F("coverage_geometry")).all()
 
             for tile_set in tile_sets:
                 setting_tile_set = MapSettingTileSetSerializer(
@@ -53,8 +53,7 @@ class StatisticsValidationStatusEvolutionView(APIView):
             filter_tile_set_type__in=[TileSetType.PARTIAL, TileSetType.BACKGROUND],
             order_bys=["-date"],
         )
-        tile_sets_queried = tile_sets.all()
-        tile_sets_queried_uuids = [tile_set.uuid for tile_set in tile_sets_queried]
+        tile_sets_queried_uuids = [tile_set.uuid for tile_set in tile_sets]
 
         if (
             endpoint_serializer.validated_data.get("communesUuids")